@@ -0,0 +1,238 @@
+# Approximate nearest-neighbour (IVF) index for large face galleries
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _sq_distances(queries, points, points_sq=None):
+    # (M, D) x (N, D) -> (M, N) squared euclidean distances
+    if points_sq is None:
+        points_sq = np.einsum('ij,ij->i', points, points)
+    q_sq = np.einsum('ij,ij->i', queries, queries)
+    d2 = q_sq[:, None] + points_sq[None, :] - 2.0 * (queries @ points.T)
+    return np.maximum(d2, 0.0, out=d2)
+
+
+def _assign(points, centroids, chunk=8192):
+    # Index of the nearest centroid for every point, in chunks to bound memory
+    labels = np.empty(points.shape[0], dtype=np.int64)
+    c_sq = np.einsum('ij,ij->i', centroids, centroids)
+    for start in range(0, points.shape[0], chunk):
+        d2 = _sq_distances(points[start:start + chunk], centroids, c_sq)
+        labels[start:start + chunk] = d2.argmin(axis=1)
+    return labels
+
+
+def kmeans(points, n_clusters, n_iter=20, sample_size=256, seed=0):
+    # Plain Lloyd's k-means, trained on at most sample_size points per cluster
+    rng = np.random.default_rng(seed)
+    n = points.shape[0]
+    if n > n_clusters * sample_size:
+        points = points[rng.choice(n, n_clusters * sample_size, replace=False)]
+        n = points.shape[0]
+    centroids = points[rng.choice(n, n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(points, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        counts = np.bincount(labels, minlength=n_clusters)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters on random points so every list stays usable
+        if empty.any():
+            centroids[empty] = points[rng.choice(n, int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    # Inverted file index: rows are bucketed by their nearest coarse centroid and a
+    # query only scans the n_probe closest buckets. n_probe is the recall/latency knob,
+    # n_probe >= n_lists is an exact search.
+
+    def __init__(self, n_lists=None, n_probe=8, storage='float32', seed=0):
+        if storage not in ('float32', 'int8'):
+            raise ValueError(f"Unknown storage '{storage}', expected 'float32' or 'int8'")
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.storage = storage
+        self.seed = seed
+        self.dim = None
+        self.centroids = None
+        self.scale = None
+        self._list_ids = []
+        self._list_codes = []
+        self._list_sq = []
+
+    def __len__(self):
+        return int(sum(len(ids) for ids in self._list_ids))
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _encode(self, features):
+        if self.storage == 'int8':
+            return np.clip(np.rint(features / self.scale), -127, 127).astype(np.int8)
+        return features.astype(np.float32, copy=False)
+
+    def _decode(self, codes):
+        if self.storage == 'int8':
+            return codes.astype(np.float32) * self.scale
+        return codes
+
+    def build(self, features, ids=None):
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        n, self.dim = features.shape
+        if ids is None:
+            ids = np.arange(n, dtype=np.int64)
+        if self.n_lists is None:
+            # Usual IVF rule of thumb: about 4 * sqrt(N) lists
+            self.n_lists = int(max(1, min(n, round(4 * np.sqrt(n)))))
+        self.n_lists = min(self.n_lists, n)
+        logger.info("Building IVF index: %d rows, %d lists, %s storage", n, self.n_lists, self.storage)
+
+        self.centroids = kmeans(features, self.n_lists, seed=self.seed).astype(np.float32)
+        # Symmetric per-dimension int8 scale
+        self.scale = np.maximum(np.abs(features).max(axis=0), 1e-12).astype(np.float32) / 127.0
+
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self._list_codes = [np.empty((0, self.dim), dtype=self._encode(features[:0]).dtype)
+                            for _ in range(self.n_lists)]
+        self._list_sq = [np.empty(0, dtype=np.float32) for _ in range(self.n_lists)]
+        self.add(features, ids)
+        return self
+
+    def add(self, features, ids):
+        features = np.ascontiguousarray(features, dtype=np.float32).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = _assign(features, self.centroids)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(self.n_lists + 1))
+        for list_no in range(self.n_lists):
+            rows = order[bounds[list_no]:bounds[list_no + 1]]
+            if len(rows) == 0:
+                continue
+            codes = self._encode(features[rows])
+            decoded = self._decode(codes)
+            self._list_ids[list_no] = np.concatenate([self._list_ids[list_no], ids[rows]])
+            self._list_codes[list_no] = np.concatenate([self._list_codes[list_no], codes])
+            self._list_sq[list_no] = np.concatenate(
+                [self._list_sq[list_no], np.einsum('ij,ij->i', decoded, decoded)])
+
+    def copy(self):
+        # add() and remove() replace list arrays instead of modifying them, so the copy
+        # can share them; only the per-list containers are duplicated
+        index = IVFIndex(self.n_lists, self.n_probe, self.storage, self.seed)
+        index.dim = self.dim
+        index.centroids = self.centroids
+        index.scale = self.scale
+        index._list_ids = list(self._list_ids)
+        index._list_codes = list(self._list_codes)
+        index._list_sq = list(self._list_sq)
+        return index
+
+    def remove(self, ids, renumber=True):
+        # Drop rows by id. With renumber, ids above a removed one shift down so they
+        # keep matching row numbers of a gallery with those rows deleted.
+        removed = np.unique(np.asarray(ids, dtype=np.int64))
+        if len(removed) == 0:
+            return
+        for list_no in range(self.n_lists):
+            list_ids = self._list_ids[list_no]
+            keep = ~np.isin(list_ids, removed)
+            if not keep.all():
+                list_ids = list_ids[keep]
+                self._list_codes[list_no] = self._list_codes[list_no][keep]
+                self._list_sq[list_no] = self._list_sq[list_no][keep]
+            if renumber:
+                list_ids = list_ids - np.searchsorted(removed, list_ids)
+            self._list_ids[list_no] = list_ids
+
+    def search(self, queries, k=1, n_probe=None):
+        # Return (ids, distances) of shape (M, k), nearest first; missing hits are -1 / inf
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        m = queries.shape[0]
+        out_ids = np.full((m, k), -1, dtype=np.int64)
+        out_dist = np.full((m, k), np.inf, dtype=np.float32)
+        if m == 0:
+            return out_ids, out_dist
+
+        coarse = _sq_distances(queries, self.centroids)
+        if n_probe < self.n_lists:
+            probes = np.argpartition(coarse, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probes = np.tile(np.arange(self.n_lists), (m, 1))
+
+        for qi in range(m):
+            lists = [l for l in probes[qi] if len(self._list_ids[l])]
+            if not lists:
+                continue
+            cand_ids = np.concatenate([self._list_ids[l] for l in lists])
+            cand = self._decode(np.concatenate([self._list_codes[l] for l in lists]))
+            cand_sq = np.concatenate([self._list_sq[l] for l in lists])
+            d2 = _sq_distances(queries[qi:qi + 1], cand, cand_sq)[0]
+            kk = min(k, len(cand_ids))
+            top = np.argpartition(d2, kk - 1)[:kk] if kk < len(cand_ids) else np.arange(kk)
+            top = top[np.argsort(d2[top])]
+            out_ids[qi, :kk] = cand_ids[top]
+            out_dist[qi, :kk] = np.sqrt(d2[top])
+        return out_ids, out_dist
+
+    def save(self, path):
+        sizes = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+        np.savez(path,
+                 version=np.array(1),
+                 storage=np.array(self.storage),
+                 n_probe=np.array(self.n_probe),
+                 centroids=self.centroids,
+                 scale=self.scale,
+                 sizes=sizes,
+                 ids=np.concatenate(self._list_ids),
+                 codes=np.concatenate(self._list_codes),
+                 sq=np.concatenate(self._list_sq))
+        logger.info("Saved IVF index (%d rows) to %s", len(self), path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(n_lists=data['centroids'].shape[0], n_probe=int(data['n_probe']),
+                        storage=str(data['storage']))
+            index.centroids = data['centroids']
+            index.scale = data['scale']
+            index.dim = index.centroids.shape[1]
+            bounds = np.concatenate([[0], np.cumsum(data['sizes'])])
+            ids, codes, sq = data['ids'], data['codes'], data['sq']
+            index._list_ids = [ids[bounds[i]:bounds[i + 1]] for i in range(index.n_lists)]
+            index._list_codes = [codes[bounds[i]:bounds[i + 1]] for i in range(index.n_lists)]
+            index._list_sq = [sq[bounds[i]:bounds[i + 1]] for i in range(index.n_lists)]
+        return index
+
+
+def main():
+    import argparse
+    from gallery_store import load_known_faces, GALLERY_PATH, CSV_PATH
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build an IVF index for the known-faces gallery")
+    parser.add_argument('--gallery', default=GALLERY_PATH)
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--output', default="data/features_all.ivf.npz")
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--n-probe', type=int, default=8)
+    parser.add_argument('--storage', choices=['float32', 'int8'], default='float32')
+    args = parser.parse_args()
+
+    gallery = load_known_faces(args.gallery, args.csv)
+    if gallery is None:
+        logger.error("No gallery found at %s or %s", args.gallery, args.csv)
+        return
+    _, features = gallery
+    index = IVFIndex(n_lists=args.n_lists, n_probe=args.n_probe, storage=args.storage).build(features)
+    index.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,302 @@
-from flask import Flask, render_template, request
-import sqlite3
-from datetime import datetime
-import pymysql
-
-conn = pymysql.connect(
-    host='SumaiyaBibi.mysql.pythonanywhere-services.com',
-    user='SumaiyaBibi',
-    password='sum@12345678',
-    database='SumaiyaBibi$attendancesystem'
-)
-cursor = conn.cursor()
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+import base64
+import collections
+import gzip
+import hmac
+import io
+import json
+import os
+import threading
+from datetime import datetime, date
+
+from db_pool import ReadPool, WriteConnection
+import exports
+import ingest
+import rollups
 
 app = Flask(__name__)
 
+# Read-only SQLite connections, opened on first use in each worker process
+db_pool = ReadPool(os.environ.get("ATTENDANCE_DB", "attendance.db"),
+                   size=int(os.environ.get("ATTENDANCE_DB_POOL_SIZE", "4")))
+
+# Read-write connection for kiosk ingest, also opened lazily per worker process
+db_writer = WriteConnection(os.environ.get("ATTENDANCE_DB", "attendance.db"), setup=ingest.create_tables)
+#  Kiosks must send "Authorization: Bearer <token>" when this is set
+INGEST_TOKEN = os.environ.get("ATTENDANCE_INGEST_TOKEN")
+
+
+class ResponseCache:
+    # Small LRU for query results of days that are over. Kiosks only write today, but
+    # ingest and video_archive.py can fill in the past from any process; they log the
+    # dates in attendance_changes, and entries depending on them are dropped before
+    # the next lookup.
+    def __init__(self, maxsize=512, changes=None):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        # changes(seq) -> rollups.changes_since(); None when nothing can change
+        self.changes = changes
+        self._seq = None
+
+    def _drop_changed(self):
+        if self.changes is None:
+            return None
+        seq, spans = self.changes(self._seq)
+        with self._lock:
+            if self._seq is not None and seq <= self._seq:
+                return self._seq
+            self._seq = seq
+            if spans is None:
+                stale = list(self._items)
+            else:
+                stale = [key for key, (_, (first, last)) in self._items.items()
+                         if any(first <= changed_last and changed_first <= last
+                                for changed_first, changed_last in spans)]
+            for key in stale:
+                del self._items[key]
+            self.invalidated += len(stale)
+            return seq
+
+    def get_or_compute(self, key, cacheable, compute, span):
+        # span is the (first, last) date range the value was computed from
+        if not cacheable:
+            return compute()
+        seq = self._drop_changed()
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            # Not kept when a change was seen while it was being computed
+            if self._seq == seq:
+                self._items[key] = (value, span)
+                if len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return value
+
+
+def attendance_changes(seq):
+    with db_pool.connection() as conn:
+        return rollups.changes_since(conn, seq)
+
+
+response_cache = ResponseCache(changes=attendance_changes)
+
+
+def is_past(day):
+    return day < date.today().strftime('%Y-%m-%d')
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def parse_month(value):
+    # "2024-09" or any date in the month -> "2024-09"
+    if len(value) == 7:
+        return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+    return parse_date(value)[:7]
+
+
+def encode_cursor(day, name):
+    return base64.urlsafe_b64encode(json.dumps([day, name]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    day, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return str(day), str(name)
+
+
+def query_day(formatted_date):
+    with db_pool.connection() as conn:
+        return conn.execute("SELECT name, time FROM attendance WHERE date = ? ORDER BY name",
+                            (formatted_date,)).fetchall()
+
+
 @app.route('/')
 def index():
     return render_template('index.html', selected_date='', no_data=False)
 
+
 @app.route('/attendance', methods=['POST'])
 def attendance():
     selected_date = request.form.get('selected_date')
-    selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d')
-    formatted_date = selected_date_obj.strftime('%Y-%m-%d')
-
-    conn = sqlite3.connect('attendance.db')
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT name, time FROM attendance WHERE date = ?", (formatted_date,))
-    attendance_data = cursor.fetchall()
+    formatted_date = parse_date(selected_date)
 
-    conn.close()
+    attendance_data = response_cache.get_or_compute(
+        ("day", formatted_date), is_past(formatted_date), lambda: query_day(formatted_date),
+        (formatted_date, formatted_date))
 
     if not attendance_data:
         return render_template('index.html', selected_date=selected_date, no_data=True)
     
     return render_template('index.html', selected_date=selected_date, attendance_data=attendance_data)
 
+
+@app.route('/api/attendance')
+def api_attendance():
+    # JSON rows for a date range, ordered by (date, name) and paged by keyset:
+    #   /api/attendance?from=2024-01-01&to=2024-01-31&limit=500&cursor=<next_cursor>
+    try:
+        from_date = parse_date(request.args.get('from') or request.args['to'])
+        to_date = parse_date(request.args.get('to') or from_date)
+        limit = max(1, min(int(request.args.get('limit', 500)), 5000))
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except (KeyError, ValueError, TypeError):
+        return jsonify(error="expected from/to as YYYY-MM-DD, an integer limit and a valid cursor"), 400
+
+    def compute():
+        sql = "SELECT date, name, time FROM attendance WHERE date BETWEEN ? AND ?"
+        params = [from_date, to_date]
+        if after:
+            sql += " AND (date, name) > (?, ?)"
+            params += list(after)
+        sql += " ORDER BY date, name LIMIT ?"
+        params.append(limit)
+        with db_pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1]) if len(rows) == limit else None
+        return {"rows": [{"date": d, "name": n, "time": t} for d, n, t in rows], "next_cursor": next_cursor}
+
+    page = response_cache.get_or_compute(
+        ("range", from_date, to_date, limit, after), is_past(to_date), compute, (from_date, to_date))
+    return jsonify(page)
+
+
+#  Exports stream from one cursor, whatever the size of the range:
+#    /export/attendance.csv?from=2024-09-01&to=2025-01-31[&name=alice&name=bob]
+#  To resume, or to fetch in pieces with &limit=N, pass the last complete row back as
+#  &after_date=2024-10-07&after_name=alice; rows are ordered by (date, name).
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", exports.csv_chunks),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", exports.xlsx_chunks),
+}
+
+
+@app.route('/export/attendance.<fmt>')
+def export_attendance(fmt):
+    if fmt not in EXPORT_FORMATS:
+        return jsonify(error=f"format must be one of {', '.join(EXPORT_FORMATS)}"), 404
+    try:
+        from_date = parse_date(request.args.get('from') or request.args['to'])
+        to_date = parse_date(request.args.get('to') or from_date)
+        names = request.args.getlist('name')
+        after = None
+        if 'after_date' in request.args:
+            after = (parse_date(request.args['after_date']), request.args.get('after_name', ''))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        if limit is not None and limit < 1:
+            raise ValueError
+    except (KeyError, ValueError):
+        return jsonify(error="expected from/to and after_date as YYYY-MM-DD and a positive integer limit"), 400
+    mimetype, encode = EXPORT_FORMATS[fmt]
+    # A resumed CSV is appended to what the client has, so it gets no second header
+    options = {"header": after is None} if fmt == "csv" else {}
+
+    def generate():
+        # The pooled connection is held only while this response streams
+        with db_pool.connection() as conn:
+            yield from encode(exports.query_rows(conn, from_date, to_date, names, after, limit), **options)
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="attendance_{from_date}_{to_date}.{fmt}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@app.route('/api/ingest', methods=['POST'])
+def api_ingest():
+    # One batch of recognition events from a kiosk, optionally gzip-compressed:
+    #   {"kiosk_id": "door-1", "batch_id": "<uuid>",
+    #    "events": [{"name": "alice", "time": "2024-09-03T08:41:07", "distance": 0.31}, ...]}
+    # Replaying a batch_id returns the first result with "duplicate": true.
+    if INGEST_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {INGEST_TOKEN}"):
+        return jsonify(error="unauthorized"), 401
+    if (request.content_length or 0) > ingest.MAX_BATCH_BYTES:
+        return jsonify(error=f"batch larger than {ingest.MAX_BATCH_BYTES} bytes"), 413
+    body = request.get_data(cache=False)
+    try:
+        if request.headers.get("Content-Encoding", "").lower() == "gzip":
+            with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                body = f.read(ingest.MAX_BATCH_BYTES + 1)
+        if len(body) > ingest.MAX_BATCH_BYTES:
+            return jsonify(error=f"batch larger than {ingest.MAX_BATCH_BYTES} bytes"), 413
+        kiosk_id, batch_id, events = ingest.parse_batch(json.loads(body))
+    except (OSError, EOFError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    with db_writer.connection() as conn:
+        result = ingest.apply_batch(conn, kiosk_id, batch_id, events)
+    return jsonify(result)
+
+
+#  Reports read only the rollup tables that AttendanceStore keeps up to date
+
+def report(compute, cache_key, cacheable, span):
+    with db_pool.connection() as conn:
+        built = rollups.is_built(conn)
+    if not built:
+        return jsonify(error="attendance rollups are not built yet, run 'python rollups.py backfill'"), 503
+
+    def run():
+        with db_pool.connection() as conn:
+            return compute(conn)
+
+    return jsonify(response_cache.get_or_compute(cache_key, cacheable, run, span))
+
+
+@app.route('/api/reports/daily')
+def api_report_daily():
+    # Headcount, late arrivals and first/last arrival per day:
+    #   /api/reports/daily?from=2024-09-01&to=2024-12-20
+    try:
+        from_date = parse_date(request.args.get('from') or request.args['to'])
+        to_date = parse_date(request.args.get('to') or from_date)
+    except (KeyError, ValueError):
+        return jsonify(error="expected from/to as YYYY-MM-DD"), 400
+    return report(lambda conn: {"days": rollups.daily_report(conn, from_date, to_date)},
+                  ("report_daily", from_date, to_date), is_past(to_date), (from_date, to_date))
+
+
+@app.route('/api/reports/people')
+def api_report_people():
+    # Per-person days present, attendance rate and late days over a term of whole months:
+    #   /api/reports/people?from=2024-09&to=2024-12
+    try:
+        from_month = parse_month(request.args.get('from') or request.args['to'])
+        to_month = parse_month(request.args.get('to') or from_month)
+    except (KeyError, ValueError):
+        return jsonify(error="expected from/to as YYYY-MM"), 400
+
+    def compute(conn):
+        class_days, people = rollups.people_report(conn, from_month, to_month)
+        return {"from": from_month, "to": to_month, "class_days": class_days, "people": people}
+
+    return report(compute, ("report_people", from_month, to_month), to_month < date.today().strftime('%Y-%m'),
+                  (from_month + "-01", to_month + "-31"))
+
+
+@app.route('/api/reports/people/<name>')
+def api_report_person(name):
+    # One person's month-by-month attendance:
+    #   /api/reports/people/alice?from=2024-09&to=2024-12
+    try:
+        from_month = parse_month(request.args.get('from', '0001-01'))
+        to_month = parse_month(request.args.get('to', '9999-12'))
+    except ValueError:
+        return jsonify(error="expected from/to as YYYY-MM"), 400
+    return report(lambda conn: {"name": name, "months": rollups.person_report(conn, name, from_month, to_month)},
+                  ("report_person", name, from_month, to_month), to_month < date.today().strftime('%Y-%m'),
+                  (from_month + "-01", to_month + "-31"))
+
+
 if __name__ == '__main__':
     app.run(debug=True)
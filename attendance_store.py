@@ -0,0 +1,183 @@
+# Write-behind attendance store: in-memory (name, date) dedup in front of a single
+# long-lived SQLite connection flushed by a background writer thread
+
+import atexit
+import datetime
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import DISABLED
+import rollups
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "attendance.db"
+#  Attempts at committing a batch while the database is locked or busy, with the wait
+#  doubling from WRITE_BACKOFF seconds between them
+WRITE_ATTEMPTS = 4
+WRITE_BACKOFF = 0.25
+#  A batch that still failed is written again after this many seconds, doubled on
+#  every consecutive failure, so marks are not lost while a person stays tracked
+RETRY_BACKOFF = 5.0
+MAX_RETRY_BACKOFF = 300.0
+
+_STOP = object()
+
+
+def connect(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    # WAL lets the viewer read while the kiosk writes; NORMAL sync is safe under WAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # One transaction, so a new database is created with its rollups marked as built
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''CREATE TABLE IF NOT EXISTS attendance
+                        (name TEXT, time TEXT, date DATE,
+                        UNIQUE(name, date))''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date_name ON attendance(date, name)")
+        rollups.create_tables(conn)
+        rollups.mark_built_if_empty(conn)
+    return conn
+
+
+class AttendanceStore:
+    def __init__(self, db_path=DB_PATH, flush_interval=0.5, batch_size=256, metrics=None):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.conn = connect(db_path)
+
+        # (name, date) pairs already present, preloaded for today
+        self._marked = set()
+        self._day = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        # Rows of failed batches, only touched by the writer thread
+        self._retry_rows = []
+        self._retry_at = 0.0
+        self._retry_delay = RETRY_BACKOFF
+
+        self.db_hits_avoided = 0
+        self.rows_written = 0
+        self.batches_written = 0
+        self.metrics = metrics if metrics is not None else DISABLED
+
+        self._load_day(datetime.date.today().strftime('%Y-%m-%d'))
+        if not rollups.is_built(self.conn):
+            logger.warning("Attendance rollups were never built, run 'python rollups.py backfill' for reports")
+        self._writer = threading.Thread(target=self._write_loop, name="attendance-writer", daemon=True)
+        self._writer.start()
+        # Pending marks are flushed even if the caller never closes the store
+        atexit.register(self.close)
+
+    def _load_day(self, day):
+        # Called with the lock held (or before the writer starts)
+        rows = self.conn.execute("SELECT name FROM attendance WHERE date = ?", (day,)).fetchall()
+        self._marked = {(name, day) for (name,) in rows}
+        self._day = day
+        logger.info("Attendance store ready, %d already marked for %s", len(rows), day)
+
+    def is_marked(self, name, day=None):
+        return (name, day or datetime.date.today().strftime('%Y-%m-%d')) in self._marked
+
+    def mark(self, name, when=None):
+        # Queue name for today unless already marked; returns (date, time) for a new
+        # mark and None otherwise. Never touches the database on the caller's thread.
+        when = when or datetime.datetime.now()
+        current_date = when.strftime('%Y-%m-%d')
+        current_time = when.strftime('%H:%M:%S')
+        key = (name, current_date)
+        with self._lock:
+            if current_date > self._day:
+                # New day: yesterday's pairs can never match again
+                self._marked = set()
+                self._day = current_date
+            if key in self._marked:
+                self.db_hits_avoided += 1
+                return None
+            self._marked.add(key)
+        self._queue.put((name, current_time, current_date))
+        return current_date, current_time
+
+    def _write_loop(self):
+        while True:
+            timeout = max(0.0, self._retry_at - time.monotonic()) if self._retry_rows else None
+            try:
+                item = self._queue.get(timeout=timeout)
+                batch = [item]
+            except queue.Empty:
+                batch = []
+            # Collect whatever else arrives within flush_interval, up to batch_size
+            try:
+                while batch and len(batch) < self.batch_size and item is not _STOP:
+                    item = self._queue.get(timeout=self.flush_interval)
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            rows = [row for row in batch if row is not _STOP]
+            if self._retry_rows and (_STOP in batch or time.monotonic() >= self._retry_at):
+                rows = self._retry_rows + rows
+                self._retry_rows = []
+            if rows:
+                self._write(rows)
+            for _ in batch:
+                self._queue.task_done()
+            if _STOP in batch:
+                if self._retry_rows:
+                    logger.error(f"{len(self._retry_rows)} attendance rows could not be written")
+                return
+
+    def _write(self, rows):
+        delay = WRITE_BACKOFF
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                start = time.perf_counter()
+                with self.conn:
+                    # Only rows that were new reach the reporting rollups, in the same commit
+                    rollups.insert_attendance(self.conn, rows)
+                self.metrics.observe("db_commit", time.perf_counter() - start)
+                self.metrics.inc("db_rows_written", len(rows))
+                self.rows_written += len(rows)
+                self.batches_written += 1
+                self._retry_delay = RETRY_BACKOFF
+                return
+            except sqlite3.OperationalError as e:
+                # "database is locked" and the like usually clear up
+                if attempt == WRITE_ATTEMPTS:
+                    error = e
+                    break
+                logger.warning("Attendance batch not committed (%s), retrying in %.2fs", e, delay)
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                error = e
+                break
+        logger.error(f"Error writing attendance batch, retrying in {self._retry_delay:.1f}s: {error}")
+        self.metrics.inc("db_write_failures")
+        # The marks stay in _marked and the rows are written again later; a tracked
+        # person is not marked again, so waiting for a new sighting could lose them
+        self._retry_rows = rows
+        self._retry_at = time.monotonic() + self._retry_delay
+        self._retry_delay = min(MAX_RETRY_BACKOFF, self._retry_delay * 2)
+
+    def flush(self):
+        # Block until everything queued so far is committed
+        self._queue.join()
+
+    def close(self):
+        if not self._writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self.conn.close()
+        logger.info("Attendance store closed: %d rows in %d batches, %d DB hits avoided",
+                    self.rows_written, self.batches_written, self.db_hits_avoided)
+
+    def stats(self):
+        return {"rows_written": self.rows_written, "batches_written": self.batches_written,
+                "db_hits_avoided": self.db_hits_avoided,
+                "pending": self._queue.qsize() + len(self._retry_rows)}
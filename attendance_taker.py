@@ -1,28 +1,29 @@
-import dlib
-import numpy as np
 import cv2
-import os
-import pandas as pd
 import time
 import logging
-import sqlite3
 import datetime
 import tkinter as tk
 from tkinter import font as tkFont
-from PIL import Image, ImageTk
 import getpass
 
+from gallery_watcher import GalleryWatcher, load_matcher
+from pipeline import FramePipeline
+from attendance_store import AttendanceStore
+from recognition_engine import RecognitionEngine, prepare_frame
+from metrics import metrics_from_env, process_rss_mb
+from kiosk_client import client_from_env
+from preview import PreviewRenderer, draw_overlays
+from model_registry import registry
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Dlib face detector and models
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor('data/data_dlib/shape_predictor_68_face_landmarks.dat')
-face_reco_model = dlib.face_recognition_model_v1("data/data_dlib/dlib_face_recognition_resnet_model_v1.dat")
-
 class AttendanceSystem:
     def __init__(self):
+        # Dlib models load in the background while the window and camera come up
+        registry.warm_up()
+
         # Initialize Tkinter window
         self.win = tk.Tk()
         self.win.title("Smart Attendance System")
@@ -40,6 +41,9 @@ class AttendanceSystem:
         self.camera_label = tk.Label(self.frame_left_camera)
         self.camera_label.pack(padx=10, pady=10)
         self.frame_left_camera.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # Persistent preview image, refreshed at most PREVIEW_FPS times a second
+        self.preview = PreviewRenderer(self.camera_label)
+        self.preview.watch_visibility(self.win)
 
         # Info Panel (Right)
         self.frame_right_info = tk.Frame(self.main_container)
@@ -53,20 +57,49 @@ class AttendanceSystem:
             exit()
 
         # Initialize face recognition variables
-        self.face_features_known_list = []
-        self.face_name_known_list = []
         self.current_frame = None
         self.fps_show = 0
+        self.frames_rendered = 0
         self.start_time = time.time()
 
+        # Stage timings and counters, off unless ATTENDANCE_METRICS_PORT / _LOG is set
+        self.metrics, self.metrics_exporters = metrics_from_env()
+
         # Setup database
         self.setup_database()
+        # Marks are also sent to a central viewer when ATTENDANCE_INGEST_URL is set
+        self.ingest = client_from_env()
+        # GUI-free recognition engine; this window is just one consumer of its results
+        self.engine = RecognitionEngine(*registry.models(), store=self.store, metrics=self.metrics,
+                                        events=self.ingest)
         # Load known faces
         self.load_known_faces()
+        # Newly enrolled people are picked up while running (file change or kill -HUP)
+        self.gallery_watcher = GalleryWatcher(self.engine).start()
+        self.gallery_watcher.install_signal_handler()
+
+        # Capture and recognition run on their own threads, the Tk loop only renders
+        self.pipeline = FramePipeline(self.get_frame, self.engine.process, workers=1,
+                                      events=lambda result: result["marked"])
+        self.last_stats_time = 0
+        self.win.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Start clock update
         self.update_clock()
 
+    @property
+    def matcher(self):
+        return self.engine.matcher
+
+    # Known faces are kept in the matcher; these are views over its gallery
+    @property
+    def face_features_known_list(self):
+        return self.matcher.features
+
+    @property
+    def face_name_known_list(self):
+        return self.matcher.names
+
     def setup_header(self):
         header_frame = tk.Frame(self.win)
         header_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -108,6 +141,11 @@ class AttendanceSystem:
         self.label_face_count = tk.Label(stats_frame, text="0")
         self.label_face_count.grid(row=1, column=1, sticky="w")
 
+        # Per-stage latency and queue depth of the pipeline
+        tk.Label(stats_frame, text="Pipeline: ").grid(row=2, column=0, sticky="nw")
+        self.label_pipeline = tk.Label(stats_frame, text="", justify=tk.LEFT)
+        self.label_pipeline.grid(row=2, column=1, sticky="w")
+
         # Attendance Log
         log_frame = tk.Frame(self.frame_right_info)
         log_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -165,135 +203,157 @@ class AttendanceSystem:
         return None
 
     def setup_database(self):
+        self.store = None
         try:
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
-            cursor.execute('''CREATE TABLE IF NOT EXISTS attendance
-                            (name TEXT, time TEXT, date DATE, 
-                            UNIQUE(name, date))''')
-            conn.commit()
-            conn.close()
+            self.store = AttendanceStore("attendance.db", metrics=self.metrics)
             logger.info("Database setup complete")
         except Exception as e:
             logger.error(f"Database setup failed: {e}")
 
     def load_known_faces(self):
         try:
-            if os.path.exists("data/features_all.csv"):
-                csv_rd = pd.read_csv("data/features_all.csv", header=None)
-                for i in range(csv_rd.shape[0]):
-                    self.face_name_known_list.append(csv_rd.iloc[i][0])
-                    features = [float(x) for x in csv_rd.iloc[i][1:129] if x != '']
-                    self.face_features_known_list.append(features)
+            # Also picks up the optional ANN index built by `python ann_index.py`
+            matcher = load_matcher()
+            if matcher is not None:
+                self.engine.matcher = matcher
                 logger.info(f"Loaded {len(self.face_features_known_list)} faces")
             else:
-                logger.warning("features_all.csv not found!")
+                logger.warning("features_all.gallery / features_all.csv not found!")
         except Exception as e:
             logger.error(f"Error loading faces: {e}")
 
-    def mark_attendance(self, name):
-        try:
-            current_date = datetime.datetime.now().strftime('%Y-%m-%d')
-            current_time = datetime.datetime.now().strftime('%H:%M:%S')
-            
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM attendance WHERE name=? AND date=?", 
-                         (name, current_date))
-            
-            if not cursor.fetchone():
-                cursor.execute("INSERT INTO attendance VALUES (?, ?, ?)",
-                             (name, current_time, current_date))
-                conn.commit()
-                log_message = f"[{current_time}] {name} marked present\n"
-                self.attendance_log.insert(tk.END, log_message)
-                self.attendance_log.see(tk.END)
-            
-            conn.close()
-        except Exception as e:
-            logger.error(f"Error marking attendance: {e}")
-
     def get_frame(self):
         if not self.cap or not self.cap.isOpened():
             logger.error("Camera is not opened!")
             return None, None
 
         try:
-            ret, frame = self.cap.read()
+            with self.metrics.timer("capture"):
+                ret, frame = self.cap.read()
             if not ret or frame is None or frame.size == 0:
                 logger.warning("Failed to capture frame")
                 return None, None
 
-            if frame.shape[0] > 0 and frame.shape[1] > 0:
-                if len(frame.shape) == 2:
-                    frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-                
-                frame = cv2.resize(frame, (640, 480))
-                return ret, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            else:
+            with self.metrics.timer("convert"):
+                frame = prepare_frame(frame)
+            if frame is None:
                 logger.warning("Invalid frame dimensions")
                 return None, None
+            return ret, frame
 
         except Exception as e:
             logger.error(f"Error capturing frame: {e}")
             return None, None
 
     def update_fps(self):
+        # Frames rendered since the last update over the time that took, rather than
+        # 1/dt of a single frame
         now = time.time()
-        self.fps_show = 1.0 / (now - self.start_time)
+        if now > self.start_time:
+            self.fps_show = self.frames_rendered / (now - self.start_time)
+        self.frames_rendered = 0
         self.start_time = now
         self.label_fps.configure(text=f"{self.fps_show:.2f}")
+        self.metrics.set_gauge("fps", round(self.fps_show, 2))
+
+    # Marks come through their own queue, so ones from results dropped before they
+    # were rendered still reach the log
+    def log_marks(self):
+        for name, _, current_time in self.pipeline.get_events():
+            self.attendance_log.insert(tk.END, f"[{current_time}] {name} marked present\n")
+            self.attendance_log.see(tk.END)
+
+    # Render stage, runs on the Tk thread. Every result updates the counters; the
+    # preview only redraws when it is visible and due.
+    def render(self, result):
+        self.label_face_count.configure(text=str(result["face_count"]))
+
+        self.frames_rendered += 1
+        if not self.preview.due():
+            return
+        try:
+            frame = result["frame"]
+            draw_overlays(frame, result["boxes"], result["names"])
+            self.preview.show(frame)
+        except Exception as e:
+            logger.error(f"Error updating display: {e}")
+
+    def update_pipeline_stats(self):
+        self.update_fps()
+        snap = self.pipeline.snapshot()
+        self.metrics.set_gauge("frame_queue_depth", snap["capture"]["queue_depth"])
+        self.metrics.set_gauge("frames_dropped", snap["capture"]["dropped"])
+        self.metrics.set_gauge("results_dropped", snap["process"]["dropped"])
+        lines = []
+        for stage in ("capture", "process", "render", "end_to_end"):
+            line = f"{stage}: {snap[stage]['avg_ms']:.1f} ms"
+            if "queue_depth" in snap[stage]:
+                line += f", q={snap[stage]['queue_depth']}, dropped={snap[stage]['dropped']}"
+            lines.append(line)
+        tracker = self.engine.tracker
+        lines.append(f"descriptors: {tracker.descriptors_computed} computed, "
+                     f"{tracker.descriptors_skipped} skipped")
+        quality = self.engine.quality.snapshot()
+        if quality["descriptors_saved"]:
+            reasons = ", ".join(f"{reason} {n}" for reason, n in quality["rejected"].items() if n)
+            lines.append(f"quality gate: {quality['descriptors_saved']} descriptors saved ({reasons})")
+        if self.store is not None:
+            db = self.store.stats()
+            lines.append(f"db: {db['rows_written']} written, {db['db_hits_avoided']} hits avoided, "
+                         f"{db['pending']} pending")
+        if self.ingest is not None:
+            sent = self.ingest.stats()
+            self.metrics.set_gauge("ingest_outbox_pending", sent["pending"])
+            lines.append(f"ingest: {sent['events_sent']} sent, {sent['pending']} in outbox, "
+                         f"{sent['failures']} failures")
+        preview = self.preview.snapshot()
+        rss = process_rss_mb()
+        self.metrics.set_gauge("preview_frames_displayed", preview["displayed"])
+        self.metrics.set_gauge("preview_frames_throttled", preview["throttled"])
+        self.metrics.set_gauge("preview_hidden_skips", preview["hidden_skips"])
+        self.metrics.set_gauge("preview_cpu_ms", preview["cpu_ms"])
+        self.metrics.set_gauge("process_rss_mb", round(rss, 1))
+        lines.append(f"preview: {preview['displayed']} shown, {preview['throttled']} throttled, "
+                     f"{preview['hidden_skips']} hidden, {preview['cpu_ms']:.1f} ms cpu, rss {rss:.0f} MB")
+        self.label_pipeline.configure(text="\n".join(lines))
 
     def process_frame(self):
         try:
-            ret, frame = self.get_frame()
-            if frame is None:
-                self.win.after(100, self.process_frame)
-                return
-
-            faces = detector(frame, 0)
-            self.label_face_count.configure(text=str(len(faces)))
-
-            for face in faces:
-                try:
-                    x1, y1, x2, y2 = face.left(), face.top(), face.right(), face.bottom()
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-                    shape = predictor(frame, face)
-                    face_descriptor = face_reco_model.compute_face_descriptor(frame, shape)
-
-                    if len(self.face_features_known_list) > 0:
-                        distances = [np.linalg.norm(np.array(face_descriptor) - np.array(known_face))
-                                   for known_face in self.face_features_known_list]
-                        min_dist = min(distances)
-                        if min_dist < 0.4:
-                            name = self.face_name_known_list[distances.index(min_dist)]
-                            cv2.putText(frame, name, (x1, y2 + 20), 
-                                      cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                            self.mark_attendance(name)
-                except Exception as e:
-                    logger.error(f"Error processing face: {e}")
-                    continue
-
-            self.update_fps()
-            try:
-                img = Image.fromarray(frame)
-                imgtk = ImageTk.PhotoImage(image=img)
-                self.camera_label.imgtk = imgtk
-                self.camera_label.configure(image=imgtk)
-            except Exception as e:
-                logger.error(f"Error updating display: {e}")
-
+            self.log_marks()
+            result = self.pipeline.get_result()
+            if result is not None:
+                start = time.perf_counter()
+                self.render(result)
+                elapsed = time.perf_counter() - start
+                self.pipeline.record_render(elapsed)
+                self.metrics.observe("render", elapsed)
+
+            if time.time() - self.last_stats_time >= 1.0:
+                self.last_stats_time = time.time()
+                self.update_pipeline_stats()
         except Exception as e:
             logger.error(f"Error in process_frame: {e}")
         finally:
-            self.win.after(20, self.process_frame)
+            self.win.after(10, self.process_frame)
 
     def run(self):
+        self.pipeline.start()
         self.process_frame()
         self.win.mainloop()
 
+    def on_close(self):
+        self.gallery_watcher.stop()
+        self.pipeline.stop()
+        if self.store is not None:
+            self.store.close()
+        if self.ingest is not None:
+            self.ingest.stop()
+        for exporter in self.metrics_exporters:
+            exporter.stop()
+        if self.cap and self.cap.isOpened():
+            self.cap.release()
+        self.win.destroy()
+
     def __del__(self):
         if self.cap and self.cap.isOpened():
             self.cap.release()
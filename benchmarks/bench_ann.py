@@ -0,0 +1,78 @@
+# Benchmark the IVF index against brute-force search on a synthetic face gallery
+#
+#   python benchmarks/bench_ann.py --gallery 50000 --queries 2000 --n-probe 4 8 16
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_matcher import GalleryMatcher, DISTANCE_THRESHOLD, FEATURE_DIM
+
+
+def synthetic_gallery(n, rng, n_groups=64):
+    # Descriptors clustered around a few "demographic" centres, with inter-person
+    # distances around 0.6-0.9 like real dlib descriptors
+    centres = rng.normal(0, 0.06, (n_groups, FEATURE_DIM))
+    groups = rng.integers(0, n_groups, n)
+    return (centres[groups] + rng.normal(0, 0.045, (n, FEATURE_DIM))).astype(np.float32)
+
+
+def decisions(names, dist):
+    # Thresholded decision per query: the matched name, or None for "unknown"
+    return [row[0] if row and d[0] < DISTANCE_THRESHOLD else None for row, d in zip(names, dist)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF index vs brute force benchmark")
+    parser.add_argument('--gallery', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--impostors', type=float, default=0.2, help="Fraction of queries not in the gallery")
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--storage', choices=['float32', 'int8'], default='float32')
+    parser.add_argument('--batch', type=int, default=8, help="Queries per match call, like faces per frame")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    gallery = synthetic_gallery(args.gallery, rng)
+    names = [f"person_{i}" for i in range(args.gallery)]
+
+    n_known = int(args.queries * (1 - args.impostors))
+    probes = gallery[rng.integers(0, args.gallery, n_known)]
+    probes = probes + rng.normal(0, 0.022, probes.shape).astype(np.float32)
+    queries = np.concatenate([probes, synthetic_gallery(args.queries - n_known, rng)])
+
+    matcher = GalleryMatcher(capacity=args.gallery, min_index_size=0)
+    matcher.add_many(names, gallery)
+
+    def run(exact):
+        out_names, out_dist = [], []
+        start = time.perf_counter()
+        for i in range(0, len(queries), args.batch):
+            n, d = matcher.match(queries[i:i + args.batch], k=1, exact=exact)
+            out_names.extend(n)
+            out_dist.extend(d)
+        return decisions(out_names, out_dist), (time.perf_counter() - start) / len(queries) * 1000
+
+    truth, exact_ms = run(exact=True)
+    print(f"gallery={args.gallery} queries={len(queries)} threshold={DISTANCE_THRESHOLD} storage={args.storage}")
+    print(f"{'mode':<14}{'recall@1':>10}{'ms/query':>10}{'speedup':>10}")
+    print(f"{'brute force':<14}{1.0:>10.4f}{exact_ms:>10.3f}{1.0:>10.1f}")
+
+    start = time.perf_counter()
+    index = matcher.build_index(n_lists=args.n_lists, storage=args.storage, seed=args.seed)
+    print(f"(index build: {index.n_lists} lists in {time.perf_counter() - start:.1f}s)")
+    for n_probe in args.n_probe:
+        index.n_probe = n_probe
+        got, ms = run(exact=False)
+        recall = np.mean([a == b for a, b in zip(got, truth)])
+        print(f"{'n_probe=' + str(n_probe):<14}{recall:>10.4f}{ms:>10.3f}{exact_ms / ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
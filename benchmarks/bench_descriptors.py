@@ -0,0 +1,68 @@
+# Per-face descriptor latency: one compute_face_descriptor call per face vs BatchDescriber
+#
+#   python benchmarks/bench_descriptors.py --faces 1 5 20 50 --image class_photo.jpg
+#
+# Needs the dlib models under data/data_dlib/. Without --image a synthetic frame is
+# used; face boxes are laid out on a grid so the cost does not depend on detection.
+
+import argparse
+import os
+import sys
+import time
+import dlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recognition import BatchDescriber
+
+
+def grid_faces(frame, n, size=100):
+    cols = max(1, frame.shape[1] // size)
+    return [dlib.rectangle(int((i % cols) * size), int((i // cols) * size),
+                           int((i % cols) * size + size - 1), int((i // cols) * size + size - 1))
+            for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-face descriptor latency, looped vs batched")
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 5, 20, 50])
+    parser.add_argument('--image', default=None, help="RGB frame to use instead of a synthetic one")
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    predictor = dlib.shape_predictor('data/data_dlib/shape_predictor_68_face_landmarks.dat')
+    face_reco_model = dlib.face_recognition_model_v1("data/data_dlib/dlib_face_recognition_resnet_model_v1.dat")
+    describer = BatchDescriber(predictor, face_reco_model, max_batch=args.max_batch)
+
+    print(f"{'faces':>6}{'loop ms/face':>14}{'batch ms/face':>15}{'speedup':>10}")
+    for n in args.faces:
+        if args.image:
+            import cv2
+            frame = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2RGB)
+        else:
+            rows = (n * 100 + 639) // 640
+            frame = np.random.default_rng(0).integers(0, 255, (max(480, rows * 100), 640, 3), dtype=np.uint8)
+        shapes = describer.landmarks(frame, grid_faces(frame, n))
+
+        # Warm up both paths once
+        face_reco_model.compute_face_descriptor(frame, shapes[0])
+        describer.describe(frame, shapes)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for shape in shapes:
+                face_reco_model.compute_face_descriptor(frame, shape)
+        loop_ms = (time.perf_counter() - start) / (args.repeat * n) * 1000
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            describer.describe(frame, shapes)
+        batch_ms = (time.perf_counter() - start) / (args.repeat * n) * 1000
+
+        print(f"{n:>6}{loop_ms:>14.2f}{batch_ms:>15.2f}{loop_ms / batch_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Detection recall and ms/frame of DetectionEngine against full-frame detector(frame, 0)
+#
+#   python benchmarks/bench_detection.py footage.mp4 --scale 1.0 --full-scan-interval 10 --roi-margin 0.5
+#
+#   Compare --scale 0.5 on footage of the actual doorway before setting
+#   ATTENDANCE_DETECTION_SCALE=0.5: it misses faces under about 160px.
+#
+# Frames are prepared like AttendanceSystem.get_frame (640x480, RGB). Recall is the
+# fraction of baseline faces matched by an engine face with IoU >= 0.5.
+
+import argparse
+import os
+import sys
+import time
+import cv2
+import dlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detection import DetectionEngine, to_box, DETECTION_SCALE
+from face_tracker import iou_matrix
+
+
+def read_frames(path, limit):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(cv2.resize(frame, (640, 480)), cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DetectionEngine vs full-frame detection on recorded footage")
+    parser.add_argument('video')
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--scale', type=float, default=DETECTION_SCALE)
+    parser.add_argument('--full-scan-interval', type=int, default=10)
+    parser.add_argument('--roi-margin', type=float, default=0.5)
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames)
+    if not frames:
+        sys.exit(f"No frames read from {args.video}")
+    detector = dlib.get_frontal_face_detector()
+
+    start = time.perf_counter()
+    baseline = [[to_box(rect) for rect in detector(frame, 0)] for frame in frames]
+    baseline_ms = (time.perf_counter() - start) / len(frames) * 1000
+
+    engine = DetectionEngine(detector, scale=args.scale, full_scan_interval=args.full_scan_interval,
+                             roi_margin=args.roi_margin)
+    start = time.perf_counter()
+    found = [[to_box(rect) for rect in engine.detect(frame)] for frame in frames]
+    engine_ms = (time.perf_counter() - start) / len(frames) * 1000
+
+    total = sum(len(boxes) for boxes in baseline)
+    matched = sum(int((iou_matrix(b, f).max(axis=1) >= 0.5).sum())
+                  for b, f in zip(baseline, found) if b and f)
+    extra = sum(max(0, len(f) - len(b)) for b, f in zip(baseline, found))
+
+    print(f"frames={len(frames)} baseline faces={total}")
+    print(f"baseline: {baseline_ms:.2f} ms/frame")
+    print(f"engine:   {engine_ms:.2f} ms/frame ({engine.full_scans} full scans, {engine.roi_scans} ROI scans)")
+    print(f"recall:   {matched / total if total else 1.0:.4f}, extra detections: {extra}")
+    print(f"speedup:  {baseline_ms / engine_ms:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Export throughput and memory: the streaming CSV / XLSX endpoints vs fetchall()
+# into one response, on a synthetic attendance database
+#
+#   python benchmarks/bench_export.py --rows 10000000
+#
+# The database is generated once (about a minute for 10M rows) and reused. Each export
+# runs in a fresh interpreter through the Flask test client, so peak RSS is per mode.
+
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Run inside the child: prints a JSON dict for one export
+EXPORT = r"""
+import json, os, resource, sys, time
+mode, db_path, from_date, to_date = sys.argv[1:5]
+os.environ["ATTENDANCE_DB"] = db_path
+import app as viewer
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+before = rss_mb()
+start = time.perf_counter()
+size = 0
+if mode == "fetchall":
+    # What a naive export does: every row in memory, then one response body
+    import csv, io
+    with viewer.db_pool.connection() as conn:
+        rows = conn.execute("SELECT date, name, time FROM attendance WHERE date BETWEEN ? AND ? "
+                            "ORDER BY date, name", (from_date, to_date)).fetchall()
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    size = len(buffer.getvalue().encode())
+else:
+    client = viewer.app.test_client()
+    response = client.get(f"/export/attendance.{mode}?from={from_date}&to={to_date}", buffered=False)
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "bytes": size, "rss_before_mb": before, "peak_rss_mb": rss_mb()}))
+"""
+
+
+def build_database(path, rows, people):
+    from attendance_store import connect
+
+    conn = connect(path)
+    (have,) = conn.execute("SELECT count(*) FROM attendance").fetchone()
+    if have >= rows:
+        conn.close()
+        return have
+    print(f"Generating {rows} rows in {path} ...", file=sys.stderr)
+    conn.execute("DELETE FROM attendance")
+    first = datetime.date(2015, 1, 1)
+
+    def generate():
+        for i in range(rows):
+            day, person = divmod(i, people)
+            yield (f"student_{person:06d}", f"{8 + person % 3:02d}:{person % 60:02d}:00",
+                   (first + datetime.timedelta(days=day)).strftime('%Y-%m-%d'))
+
+    with conn:
+        conn.executemany("INSERT INTO attendance (name, time, date) VALUES (?, ?, ?)", generate())
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming export throughput and peak RSS")
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--people', type=int, default=5000, help="Rows per synthetic day")
+    parser.add_argument('--db', default=os.path.join(ROOT, "data/bench_export.db"))
+    parser.add_argument('--modes', nargs='+', default=["csv", "xlsx", "fetchall"])
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.db), exist_ok=True)
+    rows = build_database(args.db, args.rows, args.people)
+    conn = sqlite3.connect(args.db)
+    from_date, to_date = conn.execute("SELECT min(date), max(date) FROM attendance").fetchone()
+    conn.close()
+
+    print(f"{rows} rows, {from_date} .. {to_date}")
+    print(f"{'mode':<10}{'seconds':>9}{'rows/s':>12}{'MB out':>9}{'rss before':>12}{'peak rss':>10}")
+    for mode in args.modes:
+        out = subprocess.run([sys.executable, "-c", EXPORT, mode, args.db, from_date, to_date],
+                             cwd=ROOT, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{mode:<10}failed: {out.stderr.strip().splitlines()[-1]}")
+            continue
+        r = json.loads(out.stdout)
+        print(f"{mode:<10}{r['seconds']:>9.1f}{rows / r['seconds']:>12.0f}{r['bytes'] / 2 ** 20:>9.0f}"
+              f"{r['rss_before_mb']:>12.0f}{r['peak_rss_mb']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
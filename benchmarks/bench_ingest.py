@@ -0,0 +1,186 @@
+# Sustained ingest throughput: many simulated kiosks draining their outboxes into
+# /api/ingest at once, against a fresh database
+#
+#   python benchmarks/bench_ingest.py --kiosks 50 --events 2000
+#
+# The viewer runs under gunicorn when it is installed (gunicorn.conf.py, --workers
+# processes), else on werkzeug's threaded development server. Each kiosk is an
+# IngestClient with its own outbox, filled with out-of-order events for a shared pool
+# of people, so kiosks race on the same (name, date) rows. A fraction of responses is
+# dropped after the server committed, so those batches are retried with the same
+# batch_id. At the end the table must hold exactly the earliest time per (name, date).
+
+import argparse
+import datetime
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from kiosk_client import IngestClient
+
+# Development server fallback, run inside the child
+DEV_SERVER = r"""
+import sys
+from werkzeug.serving import run_simple
+from app import app
+run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)
+"""
+
+
+class LossyClient(IngestClient):
+    # Drops the server's response to some batches after it was applied, like a
+    # connection that breaks on the way back, and records POST latencies
+    def __init__(self, *args, lost=0.0, seed=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lost = lost
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.duplicates = 0
+
+    def _post(self, batch_id, events):
+        start = time.perf_counter()
+        result = super()._post(batch_id, events)
+        self.latencies.append(time.perf_counter() - start)
+        self.duplicates += result["duplicate"]
+        if self.random.random() < self.lost:
+            raise ConnectionResetError("response lost (simulated)")
+        return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path, port, workers):
+    env = dict(os.environ, ATTENDANCE_DB=db_path, BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(workers))
+    env.pop("ATTENDANCE_INGEST_TOKEN", None)
+    try:
+        import gunicorn  # noqa: F401
+        cmd, kind = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "",
+                     "wsgi:app"], f"gunicorn, {workers} workers"
+    except ImportError:
+        cmd, kind = [sys.executable, "-c", DEV_SERVER, str(port)], "werkzeug threaded dev server"
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, kind
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit("Server did not start")
+
+
+def generate(kiosks, events, people, days, far, seed):
+    # Per-kiosk event lists and the expected {(name, date): earliest time}
+    rng = random.Random(seed)
+    first = datetime.datetime(2024, 9, 2, 7, 30)
+    expected = {}
+    per_kiosk = []
+    for _ in range(kiosks):
+        batch = []
+        for _ in range(events):
+            when = first + datetime.timedelta(days=rng.randrange(days), seconds=rng.randrange(4 * 3600))
+            name = f"student_{rng.randrange(people):05d}"
+            distance = rng.uniform(0.41, 0.6) if rng.random() < far else rng.uniform(0.2, 0.4)
+            batch.append((name, when, distance))
+            if distance <= 0.4:
+                key = (name, when.strftime('%Y-%m-%d'))
+                t = when.strftime('%H:%M:%S')
+                expected[key] = min(expected.get(key, t), t)
+        per_kiosk.append(batch)
+    return per_kiosk, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiosk ingest throughput and correctness")
+    parser.add_argument('--kiosks', type=int, default=50)
+    parser.add_argument('--events', type=int, default=2000, help="Events queued per kiosk")
+    parser.add_argument('--people', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument('--lost', type=float, default=0.05, help="Fraction of responses dropped")
+    parser.add_argument('--far', type=float, default=0.02, help="Fraction of events above the distance limit")
+    parser.add_argument('--no-compress', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    db_path = os.path.join(workdir, "attendance.db")
+    from db_pool import ensure_schema
+    ensure_schema(db_path)
+
+    per_kiosk, expected = generate(args.kiosks, args.events, args.people, args.days, args.far, args.seed)
+    clients = []
+    for i, events in enumerate(per_kiosk):
+        client = LossyClient(None, f"kiosk-{i:03d}", os.path.join(workdir, f"outbox-{i}.db"),
+                             batch_size=args.batch_size, compress=not args.no_compress,
+                             lost=args.lost, seed=args.seed + i)
+        for name, when, distance in events:
+            client.outbox.add(name, when, distance)
+        clients.append(client)
+
+    port = free_port()
+    server, kind = start_server(db_path, port, args.workers)
+    for client in clients:
+        client.url = f"http://127.0.0.1:{port}/api/ingest"
+
+    def drain(client):
+        # What the background loop does, minus the waits: retry until the outbox is empty
+        while client.outbox.pending():
+            if not client.flush():
+                client.failures += 1
+
+    threads = [threading.Thread(target=drain, args=(client,)) for client in clients]
+    try:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    total = args.kiosks * args.events
+    latencies = np.array([t for client in clients for t in client.latencies]) * 1000
+    conn = sqlite3.connect(db_path)
+    rows = dict(((name, day), t) for name, t, day in conn.execute("SELECT name, time, date FROM attendance"))
+    (batches,) = conn.execute("SELECT count(*) FROM ingest_batches").fetchone()
+    conn.close()
+    for client in clients:
+        client.outbox.close()
+
+    print(f"{args.kiosks} kiosks x {args.events} events, batches of {args.batch_size}, {kind}")
+    print(f"drained in {elapsed:.1f}s: {total / elapsed:.0f} events/s, {batches / elapsed:.0f} batches/s")
+    print(f"POST latency ms: p50 {np.percentile(latencies, 50):.1f}  p95 {np.percentile(latencies, 95):.1f}  "
+          f"p99 {np.percentile(latencies, 99):.1f}  ({len(latencies)} requests)")
+    print(f"retries after lost responses: {sum(c.failures for c in clients)}, "
+          f"answered as duplicates: {sum(c.duplicates for c in clients)}")
+    ok = rows == expected
+    print(f"attendance rows: {len(rows)}, expected {len(expected)} earliest (name, date) pairs: "
+          f"{'match' if ok else 'MISMATCH'}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
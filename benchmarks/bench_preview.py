@@ -0,0 +1,78 @@
+# Preview render cost: a new Image + PhotoImage per frame (the old path) vs loading
+# into one preallocated image and pasting into a persistent PhotoImage
+#
+#   python benchmarks/bench_preview.py --frames 600
+#
+# Reports wall and CPU milliseconds per displayed frame and how much the process RSS
+# grew over the run. The PIL-only rows run anywhere; the Tk rows need a display.
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import process_rss_mb
+from preview import PreviewRenderer
+
+
+def frames(n, width, height):
+    rng = np.random.default_rng(0)
+    pool = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    return [pool[i % len(pool)] for i in range(n)]
+
+
+def measure(label, render, batch, pump=None):
+    render(batch[0])
+    rss_start = process_rss_mb()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for frame in batch:
+        render(frame)
+        if pump is not None:
+            pump()
+    wall = (time.perf_counter() - start) * 1000 / len(batch)
+    cpu = (time.process_time() - cpu_start) * 1000 / len(batch)
+    print(f"{label:<26}{wall:>10.3f}{cpu:>10.3f}{process_rss_mb() - rss_start:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tk preview render cost")
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    args = parser.parse_args()
+
+    from PIL import Image
+    batch = frames(args.frames, args.width, args.height)
+    print(f"{'path':<26}{'wall ms':>10}{'cpu ms':>10}{'rss grew MB':>14}")
+
+    image = Image.new("RGB", (args.width, args.height))
+    measure("PIL fromarray", lambda f: Image.fromarray(f), batch)
+    measure("PIL frombytes (reused)", lambda f: image.frombytes(f.data), batch)
+
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        win = tk.Tk()
+    except Exception as e:
+        print(f"Tk rows skipped: {e}")
+        return
+    label = tk.Label(win)
+    label.pack()
+
+    def per_frame_photo(frame):
+        photo = ImageTk.PhotoImage(image=Image.fromarray(frame))
+        label.imgtk = photo
+        label.configure(image=photo)
+
+    measure("Tk new PhotoImage", per_frame_photo, batch, win.update)
+    preview = PreviewRenderer(label, max_fps=0)
+    measure("Tk persistent PhotoImage", preview.show, batch, win.update)
+    win.destroy()
+
+
+if __name__ == '__main__':
+    main()
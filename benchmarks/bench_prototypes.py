@@ -0,0 +1,132 @@
+# Single-mean vs multi-prototype galleries: accuracy at the 0.4 threshold and match
+# throughput, on the same photo set
+#
+#   python benchmarks/bench_prototypes.py                         # registered photos
+#   python benchmarks/bench_prototypes.py --synthetic 2000        # no photos / dlib needed
+#
+# Every person's photos are split in two: even-numbered ones are enrolled, odd-numbered
+# ones are probes. A probe is correct when its own identity is the best match under
+# the threshold. Because match() returns distinct identities, the second-best match
+# tells what would have happened had the person not been enrolled at all: below the
+# threshold it counts as a false accept.
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from face_matcher import GalleryMatcher, select_prototypes, DISTANCE_THRESHOLD, FEATURE_DIM
+
+
+def photo_descriptors(photos_dir):
+    # {person: [descriptor, ...]} for registered photos, using capture-time embeddings
+    # and the extraction cache where possible
+    from embedding_cache import EmbeddingCache, is_image, load_sidecar
+    from features_extraction_to_csv import describe_images
+    from gallery_store import person_name
+
+    cache = EmbeddingCache().load()
+    people = {}
+    todo = []
+    for person in sorted(os.listdir(photos_dir)):
+        folder = os.path.join(photos_dir, person)
+        if not os.path.isdir(folder):
+            continue
+        photos = sorted(os.path.join(folder, p) for p in os.listdir(folder) if is_image(p))
+        people[person_name(person)] = photos
+        todo += photos
+
+    found = {}
+    missing = []
+    for path_img in todo:
+        captured = load_sidecar(path_img)
+        entry = cache.get(path_img) if captured is None else None
+        if captured is not None:
+            found[path_img] = captured[2]
+        elif entry is not None:
+            found[path_img] = entry.descriptor if entry.has_face else None
+        else:
+            missing.append(path_img)
+    for path_img, result in zip(missing, describe_images(missing)):
+        found[path_img] = np.asarray(result[2]) if result is not None and result[2] is not None else None
+    return {name: [found[p] for p in photos if found[p] is not None] for name, photos in people.items()}
+
+
+def synthetic_descriptors(n_people, photos, rng, modes=3):
+    # Each person has a few pose/lighting "modes"; a photo is one mode plus noise
+    centres = rng.normal(0, 0.06, (64, FEATURE_DIM))
+    people = {}
+    for i in range(n_people):
+        base = centres[rng.integers(64)] + rng.normal(0, 0.045, FEATURE_DIM)
+        offsets = rng.normal(0, 0.035, (modes, FEATURE_DIM))
+        picks = rng.integers(0, modes, photos)
+        people[f"person_{i}"] = list(base + offsets[picks] + rng.normal(0, 0.01, (photos, FEATURE_DIM)))
+    return people
+
+
+def evaluate(people, max_prototypes, method, batch):
+    names, rows, probes, truth = [], [], [], []
+    for name, descriptors in people.items():
+        if len(descriptors) < 2:
+            continue
+        enrolled, held_out = descriptors[0::2], descriptors[1::2]
+        prototypes = select_prototypes(enrolled, max_prototypes, method)
+        names += [name] * len(prototypes)
+        rows.append(prototypes)
+        probes += held_out
+        truth += [name] * len(held_out)
+    matcher = GalleryMatcher.from_arrays(names, np.concatenate(rows))
+    probes = np.asarray(probes, dtype=np.float32)
+
+    matched, dist = matcher.match(probes, k=2)
+    correct = false_accept = wrong = 0
+    for true_name, row, d in zip(truth, matched, dist):
+        if row[0] == true_name:
+            correct += d[0] < DISTANCE_THRESHOLD
+            false_accept += len(row) > 1 and d[1] < DISTANCE_THRESHOLD
+        else:
+            wrong += d[0] < DISTANCE_THRESHOLD
+            false_accept += d[0] < DISTANCE_THRESHOLD
+
+    start = time.perf_counter()
+    for i in range(0, len(probes), batch):
+        matcher.identify(probes[i:i + batch])
+    elapsed = time.perf_counter() - start
+    n = len(probes)
+    return {"rows": len(matcher), "people": matcher.identity_count, "probes": n,
+            "accept": correct / n, "wrong": wrong / n, "false_accept": false_accept / n,
+            "queries_per_s": n / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-mean vs multi-prototype galleries")
+    parser.add_argument('--photos', default=os.path.join(ROOT, "data/data_faces_from_camera"))
+    parser.add_argument('--synthetic', type=int, default=0, metavar='PEOPLE',
+                        help="Use this many synthetic people instead of registered photos")
+    parser.add_argument('--photos-per-person', type=int, default=20)
+    parser.add_argument('--caps', type=int, nargs='+', default=[2, 3, 5])
+    parser.add_argument('--batch', type=int, default=5, help="Faces matched per call, like one frame")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        people = synthetic_descriptors(args.synthetic, args.photos_per_person, np.random.default_rng(0))
+    else:
+        people = photo_descriptors(args.photos)
+    if not any(len(d) >= 2 for d in people.values()):
+        sys.exit("Need people with at least two photos")
+
+    layouts = [("mean", 1, "kmeans")]
+    layouts += [(f"{method} x{cap}", cap, method) for method in ("kmeans", "farthest") for cap in args.caps]
+    print(f"{'layout':<14}{'rows':>8}{'accept':>9}{'wrong':>8}{'false acc':>11}{'queries/s':>12}")
+    for label, cap, method in layouts:
+        r = evaluate(people, cap, method, args.batch)
+        print(f"{label:<14}{r['rows']:>8}{r['accept']:>9.3f}{r['wrong']:>8.3f}"
+              f"{r['false_accept']:>11.3f}{r['queries_per_s']:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Startup cost: `--help` of the command-line scripts and cold start to the first
+# processed frame, with models loaded up front (the old behaviour) vs warmed in the
+# background while the window and camera come up
+#
+#   python benchmarks/bench_startup.py --ui-init 1.5 --repeat 3
+#
+# Every measurement runs in a fresh interpreter so nothing is cached between them.
+# --ui-init stands in for Tk window setup and camera probing, which take around a
+# second on a typical kiosk. Needs dlib and the models under data/data_dlib/.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HELP_SCRIPTS = ("features_extraction_to_csv.py", "recognition_engine.py", "multi_camera.py")
+
+# Run inside the child: prints a JSON dict of timings, all relative to interpreter start
+FIRST_FRAME = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import numpy as np
+from model_registry import registry
+from recognition_engine import RecognitionEngine
+t_import = time.perf_counter()
+lazy = sys.argv[1] == "lazy"
+if lazy:
+    registry.warm_up()
+else:
+    registry.models()
+t_models = time.perf_counter()
+time.sleep(float(sys.argv[2]))   # window + camera setup
+t_ui = time.perf_counter()
+engine = RecognitionEngine(*registry.models())
+rng = np.random.default_rng(0)
+low = rng.integers(0, 255, (60, 80, 3)).astype(np.uint8)
+engine.process(np.ascontiguousarray(np.repeat(np.repeat(low, 8, axis=0), 8, axis=1)))
+t_frame = time.perf_counter()
+print(json.dumps({"import_s": t_import - t0, "models_blocking_s": t_models - t_import,
+                  "ui_ready_s": t_ui - t0, "first_frame_s": t_frame - t0,
+                  "load_s": registry.load_seconds}))
+"""
+
+
+def run(args):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit {out.returncode}")
+    return elapsed, out.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start and --help timings")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ui-init', type=float, default=1.0, help="Seconds of simulated window/camera setup")
+    args = parser.parse_args()
+
+    print(f"{'--help':<34}{'median s':>10}")
+    for script in HELP_SCRIPTS:
+        try:
+            times = [run([script, "--help"])[0] for _ in range(args.repeat)]
+            print(f"{script:<34}{statistics.median(times):>10.3f}")
+        except RuntimeError as e:
+            print(f"{script:<34}{'failed':>10}  {e}")
+
+    print()
+    runs = []
+    print(f"{'first frame':<12}{'import s':>10}{'blocked s':>11}{'ui ready s':>12}{'first frame s':>15}")
+    for mode in ("eager", "lazy"):
+        try:
+            runs = [json.loads(run(["-c", FIRST_FRAME, mode, str(args.ui_init)])[1]) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{mode:<12}failed: {e}")
+            continue
+        med = {key: statistics.median(r[key] for r in runs) for key in runs[0] if key != "load_s"}
+        print(f"{mode:<12}{med['import_s']:>10.3f}{med['models_blocking_s']:>11.3f}"
+              f"{med['ui_ready_s']:>12.3f}{med['first_frame_s']:>15.3f}")
+    if runs:
+        print("model load times: " + ", ".join(f"{k}={v:.2f}s" for k, v in runs[-1]["load_s"].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+# Deterministic per-stage and end-to-end benchmarks, runnable on a CPU-only box without a camera
+#
+#   python benchmarks/run_benchmarks.py --output bench.json                 # run everything available
+#   python benchmarks/run_benchmarks.py --save-baseline                     # record benchmarks/baseline.json
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json # exit 1 on regressions
+#
+# Frames are synthetic and seeded (or read from --frames-dir), so every run does the
+# same work. Synthetic frames hold no faces, so end_to_end reports fixed face boxes
+# after each real detection pass and the landmark, descriptor and match stages still
+# run. Stages whose dependencies or dlib models are missing are reported as skipped
+# instead of failing the run.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from detection import DetectionEngine, to_box
+from face_matcher import GalleryMatcher, FEATURE_DIM
+
+PREDICTOR_PATH = os.path.join(ROOT, 'data/data_dlib/shape_predictor_68_face_landmarks.dat')
+RESNET_PATH = os.path.join(ROOT, 'data/data_dlib/dlib_face_recognition_resnet_model_v1.dat')
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks/baseline.json')
+
+
+class Skip(Exception):
+    pass
+
+
+def measure(fn, iterations, warmup=3, items=1):
+    # Run fn iterations times; returns latency percentiles in ms and items/sec
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - start
+    ms = samples * 1000
+    return {
+        "iterations": iterations,
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "throughput_per_s": round(items * iterations / float(samples.sum()), 2),
+    }
+
+
+def synthetic_frames(count, seed=0):
+    # Seeded 640x480 RGB frames of 8x8-pixel random blocks, so HOG has real edges to
+    # work on instead of flat colour
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        low = rng.integers(0, 255, (60, 80, 3)).astype(np.uint8)
+        frame = np.ascontiguousarray(np.repeat(np.repeat(low, 8, axis=0), 8, axis=1))
+        frames.append(frame)
+    return frames
+
+
+def load_frames(frames_dir, count):
+    import cv2
+    from recognition_engine import prepare_frame
+    names = sorted(f for f in os.listdir(frames_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')))
+    frames = [prepare_frame(cv2.imread(os.path.join(frames_dir, name))) for name in names[:count]]
+    return [frame for frame in frames if frame is not None]
+
+
+def require_dlib_models():
+    try:
+        import dlib
+    except ImportError:
+        raise Skip("dlib not installed")
+    for path in (PREDICTOR_PATH, RESNET_PATH):
+        if not os.path.exists(path):
+            raise Skip(f"model {os.path.relpath(path, ROOT)} not found")
+    return dlib
+
+
+def grid_rects(dlib, n, size=120):
+    return [dlib.rectangle(40 + (i % 4) * (size + 20), 40 + (i // 4) * (size + 20),
+                           40 + (i % 4) * (size + 20) + size, 40 + (i // 4) * (size + 20) + size)
+            for i in range(n)]
+
+
+class KnownFaces(DetectionEngine):
+    # Runs every full and ROI scan for its cost, then reports the given boxes as the
+    # faces found, so the rest of the pipeline has faces to work on in synthetic frames
+    def __init__(self, detector, boxes):
+        super().__init__(detector)
+        self.known = boxes
+
+    def full_scan(self, frame):
+        super().full_scan(frame)
+        self.last_scores = [1.0] * len(self.known)
+        return list(self.known)
+
+    def roi_scan(self, frame, boxes):
+        super().roi_scan(frame, boxes)
+        self.last_scores = [1.0] * len(self.known)
+        return list(self.known)
+
+
+def bench_detection(ctx):
+    try:
+        import dlib
+    except ImportError:
+        raise Skip("dlib not installed")
+    # The pipeline's detector: full scans every few frames, ROI scans around known faces
+    detection = DetectionEngine(dlib.get_frontal_face_detector())
+    frames = ctx["frames"]
+    it = iter(range(10 ** 9))
+    result = measure(lambda: detection.detect(frames[next(it) % len(frames)]), ctx["iterations"])
+    result["full_scans"] = detection.full_scans
+    result["roi_scans"] = detection.roi_scans
+    return result
+
+
+def bench_landmarks(ctx):
+    dlib = require_dlib_models()
+    predictor = dlib.shape_predictor(PREDICTOR_PATH)
+    frame = ctx["frames"][0]
+    rects = grid_rects(dlib, 4)
+    return measure(lambda: [predictor(frame, rect) for rect in rects], ctx["iterations"], items=len(rects))
+
+
+def bench_descriptor(ctx):
+    dlib = require_dlib_models()
+    from recognition import BatchDescriber
+    predictor = dlib.shape_predictor(PREDICTOR_PATH)
+    describer = BatchDescriber(predictor, dlib.face_recognition_model_v1(RESNET_PATH))
+    frame = ctx["frames"][0]
+    shapes = describer.landmarks(frame, grid_rects(dlib, 4))
+    return measure(lambda: describer.describe(frame, shapes), max(5, ctx["iterations"] // 5), items=len(shapes))
+
+
+def bench_match(size):
+    def run(ctx):
+        rng = np.random.default_rng(size)
+        matcher = GalleryMatcher(capacity=size)
+        matcher.add_many([f"person_{i}" for i in range(size)],
+                         rng.normal(0, 0.05, (size, FEATURE_DIM)).astype(np.float32))
+        queries = rng.normal(0, 0.05, (5, FEATURE_DIM)).astype(np.float32)
+        return measure(lambda: matcher.identify(queries), ctx["iterations"], items=len(queries))
+    return run
+
+
+def bench_attendance_write(ctx):
+    from attendance_store import AttendanceStore
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AttendanceStore(os.path.join(tmp, "attendance.db"))
+        counter = iter(range(10 ** 9))
+        day = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+        # Mostly repeat sightings of people already marked, like a live kiosk, plus
+        # one genuinely new mark in every ten calls
+        def mark():
+            i = next(counter)
+            store.mark(f"person_{i // 10 if i % 10 == 0 else 0}", day)
+
+        result = measure(mark, ctx["iterations"] * 10)
+        start = time.perf_counter()
+        store.flush()
+        result["flush_ms"] = round((time.perf_counter() - start) * 1000, 4)
+        store.close()
+    return result
+
+
+def bench_render(ctx):
+    try:
+        import cv2
+        from PIL import Image
+    except ImportError:
+        raise Skip("opencv-python / Pillow not installed")
+    frames = ctx["frames"]
+    it = iter(range(10 ** 9))
+
+    # What the preview does per frame (draw, convert for Tk) plus a JPEG encode
+    def render():
+        frame = frames[next(it) % len(frames)].copy()
+        cv2.rectangle(frame, (100, 100), (220, 220), (0, 255, 0), 2)
+        cv2.putText(frame, "person", (100, 240), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+        Image.fromarray(frame).tobytes()
+        cv2.imencode(".jpg", frame)
+    return measure(render, ctx["iterations"])
+
+
+def bench_end_to_end(ctx):
+    dlib = require_dlib_models()
+    from face_quality import QualityGate
+    from recognition_engine import RecognitionEngine
+    rng = np.random.default_rng(1)
+    matcher = GalleryMatcher(capacity=1000)
+    matcher.add_many([f"person_{i}" for i in range(1000)], rng.normal(0, 0.05, (1000, FEATURE_DIM)))
+    detector = dlib.get_frontal_face_detector()
+    # Noise would fail the quality gate at random, so synthetic faces all go through
+    quality = QualityGate(enabled=False) if ctx["synthetic"] else None
+    engine = RecognitionEngine(detector, dlib.shape_predictor(PREDICTOR_PATH),
+                               dlib.face_recognition_model_v1(RESNET_PATH), matcher, quality=quality)
+    if ctx["synthetic"]:
+        engine.detection = KnownFaces(detector, [to_box(rect) for rect in grid_rects(dlib, 4)])
+    frames = ctx["frames"]
+    it = iter(range(10 ** 9))
+    result = measure(lambda: engine.process(frames[next(it) % len(frames)]), ctx["iterations"])
+    # Tracked faces only get a new descriptor every few frames, as on a live kiosk
+    result["descriptors_per_frame"] = round(engine.tracker.descriptors_computed / max(1, engine.frame_cnt), 3)
+    return result
+
+
+STAGES = [
+    ("detection", bench_detection),
+    ("landmarks", bench_landmarks),
+    ("descriptor", bench_descriptor),
+    ("match_100", bench_match(100)),
+    ("match_10k", bench_match(10000)),
+    ("match_100k", bench_match(100000)),
+    ("attendance_write", bench_attendance_write),
+    ("render_encode", bench_render),
+    ("end_to_end", bench_end_to_end),
+]
+
+
+def compare(results, baseline, tolerance):
+    # Stages whose p50 or p95 got slower than the baseline by more than tolerance
+    regressions = []
+    for stage, result in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or "p50_ms" not in base or "p50_ms" not in result:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if base[key] > 0 and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{stage} {key}: {base[key]:.3f} -> {result[key]:.3f} "
+                                   f"(+{(result[key] / base[key] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark suite")
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _ in STAGES])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--frames-dir', help="Recorded frames to use instead of synthetic ones")
+    parser.add_argument('--output', help="Write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="Compare against this results JSON and fail on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before failing")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Also write results to {BASELINE_PATH}")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames_dir, 100) if args.frames_dir else synthetic_frames(10)
+    if not frames:
+        sys.exit("No frames available")
+    ctx = {"frames": frames, "iterations": args.iterations, "synthetic": not args.frames_dir}
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "processor": platform.processor(), "cpus": os.cpu_count()},
+        "frames": "recorded" if args.frames_dir else "synthetic",
+        "stages": {},
+    }
+    for name, bench in STAGES:
+        if args.stages and name not in args.stages:
+            continue
+        try:
+            results["stages"][name] = bench(ctx)
+        except Skip as e:
+            results["stages"][name] = {"skipped": str(e)}
+        print(f"{name:<18} {json.dumps(results['stages'][name])}", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("PERFORMANCE REGRESSION against " + args.baseline, file=sys.stderr)
+            for line in regressions:
+                print("  " + line, file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
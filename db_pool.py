@@ -0,0 +1,112 @@
+# Per-process pool of read-only SQLite connections for the attendance viewer
+
+import contextlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+import rollups
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "attendance.db"
+
+
+def ensure_schema(db_path=DB_PATH):
+    # Table and the (date, name) index every viewer query relies on
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''CREATE TABLE IF NOT EXISTS attendance
+                            (name TEXT, time TEXT, date DATE,
+                            UNIQUE(name, date))''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date_name ON attendance(date, name)")
+            rollups.create_tables(conn)
+            rollups.mark_built_if_empty(conn)
+    finally:
+        conn.close()
+
+
+class WriteConnection:
+    # One read-write connection per process for the ingest endpoint. SQLite has a single
+    # writer anyway, so threads take turns on a lock and processes on the busy timeout.
+
+    def __init__(self, db_path=DB_PATH, busy_timeout=30.0, setup=None):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        # Called with the new connection, e.g. to create tables
+        self.setup = setup
+        self._pid = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        # Autocommit connection; callers manage their own transactions
+        with self._lock:
+            if self._pid != os.getpid():
+                from attendance_store import connect
+                conn = connect(self.db_path)
+                conn.isolation_level = None
+                conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+                if self.setup is not None:
+                    self.setup(conn)
+                self._conn = conn
+                self._pid = os.getpid()
+            yield self._conn
+
+
+class ReadPool:
+    # Connections are opened lazily and only in the process that uses them, so a pool
+    # created before gunicorn forks its workers is never shared across processes
+
+    def __init__(self, db_path=DB_PATH, size=4, timeout=5.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._pid = None
+        self._idle = None
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _reset_if_forked(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    ensure_schema(self.db_path)
+                    self._idle = queue.LifoQueue()
+                    self._opened = 0
+                    self._pid = os.getpid()
+
+    def _open(self):
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True,
+                               check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        self._reset_if_forked()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
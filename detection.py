@@ -0,0 +1,105 @@
+# Face detection: periodic full-frame scans (optionally downscaled), ROI-restricted search between them
+
+import logging
+import os
+import cv2
+import numpy as np
+
+from face_tracker import iou_matrix
+
+logger = logging.getLogger(__name__)
+
+#  Full-frame scans run on a copy resized by this factor. Below 1.0 they are cheaper,
+#  but dlib's 80px HOG window then misses faces smaller than 80 / scale pixels (160px
+#  at 0.5), i.e. people standing back from the camera; only lower it for close-up kiosks
+DETECTION_SCALE = float(os.environ.get("ATTENDANCE_DETECTION_SCALE", "1.0"))
+#  Run a full-frame scan every N frames to catch newcomers
+FULL_SCAN_INTERVAL = 10
+#  Each face's search region is its box grown by this fraction on every side
+ROI_MARGIN = 0.5
+#  dlib's HOG window is 80x80, smaller regions cannot contain a detection
+MIN_ROI_SIZE = 80
+
+
+def to_rectangle(box):
+    import dlib
+    left, top, right, bottom = (int(round(v)) for v in box)
+    return dlib.rectangle(left, top, right, bottom)
+
+
+def to_box(rect):
+    return (rect.left(), rect.top(), rect.right(), rect.bottom())
+
+
+def suppress_duplicates(boxes, iou_threshold=0.5):
+    # Overlapping ROIs can find the same face twice; indices of the first of every group
+    kept = []
+    for i, box in enumerate(boxes):
+        if not kept or iou_matrix([box], [boxes[j] for j in kept]).max() < iou_threshold:
+            kept.append(i)
+    return kept
+
+
+class DetectionEngine:
+    def __init__(self, detector, scale=DETECTION_SCALE, full_scan_interval=FULL_SCAN_INTERVAL,
+                 roi_margin=ROI_MARGIN, upsample=0):
+        self.detector = detector
+        self.scale = scale
+        self.full_scan_interval = max(1, full_scan_interval)
+        self.roi_margin = roi_margin
+        self.upsample = upsample
+        self.frame_cnt = 0
+        self.last_boxes = []
+        # Detector confidence per box of the last frame, None where the detector
+        # has no run() that reports scores
+        self.last_scores = []
+        self.full_scans = 0
+        self.roi_scans = 0
+
+    def detect(self, frame):
+        # Returns dlib.rectangles in full-resolution frame coordinates
+        if not self.last_boxes or self.frame_cnt % self.full_scan_interval == 0:
+            boxes = self.full_scan(frame)
+        else:
+            boxes = self.roi_scan(frame, self.last_boxes)
+        self.frame_cnt += 1
+        self.last_boxes = boxes
+        return [to_rectangle(box) for box in boxes]
+
+    def _run(self, image):
+        # [(box, score)]; dlib's run() gives the same detections as a call, plus scores
+        if hasattr(self.detector, "run"):
+            rects, scores, _ = self.detector.run(image, self.upsample, 0.0)
+            return [(to_box(rect), score) for rect, score in zip(rects, scores)]
+        return [(to_box(rect), None) for rect in self.detector(image, self.upsample)]
+
+    def full_scan(self, frame):
+        self.full_scans += 1
+        if self.scale == 1.0:
+            found = self._run(frame)
+        else:
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            found = [(tuple(v / self.scale for v in box), score) for box, score in self._run(small)]
+        self.last_scores = [score for _, score in found]
+        return [box for box, _ in found]
+
+    def roi_scan(self, frame, boxes):
+        # Search only around the faces found in the previous frame, at full resolution
+        self.roi_scans += 1
+        height, width = frame.shape[:2]
+        found = []
+        for left, top, right, bottom in boxes:
+            margin_x = max((right - left) * self.roi_margin, (MIN_ROI_SIZE - (right - left)) / 2)
+            margin_y = max((bottom - top) * self.roi_margin, (MIN_ROI_SIZE - (bottom - top)) / 2)
+            x1 = int(max(0, left - margin_x))
+            y1 = int(max(0, top - margin_y))
+            x2 = int(min(width, right + margin_x))
+            y2 = int(min(height, bottom + margin_y))
+            if x2 - x1 < MIN_ROI_SIZE or y2 - y1 < MIN_ROI_SIZE:
+                continue
+            roi = np.ascontiguousarray(frame[y1:y2, x1:x2])
+            for (l, t, r, b), score in self._run(roi):
+                found.append(((l + x1, t + y1, r + x1, b + y1), score))
+        kept = suppress_duplicates([box for box, _ in found])
+        self.last_scores = [found[i][1] for i in kept]
+        return [found[i][0] for i in kept]
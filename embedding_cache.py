@@ -0,0 +1,306 @@
+# Persistent per-image cache of face rects, landmarks and 128D descriptors for enrollment
+
+import hashlib
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = "data/features_cache.npz"
+#  Per-person prototypes selected from the cached descriptors
+PROTOTYPE_CACHE_PATH = "data/prototypes_cache.npz"
+CACHE_VERSION = 1
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+#  Capture-time embedding stored next to a registered photo: 3.jpg -> 3.face.npz
+SIDECAR_SUFFIX = ".face.npz"
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def is_image(path_img):
+    return path_img.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def sidecar_path(path_img):
+    return os.path.splitext(path_img)[0] + SIDECAR_SUFFIX
+
+
+def save_sidecar(path_img, rect, landmarks, descriptor, quality=None):
+    # rect and landmarks are in the coordinates of the saved image; quality is the
+    # (threshold key, reason or None) verdict of the quality gate, if known
+    key, reason = quality if quality is not None else ("", None)
+    np.savez(sidecar_path(path_img),
+             version=np.array(CACHE_VERSION),
+             rect=np.asarray(rect, dtype=np.int32).reshape(4),
+             landmarks=np.asarray(landmarks, dtype=np.int32).reshape(-1, 2),
+             descriptor=np.asarray(descriptor, dtype=np.float64).reshape(128),
+             quality_key=np.array(key), quality_reason=np.array(reason or ""))
+
+
+def read_sidecar(path_img):
+    # (rect, landmarks, descriptor, quality) saved when the photo was captured, or None.
+    # quality is None for sidecars saved before verdicts were kept.
+    path = sidecar_path(path_img)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                return None
+            quality = None
+            if "quality_key" in data.files and str(data["quality_key"]):
+                quality = str(data["quality_key"]), str(data["quality_reason"]) or None
+            return data["rect"], data["landmarks"], data["descriptor"], quality
+    except Exception as e:
+        logger.warning("Could not read %s: %s", path, e)
+        return None
+
+
+def load_sidecar(path_img):
+    # (rect, landmarks, descriptor) saved when the photo was captured, or None
+    captured = read_sidecar(path_img)
+    return captured[:3] if captured is not None else None
+
+
+class CacheEntry:
+    __slots__ = ("mtime_ns", "size", "sha1", "rect", "landmarks", "descriptor", "quality")
+
+    def __init__(self, mtime_ns, size, sha1, rect=None, landmarks=None, descriptor=None, quality=None):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.sha1 = sha1
+        # rect is (left, top, right, bottom) and None when no face was found; the
+        # descriptor is also None when the face was rejected by the quality gate
+        self.rect = rect
+        self.landmarks = landmarks
+        self.descriptor = descriptor
+        # (threshold key, reason or None) from the quality gate, None if never checked
+        self.quality = quality
+
+    @property
+    def has_face(self):
+        return self.descriptor is not None
+
+    @property
+    def has_rect(self):
+        return self.rect is not None
+
+
+class EmbeddingCache:
+    # Entries are looked up by path and trusted while mtime and size are unchanged.
+    # When they differ the file content hash decides, so touched, copied or renamed
+    # photos are not recomputed.
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._entries = {}
+        self._by_sha1 = {}
+        self.hits = 0
+        self.misses = 0
+        # Set whenever an entry changes, including a stat refresh after a hash match
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path_img):
+        return path_img in self._entries
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != CACHE_VERSION:
+                    logger.warning("Ignoring %s: cache version %d", self.path, int(data["version"]))
+                    return self
+                paths = data["paths"].tolist()
+                mtimes = data["mtime_ns"].tolist()
+                sizes = data["size"].tolist()
+                sha1s = data["sha1"].tolist()
+                has_face = data["has_face"].tolist()
+                rects, landmarks, descriptors = data["rect"], data["landmarks"], data["descriptor"]
+                # Caches written before quality verdicts were kept
+                has_rect = data["has_rect"].tolist() if "has_rect" in data.files else has_face
+                quality_keys = data["quality_key"].tolist() if "quality_key" in data.files else [""] * len(paths)
+                reasons = data["quality_reason"].tolist() if "quality_reason" in data.files else [""] * len(paths)
+        except Exception as e:
+            logger.warning("Could not read embedding cache %s: %s", self.path, e)
+            return self
+
+        for i, path_img in enumerate(paths):
+            quality = (quality_keys[i], reasons[i] or None) if quality_keys[i] else None
+            if has_rect[i]:
+                entry = CacheEntry(mtimes[i], sizes[i], sha1s[i], rects[i], landmarks[i],
+                                   descriptors[i] if has_face[i] else None, quality)
+            else:
+                entry = CacheEntry(mtimes[i], sizes[i], sha1s[i])
+            self._entries[path_img] = entry
+            self._by_sha1[entry.sha1] = entry
+        logger.info("Loaded %d cached embeddings from %s", len(self._entries), self.path)
+        return self
+
+    def get(self, path_img):
+        # Return the cached entry for path_img, or None if it has to be recomputed
+        st = os.stat(path_img)
+        entry = self._entries.get(path_img)
+        if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+            self.hits += 1
+            return entry
+
+        sha1 = file_sha1(path_img)
+        same = self._by_sha1.get(sha1)
+        if same is not None:
+            entry = CacheEntry(st.st_mtime_ns, st.st_size, sha1, same.rect, same.landmarks, same.descriptor,
+                               same.quality)
+            self._entries[path_img] = entry
+            self.dirty = True
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, path_img, rect=None, landmarks=None, descriptor=None, quality=None):
+        st = os.stat(path_img)
+        if rect is not None:
+            rect = np.asarray(rect, dtype=np.int32).reshape(4)
+            landmarks = np.asarray(landmarks, dtype=np.int32).reshape(-1, 2)
+        if descriptor is not None:
+            descriptor = np.asarray(descriptor, dtype=np.float64)
+        entry = CacheEntry(st.st_mtime_ns, st.st_size, file_sha1(path_img), rect, landmarks, descriptor, quality)
+        self._entries[path_img] = entry
+        self._by_sha1[entry.sha1] = entry
+        self.dirty = True
+        return entry
+
+    def set_quality(self, path_img, quality):
+        self._entries[path_img].quality = quality
+        self.dirty = True
+
+    def prune(self, keep_paths):
+        # Drop entries for images that no longer exist
+        keep_paths = set(keep_paths)
+        removed = [p for p in self._entries if p not in keep_paths]
+        for path_img in removed:
+            del self._entries[path_img]
+        self._by_sha1 = {entry.sha1: entry for entry in self._entries.values()}
+        if removed:
+            self.dirty = True
+        return len(removed)
+
+    def save(self):
+        paths = list(self._entries)
+        entries = [self._entries[p] for p in paths]
+        n = len(entries)
+        n_parts = max((len(e.landmarks) for e in entries if e.has_rect), default=68)
+        rect = np.zeros((n, 4), dtype=np.int32)
+        landmarks = np.zeros((n, n_parts, 2), dtype=np.int32)
+        descriptor = np.zeros((n, 128), dtype=np.float64)
+        for i, entry in enumerate(entries):
+            if entry.has_rect:
+                rect[i] = entry.rect
+                landmarks[i, :len(entry.landmarks)] = entry.landmarks
+            if entry.has_face:
+                descriptor[i] = entry.descriptor
+
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path,
+                 version=np.array(CACHE_VERSION),
+                 paths=np.array(paths, dtype=str),
+                 mtime_ns=np.array([e.mtime_ns for e in entries], dtype=np.int64),
+                 size=np.array([e.size for e in entries], dtype=np.int64),
+                 sha1=np.array([e.sha1 for e in entries], dtype=str),
+                 has_face=np.array([e.has_face for e in entries], dtype=bool),
+                 has_rect=np.array([e.has_rect for e in entries], dtype=bool),
+                 quality_key=np.array([e.quality[0] if e.quality else "" for e in entries], dtype=str),
+                 quality_reason=np.array([(e.quality[1] or "") if e.quality else "" for e in entries], dtype=str),
+                 rect=rect, landmarks=landmarks, descriptor=descriptor)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        logger.info("Saved %d cached embeddings to %s", n, self.path)
+
+
+class PrototypeCache:
+    # Each person's prototypes, keyed by a hash of the descriptors they were selected
+    # from and the selection settings, so people whose photos did not change are not
+    # clustered again. gallery is the gallery_store.gallery_version() written from them.
+
+    def __init__(self, path=PROTOTYPE_CACHE_PATH):
+        self.path = path
+        self._entries = {}
+        self.gallery = ""
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    @staticmethod
+    def key(descriptors, max_prototypes, method):
+        sha1 = hashlib.sha1(f"{method}:{max_prototypes}:".encode())
+        sha1.update(np.asarray(descriptors, dtype=np.float64).tobytes())
+        return sha1.hexdigest()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != CACHE_VERSION:
+                    return self
+                people = data["people"].tolist()
+                keys = data["keys"].tolist()
+                counts = data["counts"].tolist()
+                prototypes = data["prototypes"]
+                self.gallery = str(data["gallery"])
+        except Exception as e:
+            logger.warning("Could not read prototype cache %s: %s", self.path, e)
+            return self
+        start = 0
+        for person, key, count in zip(people, keys, counts):
+            self._entries[person] = (key, prototypes[start:start + count])
+            start += count
+        return self
+
+    def get(self, person, key):
+        # Cached prototypes of person if they were selected under the same key, else None
+        entry = self._entries.get(person)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, person, key, prototypes):
+        self._entries[person] = (key, np.asarray(prototypes, dtype=np.float32))
+        self.dirty = True
+
+    def prune(self, keep_people):
+        # Drop people whose folders are gone
+        keep_people = set(keep_people)
+        removed = [p for p in self._entries if p not in keep_people]
+        for person in removed:
+            del self._entries[person]
+        if removed:
+            self.dirty = True
+        return len(removed)
+
+    def save(self):
+        people = list(self._entries)
+        prototypes = [self._entries[p][1] for p in people]
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path,
+                 version=np.array(CACHE_VERSION),
+                 people=np.array(people, dtype=str),
+                 keys=np.array([self._entries[p][0] for p in people], dtype=str),
+                 counts=np.array([len(p) for p in prototypes], dtype=np.int64),
+                 prototypes=np.concatenate(prototypes) if prototypes else np.zeros((0, 128), np.float32),
+                 gallery=np.array(self.gallery))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
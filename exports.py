@@ -0,0 +1,172 @@
+# Streaming CSV / XLSX export of attendance rows
+#
+# Rows come straight off one SQLite cursor in (date, name) order a few thousand at a
+# time and are encoded into small chunks for a generator response, so memory does not
+# depend on how many rows are exported. Because the order is stable, an interrupted
+# download resumes by asking for the rows after the last complete (date, name) it got.
+
+import csv
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+#  Rows fetched from SQLite per round trip, and roughly rows per yielded chunk
+FETCH_SIZE = 5000
+#  Excel's hard limit is 1,048,576 rows per sheet; longer exports continue on the next
+XLSX_SHEET_ROWS = 1000000
+
+HEADER = ("date", "name", "time")
+
+
+def query_rows(conn, from_date, to_date, names=None, after=None, limit=None, fetch_size=FETCH_SIZE):
+    # Yield lists of (date, name, time) rows; served by idx_attendance_date_name
+    sql = "SELECT date, name, time FROM attendance WHERE date BETWEEN ? AND ?"
+    params = [from_date, to_date]
+    if names:
+        sql += f" AND name IN ({','.join('?' * len(names))})"
+        params += list(names)
+    if after:
+        sql += " AND (date, name) > (?, ?)"
+        params += list(after)
+    sql += " ORDER BY date, name"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def csv_chunks(batches, header=True):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(HEADER)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink:
+    # Write-only file object for zipfile. It has no tell()/seek(), so zipfile streams
+    # entries with data descriptors instead of seeking back to patch headers.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _sheet_xml_rows(rows, first_row):
+    parts = []
+    for i, (day, name, t) in enumerate(rows, first_row):
+        parts.append(f'<row r="{i}"><c t="inlineStr"><is><t>{day}</t></is></c>'
+                     f'<c t="inlineStr"><is><t>{escape(name)}</t></is></c>'
+                     f'<c t="inlineStr"><is><t>{t}</t></is></c></row>')
+    return "".join(parts).encode()
+
+
+_HEADER_ROW = _sheet_xml_rows([HEADER], 1)
+_SHEET_START = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_SHEET_END = b"</sheetData></worksheet>"
+
+
+def _workbook_parts(sheets):
+    ns = "http://schemas.openxmlformats.org/"
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<Types xmlns="{ns}package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        + "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                  'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                  for i in range(1, sheets + 1))
+        + '</Types>')
+    root_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<Relationships xmlns="{ns}package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{ns}officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>')
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<workbook xmlns="{ns}spreadsheetml/2006/main" xmlns:r="{ns}officeDocument/2006/relationships"><sheets>'
+        + "".join(f'<sheet name="Attendance{"" if i == 1 else f" {i}"}" sheetId="{i}" r:id="rId{i}"/>'
+                  for i in range(1, sheets + 1))
+        + '</sheets></workbook>')
+    workbook_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<Relationships xmlns="{ns}package/2006/relationships">'
+        + "".join(f'<Relationship Id="rId{i}" Type="{ns}officeDocument/2006/relationships/worksheet" '
+                  f'Target="worksheets/sheet{i}.xml"/>' for i in range(1, sheets + 1))
+        + '</Relationships>')
+    return [("[Content_Types].xml", content_types), ("_rels/.rels", root_rels),
+            ("xl/workbook.xml", workbook), ("xl/_rels/workbook.xml.rels", workbook_rels)]
+
+
+def xlsx_chunks(batches, sheet_rows=XLSX_SHEET_ROWS):
+    # Minimal workbook with inline strings (no shared-strings table to hold in memory).
+    # Worksheets are written first and the parts listing them last, once the number of
+    # sheets is known; readers go by the zip's central directory, not entry order.
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+    sheets = 0
+    sheet = None
+    row_no = 0
+    try:
+        for rows in batches:
+            while rows:
+                if sheet is None:
+                    sheets += 1
+                    sheet = archive.open(f"xl/worksheets/sheet{sheets}.xml", "w", force_zip64=True)
+                    sheet.write(_SHEET_START + _HEADER_ROW)
+                    row_no = 1
+                take = rows[:sheet_rows - (row_no - 1)]
+                rows = rows[len(take):]
+                sheet.write(_sheet_xml_rows(take, row_no + 1))
+                row_no += len(take)
+                if row_no - 1 >= sheet_rows:
+                    sheet.write(_SHEET_END)
+                    sheet.close()
+                    sheet = None
+            # Deflate holds data back until it has enough to emit a block
+            data = sink.take()
+            if data:
+                yield data
+        if sheet is None and not sheets:
+            sheets = 1
+            archive.writestr("xl/worksheets/sheet1.xml", _SHEET_START + _HEADER_ROW + _SHEET_END)
+        elif sheet is not None:
+            sheet.write(_SHEET_END)
+            sheet.close()
+            sheet = None
+        for name, xml in _workbook_parts(sheets):
+            archive.writestr(name, xml)
+    finally:
+        # Also reached when the client goes away mid-download
+        if sheet is not None and not sheet.closed:
+            sheet.close()
+        archive.close()
+    yield sink.take()
+
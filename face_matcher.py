@@ -0,0 +1,289 @@
+# Match 128D face descriptors against the known-faces gallery
+
+import logging
+import numpy as np
+
+from ann_index import IVFIndex, kmeans
+
+logger = logging.getLogger(__name__)
+
+#  Length of the dlib ResNet face descriptor
+FEATURE_DIM = 128
+
+#  Euclidean distance below which two descriptors are the same person
+DISTANCE_THRESHOLD = 0.4
+
+#  Prototypes kept per person at enrollment, and photos needed per prototype
+MAX_PROTOTYPES = 3
+MIN_PHOTOS_PER_PROTOTYPE = 3
+
+
+def select_prototypes(descriptors, max_prototypes=MAX_PROTOTYPES, method='kmeans', seed=0):
+    # Reduce one person's photo descriptors to at most max_prototypes rows that cover
+    # their pose / lighting variation. 'kmeans' returns cluster means (a single
+    # prototype is the plain mean), 'farthest' picks actual photos: the one closest to
+    # the mean, then repeatedly the one farthest from those already picked.
+    descriptors = np.asarray(descriptors, dtype=np.float64).reshape(-1, FEATURE_DIM)
+    n = descriptors.shape[0]
+    if n == 0:
+        return np.zeros((1, FEATURE_DIM), dtype=np.float32)
+    k = max(1, min(max_prototypes, n // MIN_PHOTOS_PER_PROTOTYPE))
+    if k == 1:
+        return descriptors.mean(axis=0, keepdims=True).astype(np.float32)
+    if method == 'kmeans':
+        return kmeans(descriptors, k, seed=seed).astype(np.float32)
+    if method == 'farthest':
+        chosen = [int(np.argmin(np.linalg.norm(descriptors - descriptors.mean(axis=0), axis=1)))]
+        nearest = np.linalg.norm(descriptors - descriptors[chosen[0]], axis=1)
+        while len(chosen) < k:
+            chosen.append(int(np.argmax(nearest)))
+            nearest = np.minimum(nearest, np.linalg.norm(descriptors - descriptors[chosen[-1]], axis=1))
+        return descriptors[chosen].astype(np.float32)
+    raise ValueError(f"Unknown prototype selection '{method}', expected 'kmeans' or 'farthest'")
+
+
+class GalleryMatcher:
+    def __init__(self, capacity=1024, dim=FEATURE_DIM, index=None, min_index_size=2000, rerank=8):
+        self.dim = dim
+        self.count = 0
+        # Optional ANN index, only consulted once the gallery has min_index_size rows;
+        # its top `rerank` candidates are re-scored exactly against the float32 rows
+        self.index = index
+        self.min_index_size = min_index_size
+        self.rerank = rerank
+        # All known descriptors live in one contiguous float32 matrix, rows [0, count) are valid
+        self._features = np.zeros((max(1, capacity), dim), dtype=np.float32)
+        # Cached squared norms of the gallery rows, used by the batched distance computation
+        self._sq_norms = np.zeros(max(1, capacity), dtype=np.float32)
+        self._names = []
+        # Identity offset table: a person's prototypes are consecutive rows, identity i
+        # owning rows [offsets[i], offsets[i + 1]). Rebuilt lazily after changes.
+        self._offsets = None
+        self._offset_names = None
+
+    @classmethod
+    def from_arrays(cls, names, features, **kwargs):
+        # Adopt an existing (N, dim) float32 array, e.g. the read-only memmap from
+        # gallery_store.load_gallery, without copying it; the first add() moves the
+        # rows into a private growable matrix
+        features = np.asarray(features, dtype=np.float32)
+        matcher = cls(capacity=1, dim=features.shape[1], **kwargs)
+        matcher._features = features
+        matcher._sq_norms = np.einsum('ij,ij->i', features, features)
+        matcher._names = list(names)
+        matcher.count = features.shape[0]
+        return matcher
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def features(self):
+        # View, not a copy, of the valid rows
+        return self._features[:self.count]
+
+    @property
+    def names(self):
+        return self._names
+
+    def identity_offsets(self):
+        # (offsets, names): start row of every run of rows sharing a name, plus the row
+        # count, and the name of each run
+        if self._offsets is None:
+            names = self._names
+            starts = [i for i in range(self.count) if i == 0 or names[i] != names[i - 1]]
+            self._offset_names = [names[i] for i in starts]
+            self._offsets = np.array(starts + [self.count], dtype=np.int64)
+        return self._offsets, self._offset_names
+
+    @property
+    def identity_count(self):
+        return len(set(self._names))
+
+    def _reserve(self, extra):
+        needed = self.count + extra
+        capacity = self._features.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(1, capacity)
+        while capacity < needed:
+            capacity *= 2
+        features = np.zeros((capacity, self.dim), dtype=np.float32)
+        features[:self.count] = self._features[:self.count]
+        sq_norms = np.zeros(capacity, dtype=np.float32)
+        sq_norms[:self.count] = self._sq_norms[:self.count]
+        self._features = features
+        self._sq_norms = sq_norms
+
+    def add(self, name, descriptor):
+        self.add_many([name], [descriptor])
+
+    def add_many(self, names, descriptors):
+        names = list(names)
+        descriptors = np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim)
+        if len(names) != descriptors.shape[0]:
+            raise ValueError(f"Got {len(names)} names for {descriptors.shape[0]} descriptors")
+        self._reserve(len(names))
+        start, end = self.count, self.count + len(names)
+        self._features[start:end] = descriptors
+        self._sq_norms[start:end] = np.einsum('ij,ij->i', descriptors, descriptors)
+        self._names.extend(names)
+        self.count = end
+        self._offsets = None
+        if self.index is not None:
+            self.index.add(descriptors, np.arange(start, end))
+
+    def clear(self):
+        self.count = 0
+        self._names = []
+        self._offsets = None
+        self.index = None
+
+    # Copy-on-write updates. A matcher in use is never modified: these return a new
+    # matcher for the caller to swap in, while frames already matching keep the old one.
+
+    def copy(self):
+        matcher = GalleryMatcher(capacity=self.count, dim=self.dim, min_index_size=self.min_index_size,
+                                 rerank=self.rerank)
+        matcher.add_many(self._names, self.features)
+        matcher.index = self.index.copy() if self.index is not None else None
+        return matcher
+
+    def with_faces(self, names, descriptors):
+        # Copy with one row per (name, descriptor) pair; every existing row of those
+        # names is replaced, so a person can be given several prototypes at once
+        names = list(names)
+        known = set(names) & set(self._names)
+        matcher = self.without(known) if known else self.copy()
+        matcher.add_many(names, descriptors)
+        return matcher
+
+    def without(self, names):
+        # Copy with every row of these people removed
+        drop = set(names)
+        keep = np.array([name not in drop for name in self._names], dtype=bool)
+        matcher = GalleryMatcher(capacity=int(keep.sum()), dim=self.dim, min_index_size=self.min_index_size,
+                                 rerank=self.rerank)
+        matcher.add_many([name for name, k in zip(self._names, keep) if k], self.features[keep])
+        if self.index is not None:
+            matcher.index = self.index.copy()
+            matcher.index.remove(np.flatnonzero(~keep))
+        return matcher
+
+    def update_index_from(self, previous):
+        # Carry previous's index over to this (reloaded) gallery when it only changed
+        # rows in place or appended new ones, which is what enrollment does.
+        # Returns False when the index would have to be rebuilt.
+        n_old = previous.count
+        if previous.index is None or self.count < n_old or self._names[:n_old] != previous.names[:n_old]:
+            return False
+        index = previous.index.copy()
+        changed = np.flatnonzero(np.any(self.features[:n_old] != previous.features, axis=1))
+        if len(changed):
+            index.remove(changed, renumber=False)
+            index.add(self.features[changed], changed)
+        if self.count > n_old:
+            index.add(self.features[n_old:], np.arange(n_old, self.count))
+        self.index = index
+        return True
+
+    def build_index(self, **kwargs):
+        self.index = IVFIndex(**kwargs).build(self.features)
+        return self.index
+
+    def load_index(self, path):
+        index = IVFIndex.load(path)
+        if len(index) != self.count or index.dim != self.dim:
+            logger.warning("Index %s has %d rows, gallery has %d; using exact search", path, len(index), self.count)
+            return None
+        self.index = index
+        return index
+
+    def distances(self, descriptors):
+        # (M, 128) queries against (N, 128) gallery -> (M, N) euclidean distances,
+        # using |q - g|^2 = |q|^2 + |g|^2 - 2 q.g so the whole frame is one matrix product
+        queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim)
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        d2 = q_sq[:, None] + self._sq_norms[None, :self.count] - 2.0 * (queries @ self.features.T)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def match(self, descriptors, k=1, exact=False):
+        # Return top-k identities and distances for every query, nearest first. A person
+        # with several prototypes scores the distance of their closest one.
+        queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim)
+        if self.count == 0 or queries.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])], np.zeros((queries.shape[0], 0), dtype=np.float32)
+        if self.index is not None and not exact and self.count >= self.min_index_size:
+            return self._match_index(queries, k)
+
+        dist = self.distances(queries)
+        offsets, run_names = self.identity_offsets()
+        if len(run_names) < self.count:
+            # Best prototype per identity, one reduction over the dense distance matrix
+            dist = np.minimum.reduceat(dist, offsets[:-1], axis=1)
+        if len(set(run_names)) < len(run_names):
+            # Some person's rows are not consecutive; rank every run and keep each name once
+            order = np.argsort(dist, axis=1)
+            return self._dedup([[run_names[j] for j in row] for row in order],
+                               np.take_along_axis(dist, order, axis=1), k)
+
+        n = dist.shape[1]
+        k = min(k, n)
+        if k < n:
+            idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.tile(np.arange(n), (queries.shape[0], 1))
+        top = np.take_along_axis(dist, idx, axis=1)
+        order = np.argsort(top, axis=1)
+        idx = np.take_along_axis(idx, order, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        names = [[run_names[j] for j in row] for row in idx]
+        return names, top
+
+    @staticmethod
+    def _dedup(cand_names, dist, k):
+        # cand_names[q] and dist[q] list query q's candidates nearest first (None for no
+        # candidate); keep the first k distinct names
+        out_names = []
+        out_dist = np.full((dist.shape[0], k), np.inf, dtype=np.float32)
+        for qi, row in enumerate(cand_names):
+            seen = []
+            for j, name in enumerate(row):
+                if name is None or name in seen:
+                    continue
+                out_dist[qi, len(seen)] = dist[qi, j]
+                seen.append(name)
+                if len(seen) == k:
+                    break
+            out_names.append(seen)
+        width = max((len(row) for row in out_names), default=0)
+        return out_names, out_dist[:, :width]
+
+    def _match_index(self, queries, k):
+        ids, _ = self.index.search(queries, k=max(k, self.rerank))
+        valid = ids >= 0
+        rows = self._features[np.where(valid, ids, 0)]
+        dist = np.linalg.norm(rows - queries[:, None, :], axis=2)
+        dist[~valid] = np.inf
+        order = np.argsort(dist, axis=1)
+        ids = np.take_along_axis(ids, order, axis=1)
+        dist = np.take_along_axis(dist, order, axis=1).astype(np.float32)
+        _, run_names = self.identity_offsets()
+        if len(run_names) < self.count:
+            # Candidates can be several prototypes of the same person
+            return self._dedup([[self._names[j] if j >= 0 else None for j in row] for row in ids], dist, k)
+        ids, dist = ids[:, :k], dist[:, :k]
+        names = [[self._names[j] for j in row if j >= 0] for row in ids]
+        return names, dist
+
+    def identify(self, descriptors, threshold=DISTANCE_THRESHOLD):
+        # Best match per query, or None when nothing is closer than the threshold
+        names, dist = self.match(descriptors, k=1)
+        results = []
+        for row_names, row_dist in zip(names, dist):
+            if row_names and row_dist[0] < threshold:
+                results.append((row_names[0], float(row_dist[0])))
+            else:
+                results.append((None, float(row_dist[0]) if len(row_dist) else float('inf')))
+        return results
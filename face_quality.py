@@ -0,0 +1,158 @@
+# Cheap face-quality gate in front of the landmark / ResNet descriptor stages
+#
+# Tiny, blurred, badly lit or profile faces cost a full descriptor and then fail the
+# 0.4 distance check anyway (or, at enrollment, drag a person's prototypes off). Each
+# check here costs well under a millisecond:
+#
+#   size        shorter side of the detector box, in pixels
+#   sharpness   variance of the Laplacian of the face crop, scaled to a fixed width
+#   brightness  mean gray level of the crop; contrast is its standard deviation
+#   confidence  detector score from detector.run(), when the detector reports one
+#   yaw         head turn estimated from the 68 landmarks (nose tip vs jaw ends),
+#               checked after the predictor and before the descriptor
+#
+# Thresholds come from the environment, e.g. ATTENDANCE_QUALITY_MIN_SIZE=48;
+# ATTENDANCE_QUALITY=0 turns the gate off.
+
+import logging
+import math
+import os
+import threading
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#  Crops are scaled to this width before measuring sharpness, so the threshold does
+#  not depend on how close the person stands
+SHARPNESS_WIDTH = 96
+
+DEFAULTS = {
+    "min_size": 60,
+    "min_sharpness": 30.0,
+    "min_brightness": 40.0,
+    "max_brightness": 220.0,
+    "min_contrast": 18.0,
+    # dlib only reports detections scoring above 0; weak ones sit just above it
+    "min_confidence": 0.2,
+    "max_yaw": 35.0,
+}
+
+REASONS = ("size", "sharpness", "brightness", "contrast", "confidence", "yaw")
+
+
+def _crop_gray(image, box):
+    height, width = image.shape[:2]
+    left, top, right, bottom = (int(round(v)) for v in box)
+    left, top = max(0, left), max(0, top)
+    right, bottom = min(width, right), min(height, bottom)
+    if right - left < 2 or bottom - top < 2:
+        return None
+    crop = image[top:bottom, left:right]
+    return cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+
+
+def sharpness(gray):
+    scale = SHARPNESS_WIDTH / gray.shape[1]
+    gray = cv2.resize(gray, (SHARPNESS_WIDTH, max(2, int(round(gray.shape[0] * scale)))),
+                      interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def landmark_points(shape):
+    # dlib full_object_detection or a sequence of (x, y) -> (n, 2) array
+    if hasattr(shape, "num_parts"):
+        return np.array([(shape.part(i).x, shape.part(i).y) for i in range(shape.num_parts)], dtype=np.float64)
+    return np.asarray(shape, dtype=np.float64).reshape(-1, 2)
+
+
+def estimate_yaw(points):
+    # Degrees of head turn, 0 when frontal: how far the nose tip (30) sits off the
+    # middle between the jaw ends (0 and 16). None without the 68-point layout.
+    if len(points) < 68:
+        return None
+    left = np.linalg.norm(points[30] - points[0])
+    right = np.linalg.norm(points[16] - points[30])
+    if left + right == 0:
+        return None
+    return math.degrees(math.asin(max(-1.0, min(1.0, (left - right) / (left + right)))))
+
+
+class QualityGate:
+    def __init__(self, enabled=True, **thresholds):
+        self.enabled = enabled
+        unknown = set(thresholds) - set(DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown quality thresholds: {', '.join(sorted(unknown))}")
+        for name, value in DEFAULTS.items():
+            setattr(self, name, thresholds.get(name, value))
+        self.checked = 0
+        self.rejected = dict.fromkeys(REASONS, 0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        thresholds = {}
+        for name in DEFAULTS:
+            value = environ.get(f"ATTENDANCE_QUALITY_{name.upper()}")
+            if value not in (None, ""):
+                thresholds[name] = float(value)
+        enabled = environ.get("ATTENDANCE_QUALITY", "1") not in ("0", "off", "false")
+        return cls(enabled, **thresholds)
+
+    def key(self):
+        # Names the threshold set, so verdicts saved under other thresholds are re-checked
+        if not self.enabled:
+            return "off"
+        return ",".join(f"{name}={float(getattr(self, name)):g}" for name in DEFAULTS)
+
+    def _count(self, reason):
+        with self._lock:
+            self.checked += 1
+            if reason is not None:
+                self.rejected[reason] += 1
+        return reason
+
+    def check_box(self, image, box, confidence=None):
+        # Reason the face should be skipped, or None. Runs before the predictor.
+        if not self.enabled:
+            return None
+        left, top, right, bottom = box
+        if min(right - left, bottom - top) < self.min_size:
+            return self._count("size")
+        if confidence is not None and confidence < self.min_confidence:
+            return self._count("confidence")
+        gray = _crop_gray(image, box)
+        if gray is None:
+            return self._count("size")
+        brightness = gray.mean()
+        if brightness < self.min_brightness or brightness > self.max_brightness:
+            return self._count("brightness")
+        if gray.std() < self.min_contrast:
+            return self._count("contrast")
+        if sharpness(gray) < self.min_sharpness:
+            return self._count("sharpness")
+        return None
+
+    def check_landmarks(self, shape):
+        # Second stage, after the predictor: reason or None; counts every face checked
+        if not self.enabled:
+            return None
+        yaw = estimate_yaw(landmark_points(shape))
+        if yaw is not None and abs(yaw) > self.max_yaw:
+            return self._count("yaw")
+        return self._count(None)
+
+    def check(self, image, box, shape=None, confidence=None):
+        # Both stages at once, for enrollment where the landmarks are already known
+        reason = self.check_box(image, box, confidence)
+        if reason is not None or not self.enabled:
+            return reason
+        if shape is not None:
+            return self.check_landmarks(shape)
+        return self._count(None)
+
+    def snapshot(self):
+        with self._lock:
+            return {"checked": self.checked, "descriptors_saved": sum(self.rejected.values()),
+                    "rejected": dict(self.rejected)}
@@ -0,0 +1,190 @@
+# Multi-face tracker that carries identities across frames, so the ResNet descriptor
+# only has to run for new, unrecognized or stale tracks
+
+import itertools
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def _hungarian(cost):
+    # Minimum-cost assignment for an (n, m) matrix with n <= m (shortest augmenting
+    # path with potentials, O(n^2 m)). Returns the column chosen for every row.
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            free = ~used[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = np.zeros(n, dtype=np.int64)
+    for j in range(1, m + 1):
+        if p[j]:
+            cols[p[j] - 1] = j - 1
+    return cols
+
+
+def assign(cost):
+    # Optimal (rows, cols) assignment of a rectangular cost matrix
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+    if cost.shape[0] <= cost.shape[1]:
+        return np.arange(cost.shape[0]), _hungarian(cost)
+    cols = _hungarian(cost.T)
+    order = np.argsort(cols)
+    return cols[order], np.arange(cost.shape[1])[order]
+
+
+def iou_matrix(boxes_a, boxes_b):
+    # (N, 4) x (M, 4) boxes as (left, top, right, bottom) -> (N, M) intersection over union
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    left = np.maximum(a[:, None, 0], b[None, :, 0])
+    top = np.maximum(a[:, None, 1], b[None, :, 1])
+    right = np.minimum(a[:, None, 2], b[None, :, 2])
+    bottom = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def centroid_distance_matrix(boxes_a, boxes_b):
+    # Centroid distance normalised by the size of the tracked box
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ca = np.stack([(a[:, 0] + a[:, 2]) / 2, (a[:, 1] + a[:, 3]) / 2], axis=1)
+    cb = np.stack([(b[:, 0] + b[:, 2]) / 2, (b[:, 1] + b[:, 3]) / 2], axis=1)
+    size = np.maximum(np.maximum(a[:, 2] - a[:, 0], a[:, 3] - a[:, 1]), 1.0)
+    return np.linalg.norm(ca[:, None, :] - cb[None, :, :], axis=2) / size[:, None]
+
+
+class Track:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.name = None
+        self.distance = float('inf')
+        self.hits = 1
+        self.misses = 0
+        # Frames since the descriptor was last computed for this track; None = never
+        self.frames_since_descriptor = None
+
+    @property
+    def is_new(self):
+        return self.frames_since_descriptor is None
+
+
+class FaceTracker:
+    # Descriptors are requested for a track when it is new, every unknown_interval
+    # frames while it is unrecognized or matched with distance above
+    # confident_distance, and every refresh_interval frames otherwise.
+
+    def __init__(self, max_misses=5, min_iou=0.1, max_centroid_ratio=1.0,
+                 refresh_interval=30, unknown_interval=5, confident_distance=0.35):
+        self.max_misses = max_misses
+        self.min_iou = min_iou
+        self.max_centroid_ratio = max_centroid_ratio
+        self.refresh_interval = refresh_interval
+        self.unknown_interval = unknown_interval
+        self.confident_distance = confident_distance
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self.descriptors_computed = 0
+        self.descriptors_skipped = 0
+
+    def update(self, boxes):
+        # Match this frame's boxes to existing tracks; returns one track per box
+        boxes = [tuple(int(x) for x in box) for box in boxes]
+        matched = [None] * len(boxes)
+
+        if self.tracks and boxes:
+            track_boxes = [track.box for track in self.tracks]
+            iou = iou_matrix(track_boxes, boxes)
+            centroid = centroid_distance_matrix(track_boxes, boxes)
+            cost = (1.0 - iou) + 0.5 * np.minimum(centroid, 2.0)
+            allowed = (iou >= self.min_iou) | (centroid <= self.max_centroid_ratio)
+            cost = np.where(allowed, cost, 1e6)
+            for row, col in zip(*assign(cost)):
+                if allowed[row, col]:
+                    matched[col] = self.tracks[row]
+
+        used = {id(track) for track in matched if track is not None}
+        survivors = []
+        for track in self.tracks:
+            if id(track) not in used:
+                track.misses += 1
+                if track.misses <= self.max_misses:
+                    survivors.append(track)
+        for col, box in enumerate(boxes):
+            track = matched[col]
+            if track is None:
+                track = Track(next(self._ids), box)
+                matched[col] = track
+            else:
+                track.box = box
+                track.hits += 1
+                track.misses = 0
+                if track.frames_since_descriptor is not None:
+                    track.frames_since_descriptor += 1
+            survivors.append(track)
+        self.tracks = survivors
+        return matched
+
+    def needs_descriptor(self, track):
+        if track.is_new:
+            return True
+        if track.name is None or track.distance > self.confident_distance:
+            return track.frames_since_descriptor >= self.unknown_interval
+        return track.frames_since_descriptor >= self.refresh_interval
+
+    def select(self, tracks):
+        # Indices of the tracks that need a fresh descriptor this frame
+        selected = [i for i, track in enumerate(tracks) if self.needs_descriptor(track)]
+        self.descriptors_skipped += len(tracks) - len(selected)
+        return selected
+
+    def set_identity(self, track, name, distance):
+        # Called with the result of a freshly computed descriptor; returns True when the
+        # track's identity changed. Selected tracks that never get here (rejected by the
+        # quality gate) are not counted and stay due.
+        self.descriptors_computed += 1
+        changed = name != track.name
+        track.name = name
+        track.distance = distance
+        track.frames_since_descriptor = 0
+        return changed
@@ -1,53 +1,134 @@
 # Extract features from images and save into "features_all.csv"
 
 import os
-import dlib
-import csv
+import time
+import argparse
+import multiprocessing
 import numpy as np
 import logging
 import cv2
 
+from gallery_store import save_gallery, write_csv, person_name, gallery_version, GALLERY_PATH, CSV_PATH
+from face_matcher import select_prototypes, MAX_PROTOTYPES
+from embedding_cache import EmbeddingCache, PrototypeCache, is_image, read_sidecar, save_sidecar
+from model_registry import registry
+from face_quality import QualityGate
+
 #  Path of cropped faces
 path_images_from_camera = "data/data_faces_from_camera/"
 
-#  Use frontal face detector of Dlib
-detector = dlib.get_frontal_face_detector()
+#  Dlib frontal face detector, 68-point landmark predictor and ResNet 128D descriptor
+#  model come from the shared registry and are only loaded once an image needs them
 
-#  Get face landmarks
-predictor = dlib.shape_predictor('data/data_dlib/shape_predictor_68_face_landmarks.dat')
+#  Photos of faces too small, blurred, dark or turned away are left out of the gallery
+quality = QualityGate.from_env()
 
-#  Use Dlib resnet50 model to get 128D face descriptor
-face_reco_model = dlib.face_recognition_model_v1("data/data_dlib/dlib_face_recognition_resnet_model_v1.dat")
 
+#  Return (rect, landmarks, 128D features) for single image, None if no face is found.
+#  A face that fails the quality gate comes back without a descriptor.
 
-#  Return 128D features for single image
+def return_128d_features_full(path_img):
+    result = detect_and_describe(path_img)
+    return result[:3] if result is not None else None
 
-def return_128d_features(path_img):
+
+#  Same, plus the quality gate's reason (None when the face passed)
+
+def detect_and_describe(path_img):
     img_rd = cv2.imread(path_img)
-    faces = detector(img_rd, 1)
+    if hasattr(registry.detector, "run"):
+        faces, scores, _ = registry.detector.run(img_rd, 1, 0.0)
+    else:
+        faces, scores = registry.detector(img_rd, 1), None
 
     logging.info("%-40s %-20s", " Image with faces detected:", path_img)
 
     # For photos of faces saved, we need to make sure that we can detect faces from the cropped images
     if len(faces) != 0:
-        shape = predictor(img_rd, faces[0])
-        face_descriptor = face_reco_model.compute_face_descriptor(img_rd, shape)
+        shape = registry.predictor(img_rd, faces[0])
+        rect = (faces[0].left(), faces[0].top(), faces[0].right(), faces[0].bottom())
+        landmarks = [(shape.part(i).x, shape.part(i).y) for i in range(shape.num_parts)]
+        reason = quality.check(cv2.cvtColor(img_rd, cv2.COLOR_BGR2GRAY), rect, shape,
+                               scores[0] if scores is not None else None)
+        if reason is not None:
+            logging.warning("Skipping %s: face rejected (%s)", path_img, reason)
+            return rect, landmarks, None, reason
+        face_descriptor = registry.face_reco_model.compute_face_descriptor(img_rd, shape)
+        return rect, landmarks, face_descriptor, None
+    logging.warning("no face")
+    return None
+
+
+#  Return 128D features for single image
+
+def return_128d_features(path_img):
+    result = return_128d_features_full(path_img)
+    if result is None or result[2] is None:
+        return 0
+    return result[2]
+
+
+#  Log progress and throughput (images/sec) while extracting
+
+class ExtractionProgress:
+    def __init__(self, total, log_interval=2.0):
+        self.total = total
+        self.done = 0
+        self.log_interval = log_interval
+        self.start_time = time.time()
+        self.last_log_time = self.start_time
+
+    def update(self, n=1):
+        self.done += n
+        now = time.time()
+        if now - self.last_log_time >= self.log_interval or self.done == self.total:
+            self.last_log_time = now
+            logging.info("Progress: %d/%d images, %.1f images/sec", self.done, self.total, self.rate())
+
+    def rate(self):
+        elapsed = time.time() - self.start_time
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+
+#  Quality verdict (threshold key, reason or None) for a photo whose face was found in
+#  an earlier run (cache or sidecar). A verdict saved under the same thresholds is
+#  reused; otherwise the image is re-read and the rect and landmarks reused.
+
+def quality_verdict(path_img, rect, landmarks, saved=None):
+    key = quality.key()
+    if saved is not None and saved[0] == key:
+        return saved
+    if not quality.enabled:
+        return key, None
+    gray = cv2.imread(path_img, cv2.IMREAD_GRAYSCALE)
+    reason = "unreadable" if gray is None else quality.check(gray, tuple(rect), landmarks)
+    if reason is not None:
+        logging.warning("Skipping %s: face rejected (%s)", path_img, reason)
+    return key, reason
+
+
+#  Mean of the 128D descriptors found for one person, zeros when there are none
+
+def return_features_mean(features_list_personX):
+    if features_list_personX:
+        features_mean_personX = np.array(features_list_personX, dtype=np.float64).mean(axis=0)
     else:
-        face_descriptor = 0
-        logging.warning("no face")
-    return face_descriptor
+        features_mean_personX = np.zeros(128, dtype=np.float64)
+    return features_mean_personX
 
 
 #   Return the mean value of 128D face descriptor for person X
 
-def return_features_mean_personX(path_face_personX):
+def return_features_mean_personX(path_face_personX, progress=None):
     features_list_personX = []
-    photos_list = os.listdir(path_face_personX)
+    photos_list = [photo for photo in os.listdir(path_face_personX) if is_image(photo)]
     if photos_list:
         for i in range(len(photos_list)):
             #  return_128d_features()  128D  / Get 128D features for single image of personX
             logging.info("%-40s %-20s", " / Reading image:", path_face_personX + "/" + photos_list[i])
             features_128d = return_128d_features(path_face_personX + "/" + photos_list[i])
+            if progress is not None:
+                progress.update()
             #  Jump if no face detected from image
             if features_128d == 0:
                 i += 1
@@ -56,38 +137,179 @@ def return_features_mean_personX(path_face_personX):
     else:
         logging.warning(" Warning: No images in%s/", path_face_personX)
 
-   
-    if features_list_personX:
-        features_mean_personX = np.array(features_list_personX, dtype=object).mean(axis=0)
+    return return_features_mean(features_list_personX)
+
+
+#  Worker side of the parallel mode. Each worker process holds its own copy of the
+#  dlib models (inherited on fork, loaded on first image on spawn) and returns plain
+#  lists so results pickle cheaply.
+
+def _init_worker():
+    logging.basicConfig(level=logging.INFO)
+
+
+def _describe_image(path_img):
+    result = detect_and_describe(path_img)
+    if result is None:
+        return None
+    rect, landmarks, face_descriptor, reason = result
+    return rect, landmarks, list(face_descriptor) if face_descriptor is not None else None, reason
+
+
+#  Yield the result of return_128d_features_full for every image, in order.
+#  With workers > 1 images are streamed to a process pool in chunks; imap keeps the
+#  input order so the per-person means are identical to the serial path.
+
+def describe_images(paths, workers=1, chunksize=8):
+    progress = ExtractionProgress(len(paths))
+    if workers > 1 and paths:
+        if multiprocessing.get_start_method() == "fork":
+            # Load once here so every forked worker shares the models
+            registry.warm_up(background=False)
+        with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+            for result in pool.imap(_describe_image, paths, chunksize):
+                progress.update()
+                yield result
     else:
-        features_mean_personX = np.zeros(128, dtype=object, order='C')
-    return features_mean_personX
+        for path_img in paths:
+            result = _describe_image(path_img)
+            progress.update()
+            yield result
+    logging.info("Extracted %d images with %d worker(s) at %.1f images/sec",
+                 progress.done, max(1, workers), progress.rate())
 
 
-def main():
+def main(argv=None):
     logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Extract 128D features of registered faces")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (1 = serial)")
+    parser.add_argument('--chunksize', type=int, default=8, help="Images sent to a worker at a time")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore and do not update the embedding cache")
+    parser.add_argument('--prototypes', type=int, default=MAX_PROTOTYPES,
+                        help="Most descriptors kept per person (1 = a single mean, the old layout)")
+    parser.add_argument('--prototype-method', choices=['kmeans', 'farthest'], default='kmeans',
+                        help="Cluster means, or the most spread-out actual photos")
+    parser.add_argument('--redetect', action='store_true',
+                        help="Re-detect every photo instead of using embeddings saved at registration or cached")
+    args = parser.parse_args(argv)
+
     #  Get the order of latest person
     person_list = os.listdir("data/data_faces_from_camera/")
     person_list.sort()
+    person_dirs = [path_images_from_camera + person for person in person_list]
 
-    with open("data/features_all.csv", "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        for person in person_list:
-            # Get the mean/average features of face/personX, it will be a list with a length of 128D
-            logging.info("%sperson_%s", path_images_from_camera, person)
-            features_mean_personX = return_features_mean_personX(path_images_from_camera + person)
+    photos_per_person = []
+    for path_face_personX in person_dirs:
+        photos_list = [photo for photo in os.listdir(path_face_personX) if is_image(photo)]
+        if not photos_list:
+            logging.warning(" Warning: No images in%s/", path_face_personX)
+        photos_per_person.append([path_face_personX + "/" + photo for photo in photos_list])
+    all_photos = [path_img for photos in photos_per_person for path_img in photos]
 
-            if len(person.split('_', 2)) == 2:
-                # "person_x"
-                person_name = person
+    #  Only images that are new or changed since the last run, and were not embedded
+    #  when they were captured, go through dlib. The stat-keyed cache is checked first;
+    #  a sidecar is only opened on a miss, and its contents are cached from then on.
+    cache = None if args.no_cache else EmbeddingCache().load()
+    descriptors = {}
+    todo = []
+    from_capture = 0
+    rejected = 0
+    for path_img in all_photos:
+        entry = cache.get(path_img) if cache is not None and not args.redetect else None
+        captured = read_sidecar(path_img) if entry is None and not args.redetect else None
+        if captured is not None:
+            rect, landmarks, face_descriptor, saved = captured
+            verdict = quality_verdict(path_img, rect, landmarks, saved)
+            if verdict != saved:
+                save_sidecar(path_img, rect, landmarks, face_descriptor, quality=verdict)
+            if cache is not None:
+                cache.put(path_img, rect, landmarks, face_descriptor, verdict)
+            passed = verdict[1] is None
+            descriptors[path_img] = face_descriptor.tolist() if passed else None
+            rejected += not passed
+            from_capture += 1
+            continue
+        if entry is not None and not entry.has_face and entry.has_rect and \
+                (entry.quality is None or entry.quality[0] != quality.key()):
+            # Rejected under other thresholds; it needs a descriptor if it passes now
+            entry = None
+        if entry is None:
+            todo.append(path_img)
+        elif not entry.has_rect:
+            descriptors[path_img] = None
+        else:
+            verdict = quality_verdict(path_img, entry.rect, entry.landmarks, entry.quality)
+            if verdict != entry.quality:
+                cache.set_quality(path_img, verdict)
+            if verdict[1] is None:
+                descriptors[path_img] = entry.descriptor.tolist()
             else:
-                # "person_x_tom"
-                person_name = person.split('_', 2)[-1]
-            features_mean_personX = np.insert(features_mean_personX, 0, person_name, axis=0)
-            # features_mean_personX will be 129D, person name + 128 features
-            writer.writerow(features_mean_personX)
-            logging.info('\n')
-        logging.info("Save all the features of faces registered into: data/features_all.csv")
+                descriptors[path_img] = None
+                rejected += 1
+    if from_capture:
+        logging.info("%d images embedded at capture time", from_capture)
+    if cache is not None:
+        logging.info("%d images cached, %d to extract", len(all_photos) - from_capture - len(todo), len(todo))
+
+    for path_img, result in zip(todo, describe_images(todo, args.workers, args.chunksize)):
+        if result is None:
+            descriptors[path_img] = None
+            if cache is not None:
+                cache.put(path_img)
+        else:
+            # A face rejected by the quality gate is cached without a descriptor and
+            # only detected again once the thresholds change
+            rect, landmarks, face_descriptor, reason = result
+            descriptors[path_img] = face_descriptor
+            rejected += face_descriptor is None
+            if cache is not None:
+                cache.put(path_img, rect, landmarks, face_descriptor, (quality.key(), reason))
+
+    if cache is not None:
+        cache.prune(all_photos)
+        if cache.dirty:
+            cache.save()
+
+    #  Up to --prototypes rows per person, consecutive, each "name, 128 features".
+    #  Only people whose descriptors changed are clustered again.
+    prototype_cache = None if args.no_cache else PrototypeCache().load()
+    person_names = []
+    person_features = []
+    for person, photos in zip(person_list, photos_per_person):
+        person_descriptors = [descriptors[p] for p in photos if descriptors[p] is not None]
+        prototypes = None
+        if prototype_cache is not None:
+            key = PrototypeCache.key(person_descriptors, args.prototypes, args.prototype_method)
+            prototypes = prototype_cache.get(person, key)
+        if prototypes is None:
+            prototypes = select_prototypes(person_descriptors, args.prototypes, args.prototype_method)
+            if prototype_cache is not None:
+                prototype_cache.put(person, key, prototypes)
+        person_names += [person_name(person)] * len(prototypes)
+        person_features.append(prototypes)
+    person_features = np.concatenate(person_features) if person_features else np.zeros((0, 128), np.float32)
+    logging.info("%d people, %d prototypes", len(person_list), len(person_names))
+    if rejected:
+        logging.info("%d photos left out by the quality gate", rejected)
+
+    if prototype_cache is not None:
+        prototype_cache.prune(person_list)
+        logging.info("%d people unchanged, %d re-clustered", prototype_cache.hits, prototype_cache.misses)
+        # Nothing changed since the gallery was last written from these prototypes
+        if not prototype_cache.dirty and os.path.exists(CSV_PATH) and \
+                prototype_cache.gallery == gallery_version(GALLERY_PATH, CSV_PATH):
+            logging.info("Gallery is up to date, %s and %s left as they are", CSV_PATH, GALLERY_PATH)
+            return
+
+    write_csv(CSV_PATH, person_names, person_features)
+    logging.info("Save all the features of faces registered into: %s", CSV_PATH)
+
+    # Binary copy of the same gallery, memory-mapped by the recognizers at startup
+    save_gallery(GALLERY_PATH, person_names, person_features)
+
+    if prototype_cache is not None:
+        prototype_cache.gallery = gallery_version(GALLERY_PATH, CSV_PATH)
+        prototype_cache.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+# Binary, memory-mapped storage for the known-faces gallery
+#
+# File layout (little endian):
+#   [0, 64)          header: magic, version, dim, count, data offset, names offset,
+#                    names size, CRC32 of the data and names blocks
+#   [64, ...)        float32 descriptor block, count x dim, C order
+#   [names offset)   name table, UTF-8, one name per line, row i is line i
+
+import csv
+import hashlib
+import logging
+import os
+import struct
+import zlib
+import numpy as np
+
+from face_matcher import FEATURE_DIM
+
+logger = logging.getLogger(__name__)
+
+GALLERY_PATH = "data/features_all.gallery"
+CSV_PATH = "data/features_all.csv"
+
+MAGIC = b"FYPGALRY"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQI")
+DATA_OFFSET = 64
+
+
+class GalleryFormatError(ValueError):
+    pass
+
+
+def _read_header(f):
+    raw = f.read(HEADER.size)
+    if len(raw) != HEADER.size:
+        raise GalleryFormatError("Gallery file is truncated")
+    magic, version, dim, count, data_offset, names_offset, names_size, checksum = HEADER.unpack(raw)
+    if magic != MAGIC:
+        raise GalleryFormatError("Not a gallery file")
+    if version != VERSION:
+        raise GalleryFormatError(f"Unsupported gallery version {version}")
+    return dim, count, data_offset, names_offset, names_size, checksum
+
+
+def save_gallery(path, names, features):
+    names = [str(name) for name in names]
+    features = np.ascontiguousarray(features, dtype='<f4')
+    if features.ndim != 2 or features.shape[0] != len(names):
+        raise ValueError(f"Got {len(names)} names for features of shape {features.shape}")
+    for name in names:
+        if "\n" in name:
+            raise ValueError(f"Name {name!r} contains a newline")
+
+    data = features.tobytes()
+    names_blob = "\n".join(names).encode("utf-8")
+    checksum = zlib.crc32(names_blob, zlib.crc32(data))
+    names_offset = DATA_OFFSET + len(data)
+    header = HEADER.pack(MAGIC, VERSION, features.shape[1], features.shape[0],
+                         DATA_OFFSET, names_offset, len(names_blob), checksum)
+
+    # Write to a temp file and rename so readers never see a half-written gallery
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(DATA_OFFSET, b"\0"))
+        f.write(data)
+        f.write(names_blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info("Saved %d faces to %s", len(names), path)
+
+
+def load_gallery(path=GALLERY_PATH, verify=False):
+    # Return (names, features) where features is a read-only np.memmap, so opening
+    # is O(1) in the descriptor data and processes mapping the same file share pages
+    with open(path, "rb") as f:
+        dim, count, data_offset, names_offset, names_size, checksum = _read_header(f)
+        f.seek(names_offset)
+        names_blob = f.read(names_size)
+    if len(names_blob) != names_size:
+        raise GalleryFormatError("Gallery name table is truncated")
+
+    if count:
+        features = np.memmap(path, dtype='<f4', mode='r', offset=data_offset, shape=(count, dim))
+    else:
+        features = np.zeros((0, dim), dtype=np.float32)
+    if verify and zlib.crc32(names_blob, zlib.crc32(features.tobytes())) != checksum:
+        raise GalleryFormatError(f"Checksum mismatch in {path}")
+
+    names = names_blob.decode("utf-8").split("\n") if count else []
+    if len(names) != count:
+        raise GalleryFormatError(f"Gallery has {count} rows but {len(names)} names")
+    return names, features
+
+
+def load_known_faces(gallery_path=GALLERY_PATH, csv_path=CSV_PATH):
+    # Prefer the binary gallery, fall back to the legacy CSV; None when neither exists
+    if os.path.exists(gallery_path):
+        return load_gallery(gallery_path)
+    if os.path.exists(csv_path):
+        logger.info("%s not found, reading %s (run 'python gallery_store.py convert' to speed this up)",
+                    gallery_path, csv_path)
+        return read_csv(csv_path)
+    return None
+
+
+def gallery_version(gallery_path=GALLERY_PATH, csv_path=CSV_PATH):
+    # Short string that changes whenever the gallery load_known_faces() would return
+    # changes: the header checksum of the binary gallery, else a hash of the CSV
+    if os.path.exists(gallery_path):
+        with open(gallery_path, "rb") as f:
+            dim, count, _, _, _, checksum = _read_header(f)
+        return f"gallery:{count}x{dim}:{checksum:08x}"
+    if os.path.exists(csv_path):
+        with open(csv_path, "rb") as f:
+            return "csv:" + hashlib.sha1(f.read()).hexdigest()[:16]
+    return "none"
+
+
+def read_csv(csv_path=CSV_PATH):
+    # Parse the legacy "name, 128 floats" CSV; empty cells count as 0
+    names = []
+    rows = []
+    with open(csv_path, newline="") as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            names.append(row[0])
+            rows.append([float(x) if x != '' else 0.0 for x in row[1:FEATURE_DIM + 1]])
+    features = np.array(rows, dtype=np.float32).reshape(-1, FEATURE_DIM)
+    return names, features
+
+
+def write_csv(csv_path, names, features):
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for name, row in zip(names, np.asarray(features)):
+            writer.writerow([name] + [repr(float(x)) for x in row])
+
+
+def person_name(folder):
+    # "person_3" -> "person_3", "person_3_tom" -> "tom"
+    folder = os.path.basename(os.path.normpath(folder))
+    parts = folder.split('_', 2)
+    return folder if len(parts) == 2 else parts[-1]
+
+
+def upsert_face(name, descriptors, gallery_path=GALLERY_PATH, csv_path=CSV_PATH):
+    # Set the prototype rows for name in both the binary gallery and the CSV, without a
+    # full extraction pass: existing rows of that name are replaced in place, a new
+    # name is appended. Rows are keyed by name, like the matcher's results.
+    gallery = load_known_faces(gallery_path, csv_path)
+    names, features = gallery if gallery is not None else ([], np.zeros((0, FEATURE_DIM), dtype=np.float32))
+    names = list(names)
+    features = np.array(features, dtype=np.float32)
+    rows = np.asarray(descriptors, dtype=np.float32).reshape(-1, FEATURE_DIM)
+    old = [i for i, n in enumerate(names) if n == name]
+    at = old[0] if old else len(names)
+    keep = np.ones(len(names), dtype=bool)
+    keep[old] = False
+    names = [n for n, k in zip(names, keep) if k]
+    names[at:at] = [name] * len(rows)
+    features = np.concatenate([features[keep][:at], rows, features[keep][at:]])
+    save_gallery(gallery_path, names, features)
+    write_csv(csv_path, names, features)
+    return len(names)
+
+
+def clear_gallery(gallery_path=GALLERY_PATH, csv_path=CSV_PATH):
+    # Empty gallery and CSV, so running recognizers reload to nobody
+    empty = np.zeros((0, FEATURE_DIM), dtype=np.float32)
+    if os.path.exists(gallery_path):
+        save_gallery(gallery_path, [], empty)
+    if os.path.exists(csv_path):
+        write_csv(csv_path, [], empty)
+
+
+def convert_csv(csv_path=CSV_PATH, gallery_path=GALLERY_PATH):
+    names, features = read_csv(csv_path)
+    save_gallery(gallery_path, names, features)
+    return len(names)
+
+
+def export_csv(gallery_path=GALLERY_PATH, csv_path=CSV_PATH):
+    names, features = load_gallery(gallery_path, verify=True)
+    write_csv(csv_path, names, features)
+    return len(names)
+
+
+def main():
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert the face gallery between CSV and binary formats")
+    parser.add_argument('command', choices=['convert', 'export', 'verify'])
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--gallery', default=GALLERY_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        count = convert_csv(args.csv, args.gallery)
+        logging.info("Converted %d faces from %s into %s", count, args.csv, args.gallery)
+    elif args.command == 'export':
+        count = export_csv(args.gallery, args.csv)
+        logging.info("Exported %d faces from %s into %s", count, args.gallery, args.csv)
+    else:
+        names, _ = load_gallery(args.gallery, verify=True)
+        logging.info("%s OK: %d faces", args.gallery, len(names))
+
+
+if __name__ == '__main__':
+    main()
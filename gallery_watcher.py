@@ -0,0 +1,140 @@
+# Hot reload of the known-faces gallery into a running recognizer
+#
+# A background thread polls the gallery, CSV and index files and, when one changes
+# (or on SIGHUP / request_reload()), builds a new GalleryMatcher off the hot path and
+# swaps it into target.matcher with a single assignment. RecognitionEngine reads
+# self.matcher once per frame, so a frame uses either the old gallery or the new
+# one, never a mix. add_face() / remove_face() apply deltas the same way.
+
+import logging
+import os
+import signal
+import threading
+
+from face_matcher import GalleryMatcher
+from gallery_store import load_known_faces, GALLERY_PATH, CSV_PATH
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = "data/features_all.ivf.npz"
+#  Seconds between checks of the gallery files
+POLL_INTERVAL = 2.0
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def load_matcher(gallery_path=GALLERY_PATH, csv_path=CSV_PATH, index_path=INDEX_PATH, previous=None):
+    # Matcher for the gallery on disk, None when there is none. The index is taken from
+    # index_path if it matches, else carried over from `previous` or rebuilt.
+    gallery = load_known_faces(gallery_path, csv_path)
+    if gallery is None:
+        return None
+    matcher = GalleryMatcher.from_arrays(*gallery)
+    if os.path.exists(index_path) and matcher.load_index(index_path) is not None:
+        return matcher
+    if previous is not None and previous.index is not None:
+        if not matcher.update_index_from(previous):
+            logger.info("Gallery rows were removed or reordered, rebuilding the index")
+            matcher.build_index(n_probe=previous.index.n_probe, storage=previous.index.storage)
+    return matcher
+
+
+class GalleryWatcher:
+    def __init__(self, target, gallery_path=GALLERY_PATH, csv_path=CSV_PATH, index_path=INDEX_PATH,
+                 poll_interval=POLL_INTERVAL, on_reload=None):
+        # target is anything with a `matcher` attribute, normally a RecognitionEngine
+        self.target = target
+        self.gallery_path = gallery_path
+        self.csv_path = csv_path
+        self.index_path = index_path
+        self.poll_interval = poll_interval
+        # Called with the new matcher after every swap, on the watcher's thread
+        self.on_reload = on_reload
+        self.reloads = 0
+        self._signatures = self._current_signatures()
+        self._pending = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        # Serializes swaps so a delta never overwrites a concurrent reload or vice versa
+        self._swap_lock = threading.Lock()
+        self._thread = None
+
+    def _current_signatures(self):
+        return tuple(_signature(path) for path in (self.gallery_path, self.csv_path, self.index_path))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="gallery-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGHUP", None)):
+        # `kill -HUP <pid>` reloads; must be called from the main thread
+        if signum is not None:
+            signal.signal(signum, lambda *_: self.request_reload())
+
+    def request_reload(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            forced = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            signatures = self._current_signatures()
+            if signatures != self._signatures:
+                # Still being written (the CSV is not replaced atomically); reload once
+                # the files look the same on two consecutive polls
+                self._signatures = signatures
+                self._pending = True
+                if not forced:
+                    continue
+            if forced or self._pending:
+                self._pending = False
+                self.reload()
+
+    def _swap(self, matcher):
+        # Called with _swap_lock held
+        self.target.matcher = matcher
+        self.reloads += 1
+        if self.on_reload is not None:
+            try:
+                self.on_reload(matcher)
+            except Exception as e:
+                logger.error(f"Error in gallery reload callback: {e}")
+
+    def reload(self):
+        with self._swap_lock:
+            try:
+                matcher = load_matcher(self.gallery_path, self.csv_path, self.index_path, self.target.matcher)
+            except Exception as e:
+                # Half-written or corrupt file: keep serving the current gallery
+                logger.error(f"Gallery reload failed, keeping the current one: {e}")
+                return False
+            if matcher is None:
+                logger.warning("Gallery files are gone, keeping the current gallery")
+                return False
+            self._swap(matcher)
+        logger.info("Reloaded gallery: %d faces", len(matcher))
+        return True
+
+    def add_face(self, name, descriptor):
+        # Add a person, or replace their descriptor, without reading the gallery files
+        with self._swap_lock:
+            self._swap(self.target.matcher.with_faces([name], [descriptor]))
+
+    def remove_face(self, name):
+        with self._swap_lock:
+            self._swap(self.target.matcher.without([name]))
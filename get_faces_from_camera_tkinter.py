@@ -1,18 +1,34 @@
-import dlib
-import numpy as np
 import cv2
 import os
+import logging
+import queue
 import shutil
+import threading
 import time
 import tkinter as tk
 from tkinter import font as tkFont
-from PIL import Image, ImageTk
 
-# Initialize Dlib face detector
-detector = dlib.get_frontal_face_detector()
+from model_registry import registry
+from embedding_cache import EmbeddingCache, save_sidecar, read_sidecar, is_image
+from gallery_store import person_name, upsert_face, clear_gallery
+from face_matcher import select_prototypes
+from preview import PreviewRenderer
+from face_quality import QualityGate
+
+logger = logging.getLogger(__name__)
+
+#  Seconds without a new photo before a person's gallery rows are rewritten, so a burst
+#  of saves costs one gallery update instead of one per photo
+GALLERY_UPDATE_DELAY = 1.0
 
 class FaceRegister:
     def __init__(self):
+        # Detector first, then the landmark and descriptor models used when a face is
+        # saved, all in the background
+        registry.warm_up()
+        # Photos of faces too small, blurred, dark or turned away are not saved
+        self.quality = QualityGate.from_env()
+
         self.current_frame_faces_cnt = 0  # Number of faces in the current frame
         self.ss_cnt = 0  # Screenshot counter
         self.existing_faces_cnt = 0  # Number of faces in the database
@@ -24,17 +40,31 @@ class FaceRegister:
         self.face_ROI_height = 0
         self.face_ROI_width_start = 0
         self.face_ROI_width = 0
+        # Undrawn copy of the frame and the dlib rect of the face the ROI was taken from
+        self.clean_frame = None
+        self.current_face = None
+        # Descriptors and gallery updates run on a worker thread, so the cost of a save
+        # does not grow with the gallery on the Tk thread. Status lines come back
+        # through _embed_messages, which process() shows.
+        self._embed_jobs = queue.Queue()
+        self._embed_messages = queue.Queue()
+        self._embed_thread = threading.Thread(target=self._embed_loop, name="gallery-update", daemon=True)
+        self._embed_thread.start()
 
         # Tkinter GUI
         self.win = tk.Tk()
         self.win.title("Face Recognition System")
         self.win.geometry("1000x600")
+        self.win.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Camera Display Frame
         self.frame_left_camera = tk.Frame(self.win)
         self.label = tk.Label(self.frame_left_camera)
         self.label.pack()
         self.frame_left_camera.pack(side=tk.LEFT)
+        # Same persistent preview image as the attendance window, unthrottled
+        self.preview = PreviewRenderer(self.label, max_fps=0)
+        self.preview.watch_visibility(self.win)
 
         # Right Panel - Info and Controls
         self.frame_right_info = tk.Frame(self.win)
@@ -143,7 +173,9 @@ class FaceRegister:
             self.win.after(20, self.process)
             return
 
-        faces = detector(self.current_frame, 0)
+        faces = registry.detector(self.current_frame, 0)
+        self.clean_frame = self.current_frame.copy() if len(faces) else None
+        self.current_face = faces[-1] if len(faces) else None
 
         # Update the number of faces in the current frame
         self.current_frame_faces_cnt = len(faces)
@@ -167,13 +199,14 @@ class FaceRegister:
             self.face_ROI_width = x2 - x1
 
         try:
-            img_Image = Image.fromarray(self.current_frame)
-            img_PhotoImage = ImageTk.PhotoImage(image=img_Image)
-            self.label.img_tk = img_PhotoImage
-            self.label.configure(image=img_PhotoImage)
+            if self.preview.due():
+                self.preview.show(self.current_frame)
         except Exception as e:
             print("❌ Error converting frame to Tkinter format:", e)
 
+        while not self._embed_messages.empty():
+            self.log_all["text"] = self._embed_messages.get_nowait()
+
         self.win.after(20, self.process)
 
     def update_fps(self):
@@ -190,6 +223,9 @@ class FaceRegister:
         folders_rd = os.listdir(self.path_photos_from_camera)
         for i in range(len(folders_rd)):
             shutil.rmtree(self.path_photos_from_camera + folders_rd[i])
+        # Registration writes people straight into the gallery, so they go from there too,
+        # after any update still queued for them
+        self._embed_jobs.put(("clear",))
         self.label_face_cnt["text"] = "0"
         self.existing_faces_cnt = 0
         self.log_all["text"] = "Face images removed!"
@@ -217,11 +253,121 @@ class FaceRegister:
             self.log_all["text"] = "❌ No face detected."
             return
 
+        shape = None
+        if self.clean_frame is not None:
+            face = self.current_face
+            shape = registry.predictor(self.clean_frame, face)
+            reason = self.quality.check(self.clean_frame, (face.left(), face.top(), face.right(), face.bottom()), shape)
+            if reason is not None:
+                self.log_all["text"] = f"❌ Face rejected ({reason}), photo not saved. Please try again."
+                return
+
+        # Crop from the frame before the ROI rectangle was drawn on it
+        frame = self.clean_frame if self.clean_frame is not None else self.current_frame
         filename = f"{self.current_face_dir}/{self.ss_cnt}.jpg"
-        cv2.imwrite(filename, self.current_frame[self.face_ROI_height_start:self.face_ROI_height_start + self.face_ROI_height, 
-                                                 self.face_ROI_width_start:self.face_ROI_width_start + self.face_ROI_width])
+        cv2.imwrite(filename, frame[self.face_ROI_height_start:self.face_ROI_height_start + self.face_ROI_height,
+                                    self.face_ROI_width_start:self.face_ROI_width_start + self.face_ROI_width])
         self.ss_cnt += 1
-        self.log_all["text"] = f"Face image {self.ss_cnt} saved!"
+
+        if shape is not None:
+            self._embed_jobs.put(("embed", filename, self.current_face_dir, self.clean_frame, self.current_face,
+                                  shape, (self.face_ROI_width_start, self.face_ROI_height_start)))
+            self.log_all["text"] = f"Face image {self.ss_cnt} saved, adding to the gallery..."
+        else:
+            # features_extraction_to_csv.py re-detects photos without a saved embedding
+            self.log_all["text"] = f"Face image {self.ss_cnt} saved!"
+
+    def _embed_loop(self):
+        # Embeds saved photos as they arrive; a person's gallery rows are rewritten once
+        # no photo has arrived for GALLERY_UPDATE_DELAY seconds
+        pending = []
+        while True:
+            try:
+                job = self._embed_jobs.get(timeout=GALLERY_UPDATE_DELAY if pending else None)
+            except queue.Empty:
+                job = ("update",)
+            if job[0] == "embed":
+                if self.embed_face(*job[1:]) and job[2] not in pending:
+                    pending.append(job[2])
+                continue
+            if job[0] == "clear":
+                pending = []
+                clear_gallery()
+                continue
+            for face_dir in pending:
+                self.update_gallery(face_dir)
+            pending = []
+            if job[0] == "stop":
+                return
+
+    def on_close(self):
+        # Write the gallery rows of the last photos before leaving
+        self._embed_jobs.put(("stop",))
+        self._embed_thread.join()
+        self.win.destroy()
+
+    def embed_face(self, filename, face_dir, frame, face, shape, origin):
+        # Landmarks and 128D descriptor from the detection already made, saved next to
+        # the photo; origin is the top-left corner of the saved crop in the frame
+        try:
+            descriptor = registry.face_reco_model.compute_face_descriptor(frame, shape)
+            x0, y0 = origin
+            rect = (face.left() - x0, face.top() - y0, face.right() - x0, face.bottom() - y0)
+            landmarks = [(shape.part(i).x - x0, shape.part(i).y - y0) for i in range(shape.num_parts)]
+            # Only faces that passed the quality gate get this far
+            save_sidecar(filename, rect, landmarks, descriptor, quality=(self.quality.key(), None))
+            return True
+        except Exception as e:
+            logger.error(f"Error embedding {filename}: {e}")
+            self._embed_messages.put(f"❌ Could not embed {os.path.basename(filename)}, run features_extraction_to_csv.py")
+            return False
+
+    def update_gallery(self, face_dir):
+        # Replace the person's prototypes in the gallery so they are recognizable without
+        # running features_extraction_to_csv.py
+        try:
+            count = upsert_face(person_name(face_dir), select_prototypes(self.folder_descriptors(face_dir)))
+            self._embed_messages.put(f"{person_name(face_dir)} added to the gallery ({count} rows)")
+        except Exception as e:
+            logger.error(f"Error updating the gallery for {face_dir}: {e}")
+            self._embed_messages.put(f"❌ Gallery not updated for {person_name(face_dir)}")
+
+    def folder_descriptors(self, face_dir):
+        # Descriptors of every photo in face_dir, so the prototypes replacing the
+        # person's gallery rows still cover photos saved without a sidecar (older
+        # captures, photos added by hand): from the embedding cache, else detected once
+        # here and kept as a sidecar (or cached, when no usable face is found)
+        descriptors = []
+        cache = None
+        for photo in sorted(os.listdir(face_dir)):
+            if not is_image(photo):
+                continue
+            path_img = f"{face_dir}/{photo}"
+            captured = read_sidecar(path_img)
+            if captured is not None:
+                verdict = captured[3]
+                if verdict is None or verdict[1] is None:
+                    descriptors.append(captured[2])
+                continue
+            if cache is None:
+                cache = EmbeddingCache().load()
+            entry = cache.get(path_img)
+            if entry is not None:
+                if entry.has_face and (entry.quality is None or entry.quality[1] is None):
+                    descriptors.append(entry.descriptor)
+                continue
+            from features_extraction_to_csv import detect_and_describe
+            result = detect_and_describe(path_img)
+            if result is not None and result[2] is not None:
+                save_sidecar(path_img, *result[:3], quality=(self.quality.key(), None))
+                descriptors.append(result[2])
+            elif result is not None:
+                cache.put(path_img, *result[:2], quality=(self.quality.key(), result[3]))
+            else:
+                cache.put(path_img)
+        if cache is not None and cache.dirty:
+            cache.save()
+        return descriptors
 
 if __name__ == "__main__":
     app = FaceRegister()
@@ -0,0 +1,113 @@
+# Server side of kiosk ingest: batches of recognition events from many kiosks merged
+# into the central attendance table
+#
+# A batch is {"kiosk_id": ..., "batch_id": ..., "events": [{"name", "time", "distance"}]}
+# with ISO timestamps in the kiosk's local time. Each batch commits in one transaction;
+# (kiosk_id, batch_id) is recorded with it, so a batch retried after a lost response
+# is acknowledged again without being applied twice. Within UNIQUE(name, date) the
+# earliest time wins, whatever order the kiosks deliver in.
+
+import datetime
+import logging
+import os
+
+import rollups
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_EVENTS = 1000
+#  Bytes of JSON after decompression, well above MAX_BATCH_EVENTS events
+MAX_BATCH_BYTES = 1 << 20
+#  Events matched further away than this are not attendance (face_matcher's 0.4)
+MAX_DISTANCE = float(os.environ.get("ATTENDANCE_INGEST_MAX_DISTANCE", "0.4"))
+
+
+class BatchError(ValueError):
+    pass
+
+
+def create_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingest_batches
+                    (kiosk_id TEXT NOT NULL, batch_id TEXT NOT NULL, received_at TEXT NOT NULL,
+                    events INTEGER NOT NULL, inserted INTEGER NOT NULL, moved INTEGER NOT NULL,
+                    PRIMARY KEY (kiosk_id, batch_id))''')
+
+
+def parse_batch(payload):
+    # Validated (kiosk_id, batch_id, [(name, datetime, distance)]); raises BatchError
+    if not isinstance(payload, dict):
+        raise BatchError("expected a JSON object")
+    kiosk_id, batch_id, events = payload.get("kiosk_id"), payload.get("batch_id"), payload.get("events")
+    if not isinstance(kiosk_id, str) or not kiosk_id or len(kiosk_id) > 64:
+        raise BatchError("kiosk_id must be a non-empty string of at most 64 characters")
+    if not isinstance(batch_id, str) or not batch_id or len(batch_id) > 64:
+        raise BatchError("batch_id must be a non-empty string of at most 64 characters")
+    if not isinstance(events, list) or len(events) > MAX_BATCH_EVENTS:
+        raise BatchError(f"events must be a list of at most {MAX_BATCH_EVENTS} events")
+    parsed = []
+    for i, event in enumerate(events):
+        try:
+            name = event["name"]
+            when = datetime.datetime.fromisoformat(event["time"])
+            distance = event.get("distance")
+            if not isinstance(name, str) or not name:
+                raise ValueError("empty name")
+            if distance is not None:
+                distance = float(distance)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise BatchError(f"event {i}: expected name, ISO time and optional distance ({e})")
+        parsed.append((name, when, distance))
+    return kiosk_id, batch_id, parsed
+
+
+def apply_batch(conn, kiosk_id, batch_id, events):
+    # conn must be in autocommit mode (isolation_level=None); returns the batch summary
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT events, inserted, moved FROM ingest_batches WHERE kiosk_id = ? AND batch_id = ?",
+                           (kiosk_id, batch_id)).fetchone()
+        if row is not None:
+            conn.execute("ROLLBACK")
+            return {"batch_id": batch_id, "duplicate": True, "events": row[0], "inserted": row[1], "moved": row[2]}
+
+        # Earliest event per (name, date) within the batch first
+        earliest = {}
+        rejected = 0
+        for name, when, distance in events:
+            if distance is not None and distance > MAX_DISTANCE:
+                rejected += 1
+                continue
+            key = (name, when.strftime('%Y-%m-%d'))
+            current_time = when.strftime('%H:%M:%S')
+            if key not in earliest or current_time < earliest[key]:
+                earliest[key] = current_time
+
+        inserted = []
+        moved = 0
+        touched = set()
+        for (name, day), t in earliest.items():
+            existing = conn.execute("SELECT time FROM attendance WHERE name = ? AND date = ?", (name, day)).fetchone()
+            if existing is None:
+                conn.execute("INSERT INTO attendance (name, time, date) VALUES (?, ?, ?)", (name, t, day))
+                inserted.append((name, t, day))
+                touched.add(day)
+            elif t < existing[0]:
+                conn.execute("UPDATE attendance SET time = ? WHERE name = ? AND date = ?", (t, name, day))
+                rollups.move_time(conn, name, day, existing[0], t)
+                moved += 1
+                touched.add(day)
+        rollups.apply_rows(conn, inserted)
+        if touched:
+            rollups.record_change(conn, min(touched), max(touched))
+        conn.execute("INSERT INTO ingest_batches VALUES (?, ?, ?, ?, ?, ?)",
+                     (kiosk_id, batch_id, datetime.datetime.now().isoformat(timespec="seconds"),
+                      len(events), len(inserted), moved))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if rejected:
+        logger.warning("Kiosk %s batch %s: %d events above distance %.2f ignored",
+                       kiosk_id, batch_id, rejected, MAX_DISTANCE)
+    return {"batch_id": batch_id, "duplicate": False, "events": len(events), "inserted": len(inserted),
+            "moved": moved}
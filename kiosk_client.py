@@ -0,0 +1,217 @@
+# Kiosk side of central ingest: new attendance marks go to an on-disk outbox and a
+# background thread posts them to the viewer's /api/ingest in gzip-compressed batches
+#
+#   ATTENDANCE_INGEST_URL=http://viewer:5000/api/ingest ATTENDANCE_KIOSK_ID=door-1 python attendance_taker.py
+#
+# The outbox is a small SQLite file, so marks survive restarts and network outages and
+# the local attendance.db keeps working either way. A batch keeps its batch_id until
+# the server acknowledges it, so a retry after a lost response is not applied twice.
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = "data/outbox.db"
+BATCH_SIZE = 200
+#  Seconds between sends while there is nothing to retry
+SEND_INTERVAL = 2.0
+#  Retry backoff after a failed send, doubled up to MAX_BACKOFF with some jitter
+BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+TIMEOUT = 10.0
+
+
+class Outbox:
+    def __init__(self, path=OUTBOX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS outbox
+                             (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, time TEXT NOT NULL,
+                             distance REAL, batch_id TEXT)''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_batch ON outbox(batch_id)")
+        self._lock = threading.Lock()
+
+    def add(self, name, when, distance=None):
+        with self._lock:
+            self.conn.execute("INSERT INTO outbox (name, time, distance) VALUES (?, ?, ?)",
+                              (name, when.isoformat(timespec="seconds"), None if distance is None else float(distance)))
+
+    def next_batch(self, limit=BATCH_SIZE):
+        # (batch_id, events) to send: an unacknowledged batch again, else up to `limit`
+        # of the oldest unbatched events under a new id; None when empty
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT batch_id FROM outbox WHERE batch_id IS NOT NULL "
+                                        "ORDER BY id LIMIT 1").fetchone()
+                batch_id = row[0] if row else None
+                if batch_id is None:
+                    ids = [i for (i,) in self.conn.execute(
+                        "SELECT id FROM outbox WHERE batch_id IS NULL ORDER BY id LIMIT ?", (limit,))]
+                    if ids:
+                        batch_id = uuid.uuid4().hex
+                        self.conn.execute(f"UPDATE outbox SET batch_id = ? WHERE id IN ({','.join('?' * len(ids))})",
+                                          [batch_id] + ids)
+                events = []
+                if batch_id is not None:
+                    events = [{"name": name, "time": t, "distance": distance} for name, t, distance in
+                              self.conn.execute("SELECT name, time, distance FROM outbox WHERE batch_id = ? "
+                                                "ORDER BY id", (batch_id,))]
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return (batch_id, events) if batch_id is not None else None
+
+    def ack(self, batch_id):
+        with self._lock:
+            self.conn.execute("DELETE FROM outbox WHERE batch_id = ?", (batch_id,))
+
+    def pending(self):
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM outbox").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class IngestClient:
+    def __init__(self, url, kiosk_id=None, outbox_path=OUTBOX_PATH, batch_size=BATCH_SIZE,
+                 interval=SEND_INTERVAL, token=None, timeout=TIMEOUT, compress=True):
+        self.url = url
+        self.kiosk_id = kiosk_id or socket.gethostname()
+        self.outbox = Outbox(outbox_path)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.token = token
+        self.timeout = timeout
+        self.compress = compress
+        self.batches_sent = 0
+        self.events_sent = 0
+        self.failures = 0
+        self.last_error = None
+        self._backoff = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="ingest-client", daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, name, when=None, distance=None):
+        # Called from the recognition thread; only touches the local outbox
+        when = when or datetime.datetime.now()
+        self.outbox.add(name, when, distance)
+        self._wake.set()
+
+    def _post(self, batch_id, events):
+        body = json.dumps({"kiosk_id": self.kiosk_id, "batch_id": batch_id, "events": events}).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def send_once(self):
+        # Send one batch; True if one was acknowledged, False if the outbox is empty.
+        # Network errors and 5xx raise so the caller backs off.
+        batch = self.outbox.next_batch(self.batch_size)
+        if batch is None:
+            return False
+        batch_id, events = batch
+        try:
+            self._post(batch_id, events)
+        except urllib.error.HTTPError as e:
+            if e.code in (400, 413):
+                # The server will never take this batch; keep the queue moving
+                logger.error(f"Ingest rejected batch {batch_id} ({len(events)} events): {e.code} {e.read()[:200]!r}")
+                self.outbox.ack(batch_id)
+                return True
+            raise
+        self.outbox.ack(batch_id)
+        self.batches_sent += 1
+        self.events_sent += len(events)
+        return True
+
+    def flush(self):
+        # Send everything that is queued now; stops at the first failure
+        try:
+            while self.send_once():
+                pass
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            return False
+
+    def _loop(self):
+        while not self._stop.is_set():
+            # New marks are sent right away and batches form from whatever queued up
+            # meanwhile; after a failure a new mark does not cut the backoff short
+            if self._backoff:
+                self._stop.wait(self._backoff)
+            else:
+                self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                while self.send_once() and not self._stop.is_set():
+                    pass
+                self._backoff = 0.0
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                self._backoff = min(MAX_BACKOFF, max(BACKOFF, self._backoff * 2)) * random.uniform(0.8, 1.2)
+                logger.warning("Ingest to %s failed (%s), %d events kept, retrying in %.0fs",
+                               self.url, e, self.outbox.pending(), self._backoff)
+
+    def stop(self, flush_timeout=5.0):
+        # Best-effort last send; whatever is left stays in the outbox for next time
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        deadline = time.monotonic() + flush_timeout
+        while time.monotonic() < deadline and self.outbox.pending():
+            if not self.flush():
+                break
+        logger.info("Ingest client stopped, %d events left in the outbox", self.outbox.pending())
+        self.outbox.close()
+
+    def stats(self):
+        return {"batches_sent": self.batches_sent, "events_sent": self.events_sent, "failures": self.failures,
+                "pending": self.outbox.pending(), "last_error": self.last_error}
+
+
+def client_from_env(environ=os.environ):
+    # Started IngestClient when ATTENDANCE_INGEST_URL is set, else None:
+    #   ATTENDANCE_INGEST_URL     http://<viewer>/api/ingest
+    #   ATTENDANCE_KIOSK_ID       defaults to the host name
+    #   ATTENDANCE_INGEST_TOKEN   bearer token, if the server requires one
+    #   ATTENDANCE_OUTBOX         outbox file (default data/outbox.db)
+    url = environ.get("ATTENDANCE_INGEST_URL")
+    if not url:
+        return None
+    return IngestClient(url, environ.get("ATTENDANCE_KIOSK_ID"), environ.get("ATTENDANCE_OUTBOX", OUTBOX_PATH),
+                        token=environ.get("ATTENDANCE_INGEST_TOKEN")).start()
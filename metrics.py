@@ -0,0 +1,286 @@
+# Low-overhead hot-path instrumentation: per-stage latency histograms, counters and
+# gauges, served as Prometheus text on a local HTTP port and/or logged as JSON lines
+#
+#   ATTENDANCE_METRICS_PORT=9108 python attendance_taker.py
+#   curl -s localhost:9108/metrics
+#
+# A disabled Metrics object turns every call into an attribute check and a return, so
+# instrumented code can call it unconditionally.
+
+import bisect
+import datetime
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#  Histogram bucket upper bounds in seconds, from sub-millisecond matching to slow detections
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+#  Most recent samples per stage used for the rolling quantiles
+WINDOW = 1024
+PREFIX = "attendance"
+
+METRICS_PORT = 9108
+LOG_INTERVAL = 60.0
+
+
+class Histogram:
+    # Cumulative bucket counts since start (what Prometheus wants) plus a ring buffer of
+    # the last `window` samples for quantiles of recent behaviour
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._recent = np.zeros(window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self._recent[self.count % len(self._recent)] = seconds
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def recent(self):
+        with self._lock:
+            return self._recent[:min(self.count, len(self._recent))].copy()
+
+    def snapshot(self):
+        recent = self.recent()
+        snap = {"count": self.count, "sum_s": round(self.sum, 6), "max_ms": round(self.max * 1000, 3)}
+        if len(recent):
+            p50, p95, p99 = np.percentile(recent, (50, 95, 99)) * 1000
+            snap.update(p50_ms=round(float(p50), 3), p95_ms=round(float(p95), 3), p99_ms=round(float(p99), 3))
+        return snap
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    def __init__(self, enabled=True, window=WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def timer(self, stage):
+        # with metrics.timer("detect"): ...
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        hist = self.histograms.get(stage)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(stage, Histogram(window=self.window))
+        hist.observe(seconds)
+
+    def inc(self, name, n=1):
+        if not self.enabled or not n:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": counters,
+            "gauges": dict(self.gauges),
+            "stages": {stage: hist.snapshot() for stage, hist in sorted(histograms.items())},
+        }
+
+    def prometheus(self):
+        # Prometheus text exposition format 0.0.4
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        for name, value in counters:
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total {value}")
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+
+        if histograms:
+            lines.append(f"# HELP {PREFIX}_stage_seconds Latency of each recognizer stage")
+            lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+            for stage, hist in histograms:
+                with hist._lock:
+                    counts, total, count = list(hist.counts), hist.sum, hist.count
+                cumulative = 0
+                for bound, n in zip(hist.bounds, counts):
+                    cumulative += n
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+            lines.append(f"# HELP {PREFIX}_stage_recent_seconds Quantiles over the last {self.window} samples")
+            lines.append(f"# TYPE {PREFIX}_stage_recent_seconds summary")
+            for stage, hist in histograms:
+                recent = hist.recent()
+                if not len(recent):
+                    continue
+                for q, value in zip((0.5, 0.95, 0.99), np.percentile(recent, (50, 95, 99))):
+                    lines.append(f'{PREFIX}_stage_recent_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'{PREFIX}_stage_recent_seconds_sum{{stage="{stage}"}} {recent.sum():.6f}')
+                lines.append(f'{PREFIX}_stage_recent_seconds_count{{stage="{stage}"}} {len(recent)}')
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_mb():
+    # Resident set size of this process in MB (Linux /proc, else peak RSS)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+#  Shared no-op instance for code running without instrumentation
+DISABLED = Metrics(enabled=False)
+
+
+class MetricsServer:
+    # GET /metrics on a background thread; binds to localhost unless told otherwise
+    def __init__(self, metrics, port=METRICS_PORT, host="127.0.0.1"):
+        self.metrics = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] not in ("/metrics", "/"):
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info("Metrics on http://%s:%d/metrics", *self.httpd.server_address[:2])
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsLogger:
+    # Appends metrics.snapshot() as one JSON line every `interval` seconds, and once more on stop
+    def __init__(self, metrics, path, interval=LOG_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="metrics-log", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(self.metrics.snapshot()) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing metrics log: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+def metrics_from_env(environ=os.environ):
+    # Instrumentation is off unless an endpoint or log is configured:
+    #   ATTENDANCE_METRICS_PORT          serve Prometheus text on this port
+    #   ATTENDANCE_METRICS_LOG           append JSON snapshots to this file
+    #   ATTENDANCE_METRICS_LOG_INTERVAL  seconds between snapshots (default 60)
+    #   ATTENDANCE_METRICS=1             collect without exporting (e.g. for the GUI)
+    # Returns (metrics, [started exporters with a stop() method]).
+    port = environ.get("ATTENDANCE_METRICS_PORT")
+    log_path = environ.get("ATTENDANCE_METRICS_LOG")
+    enabled = bool(port or log_path) or environ.get("ATTENDANCE_METRICS", "0") not in ("", "0", "off", "false")
+    if not enabled:
+        return DISABLED, []
+    return start_metrics(int(port) if port else None, log_path,
+                         float(environ.get("ATTENDANCE_METRICS_LOG_INTERVAL", LOG_INTERVAL)))
+
+
+def start_metrics(port=None, log_path=None, log_interval=LOG_INTERVAL):
+    metrics = Metrics()
+    exporters = []
+    if port:
+        try:
+            exporters.append(MetricsServer(metrics, port).start())
+        except OSError as e:
+            logger.error(f"Cannot serve metrics on port {port}: {e}")
+    if log_path:
+        exporters.append(MetricsLogger(metrics, log_path, log_interval).start())
+    return metrics, exporters
@@ -0,0 +1,106 @@
+# Lazily loaded, per-process dlib models shared by the capture, extraction and
+# recognition scripts
+#
+# Nothing is imported or read from disk until a model is first asked for, so --help,
+# imports from tests and scripts that only need the detector stay fast. warm_up()
+# loads models on a background thread while a UI comes up; get() waits for a model
+# that is still loading instead of loading it twice.
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREDICTOR_PATH = 'data/data_dlib/shape_predictor_68_face_landmarks.dat'
+RESNET_PATH = 'data/data_dlib/dlib_face_recognition_resnet_model_v1.dat'
+
+MODEL_NAMES = ("detector", "predictor", "face_reco_model")
+
+
+class ModelRegistry:
+    def __init__(self, predictor_path=PREDICTOR_PATH, resnet_path=RESNET_PATH):
+        self.predictor_path = predictor_path
+        self.resnet_path = resnet_path
+        self._models = {}
+        # One lock per model so a slow ResNet load does not hold up the detector
+        self._locks = {name: threading.Lock() for name in MODEL_NAMES}
+        #  Seconds each model took to load, for startup reports
+        self.load_seconds = {}
+
+    def _load(self, name):
+        import dlib
+        if name == "detector":
+            return dlib.get_frontal_face_detector()
+        if name == "predictor":
+            return dlib.shape_predictor(self.predictor_path)
+        if name == "face_reco_model":
+            return dlib.face_recognition_model_v1(self.resnet_path)
+        raise KeyError(name)
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._load(name)
+                self.load_seconds[name] = time.perf_counter() - start
+                self._models[name] = model
+                logger.info("Loaded %s in %.2fs", name, self.load_seconds[name])
+        return model
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    @property
+    def detector(self):
+        return self.get("detector")
+
+    @property
+    def predictor(self):
+        return self.get("predictor")
+
+    @property
+    def face_reco_model(self):
+        return self.get("face_reco_model")
+
+    def models(self):
+        # (detector, predictor, face_reco_model), loading whatever is missing
+        return tuple(self.get(name) for name in MODEL_NAMES)
+
+    def warm_up(self, names=MODEL_NAMES, background=True):
+        # Load models ahead of first use; with background=True returns the daemon
+        # thread doing it so the caller can carry on building its UI
+        def load():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    # Reported again, with a traceback, by whoever calls get() for real
+                    logger.error(f"Error loading {name}: {e}")
+
+        if not background:
+            load()
+            return None
+        thread = threading.Thread(target=load, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+#  Per-process registry. Processes forked after a model is loaded inherit it.
+registry = ModelRegistry()
+
+
+def get_detector():
+    return registry.get("detector")
+
+
+def get_predictor():
+    return registry.get("predictor")
+
+
+def get_face_reco_model():
+    return registry.get("face_reco_model")
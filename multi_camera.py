@@ -0,0 +1,296 @@
+# Multi-camera server mode: one recognition worker process per stream, a gallery shared
+# read-only through the memory-mapped gallery file, and a single attendance writer
+#
+#   python multi_camera.py --camera door-1=rtsp://10.0.0.11/stream --camera door-2=rtsp://10.0.0.12/stream
+#   python multi_camera.py --config cameras.json      # [{"id": "door-1", "source": "rtsp://..."}, ...]
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+#  Restart backoff for dead streams, doubled on every consecutive failure
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+#  A worker that ran this long is considered healthy again
+STABLE_RUN_SECONDS = 60.0
+#  Seconds between FPS reports
+REPORT_INTERVAL = 10.0
+#  A live worker that sent nothing for this long is stuck (e.g. an RTSP read that
+#  blocks instead of failing) and gets restarted. Covers model loading and stream open.
+STALL_SECONDS = 60.0
+#  Imported once by the fork server, so workers start without re-importing them
+WORKER_PRELOAD = ["recognition_engine", "face_matcher", "gallery_store", "gallery_watcher", "model_registry"]
+
+
+def worker_context():
+    # Workers are started while the supervisor's writer and ingest threads are running,
+    # and forking a threaded process can leave a child stuck on a lock one of those
+    # threads held. The fork server is a clean single-threaded process instead.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["__main__"] + WORKER_PRELOAD)
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def load_models():
+    # dlib models, loaded once per worker process
+    from model_registry import registry
+    return registry.models()
+
+
+class QueueStore:
+    # Stand-in for AttendanceStore inside a worker: dedups locally and forwards new marks
+    # to the supervisor, which owns the only database connection
+    def __init__(self, camera_id, events):
+        self.camera_id = camera_id
+        self.events = events
+        self._marked = set()
+
+    def mark(self, name, when=None):
+        when = when or datetime.datetime.now()
+        key = (name, when.strftime('%Y-%m-%d'))
+        if key in self._marked:
+            return None
+        self._marked.add(key)
+        self.events.put(("mark", self.camera_id, name, when.isoformat()))
+        return key[1], when.strftime('%H:%M:%S')
+
+
+class StatsReporter:
+    # Engine consumer sending the worker's frame count to the supervisor every second
+    def __init__(self, camera_id, events, interval=1.0):
+        self.camera_id = camera_id
+        self.events = events
+        self.interval = interval
+        self.frames = 0
+        self.last_sent = 0.0
+
+    def __call__(self, result):
+        self.frames += 1
+        now = time.time()
+        if now - self.last_sent >= self.interval:
+            self.last_sent = now
+            self.events.put(("stats", self.camera_id, self.frames, now))
+
+
+def camera_worker(camera_id, source, gallery_path, events, max_fps=None):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{camera_id}] %(levelname)s %(message)s")
+    from face_matcher import GalleryMatcher
+    from gallery_store import load_gallery
+    from recognition_engine import RecognitionEngine, iter_source
+    from gallery_watcher import GalleryWatcher
+
+    detector, predictor, face_reco_model = load_models()
+    # np.memmap over the shared gallery file: no per-process copy of the descriptors
+    matcher = GalleryMatcher.from_arrays(*load_gallery(gallery_path))
+    engine = RecognitionEngine(detector, predictor, face_reco_model, matcher, QueueStore(camera_id, events))
+    # Each worker re-maps the gallery file when it is replaced
+    GalleryWatcher(engine, gallery_path).start()
+    reporter = StatsReporter(camera_id, events)
+    try:
+        engine.run(iter_source(source), [reporter], max_fps)
+    except Exception as e:
+        logger.error(f"Stream {source} failed: {e}")
+        sys.exit(1)
+    # A recorded file ending is normal, a live stream ending means it dropped
+    sys.exit(0 if os.path.isfile(source) or os.path.isdir(source) else 1)
+
+
+class CameraProcess:
+    def __init__(self, camera_id, source):
+        self.camera_id = camera_id
+        self.source = source
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+        self.finished = False
+        self.frames = 0
+        self.fps = 0.0
+        self._last_stats = None
+        #  When the supervisor last heard from the worker, for the stall watchdog
+        self.last_event = 0.0
+
+
+class Supervisor:
+    def __init__(self, cameras, gallery_path, db_path="attendance.db", max_fps=None,
+                 report_interval=REPORT_INTERVAL):
+        self.cameras = [CameraProcess(camera_id, source) for camera_id, source in cameras]
+        self.gallery_path = gallery_path
+        self.db_path = db_path
+        self.max_fps = max_fps
+        self.report_interval = report_interval
+        self.ctx = worker_context()
+        self.events = self.ctx.Queue()
+        self.store = None
+        # Optional kiosk_client.IngestClient forwarding marks to a central viewer
+        self.ingest = None
+
+    def start_worker(self, camera):
+        camera.process = self.ctx.Process(
+            target=camera_worker, name=f"camera-{camera.camera_id}",
+            args=(camera.camera_id, camera.source, self.gallery_path, self.events, self.max_fps),
+            daemon=True)
+        camera.process.start()
+        camera.started_at = camera.last_event = time.time()
+        camera._last_stats = None
+        logger.info("Started worker for %s (pid %d)", camera.camera_id, camera.process.pid)
+
+    def check_workers(self):
+        now = time.time()
+        for camera in self.cameras:
+            if camera.finished:
+                continue
+            if camera.process is None:
+                if now >= camera.restart_at:
+                    self.start_worker(camera)
+                continue
+            if camera.process.is_alive():
+                if now - camera.last_event < STALL_SECONDS:
+                    continue
+                logger.warning("%s sent nothing for %.0fs, restarting it", camera.camera_id,
+                               now - camera.last_event)
+                camera.process.terminate()
+                camera.process.join(5)
+                if camera.process.is_alive():
+                    camera.process.kill()
+                    camera.process.join()
+
+            exitcode = camera.process.exitcode
+            camera.process = None
+            camera.fps = 0.0
+            if exitcode == 0:
+                logger.info("%s finished", camera.camera_id)
+                camera.finished = True
+                continue
+            if now - camera.started_at >= STABLE_RUN_SECONDS:
+                camera.failures = 0
+            backoff = min(MAX_RESTART_BACKOFF, RESTART_BACKOFF * 2 ** camera.failures)
+            camera.failures += 1
+            camera.restart_at = now + backoff
+            logger.warning("%s exited with code %s, restarting in %.0fs", camera.camera_id, exitcode, backoff)
+
+    def handle_event(self, event):
+        kind, camera_id = event[0], event[1]
+        camera = next((c for c in self.cameras if c.camera_id == camera_id), None)
+        if camera is not None:
+            camera.last_event = time.time()
+        if kind == "mark":
+            _, _, name, when = event
+            when = datetime.datetime.fromisoformat(when)
+            if self.store.mark(name, when) is not None:
+                logger.info("%s marked present (%s)", name, camera_id)
+                if self.ingest is not None:
+                    try:
+                        self.ingest.add(name, when)
+                    except Exception as e:
+                        logger.error(f"Error queueing {name} for ingest: {e}")
+        elif kind == "stats" and camera is not None:
+            _, _, frames, at = event
+            if camera._last_stats is not None and at > camera._last_stats[1]:
+                camera.fps = (frames - camera._last_stats[0]) / (at - camera._last_stats[1])
+            camera.frames += frames - (camera._last_stats[0] if camera._last_stats else 0)
+            camera._last_stats = (frames, at)
+
+    def report(self):
+        total = sum(camera.fps for camera in self.cameras)
+        per_camera = ", ".join(f"{camera.camera_id}={camera.fps:.1f}" for camera in self.cameras)
+        logger.info("Aggregate %.1f fps (%s)", total, per_camera)
+
+    def run(self):
+        from attendance_store import AttendanceStore
+        from kiosk_client import client_from_env
+
+        self.store = AttendanceStore(self.db_path)
+        self.ingest = client_from_env()
+        next_report = time.time() + self.report_interval
+        try:
+            while not all(camera.finished for camera in self.cameras):
+                self.check_workers()
+                try:
+                    self.handle_event(self.events.get(timeout=0.5))
+                    # Drain whatever else is waiting before checking workers again
+                    while True:
+                        self.handle_event(self.events.get_nowait())
+                except queue.Empty:
+                    pass
+                if time.time() >= next_report:
+                    next_report = time.time() + self.report_interval
+                    self.report()
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+        finally:
+            for camera in self.cameras:
+                if camera.process is not None and camera.process.is_alive():
+                    camera.process.terminate()
+                    camera.process.join(5)
+            # Marks sent by workers right before they stopped
+            try:
+                while True:
+                    event = self.events.get(timeout=0.2)
+                    if event[0] == "mark":
+                        self.handle_event(event)
+            except queue.Empty:
+                pass
+            self.store.close()
+            if self.ingest is not None:
+                self.ingest.stop()
+            self.report()
+
+
+def prepare_gallery(gallery_path, csv_path):
+    # Workers need the binary gallery to share it; convert the CSV once if that is all there is
+    from gallery_store import convert_csv
+
+    if os.path.exists(gallery_path):
+        return gallery_path
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Neither {gallery_path} nor {csv_path} exists")
+    logger.info("Converting %s into %s so workers can share it", csv_path, gallery_path)
+    convert_csv(csv_path, gallery_path)
+    return gallery_path
+
+
+def main(argv=None):
+    from gallery_store import GALLERY_PATH, CSV_PATH
+
+    parser = argparse.ArgumentParser(description="Run one recognition worker per camera")
+    parser.add_argument('--camera', action='append', default=[], metavar='ID=SOURCE',
+                        help="Camera id and source (index, file, rtsp:// URL); repeatable")
+    parser.add_argument('--config', help="JSON list of {\"id\": ..., \"source\": ...}")
+    parser.add_argument('--gallery', default=GALLERY_PATH)
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--db', default="attendance.db")
+    parser.add_argument('--max-fps', type=float, default=None, help="Per-camera frame rate cap")
+    parser.add_argument('--report-interval', type=float, default=REPORT_INTERVAL)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [supervisor] %(levelname)s %(message)s")
+
+    cameras = []
+    if args.config:
+        with open(args.config) as f:
+            cameras += [(str(c["id"]), str(c["source"])) for c in json.load(f)]
+    for spec in args.camera:
+        camera_id, sep, source = spec.partition("=")
+        if not sep:
+            parser.error(f"--camera expects ID=SOURCE, got {spec!r}")
+        cameras.append((camera_id, source))
+    if not cameras:
+        parser.error("no cameras configured")
+
+    gallery_path = prepare_gallery(args.gallery, args.csv)
+    Supervisor(cameras, gallery_path, args.db, args.max_fps, args.report_interval).run()
+
+
+if __name__ == '__main__':
+    main()
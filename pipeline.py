@@ -0,0 +1,168 @@
+# Threaded capture -> recognize -> render pipeline with bounded, drop-oldest queues
+# for frames and results, and an unbounded queue for events that must not be dropped
+
+import collections
+import itertools
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DropOldestQueue:
+    # Bounded queue that never blocks the producer: when full, the oldest item is
+    # discarded so consumers always see the freshest data
+    def __init__(self, maxsize=1):
+        self.maxsize = max(1, maxsize)
+        self.dropped = 0
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        # Oldest queued item, or None if nothing arrived within timeout
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def get_nowait(self):
+        with self._cond:
+            return self._items.popleft() if self._items else None
+
+
+class StageStats:
+    def __init__(self, name, alpha=0.1):
+        self.name = name
+        self.alpha = alpha
+        self.count = 0
+        self.last_ms = 0.0
+        self.avg_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.count += 1
+        self.last_ms = ms
+        self.avg_ms = ms if self.count == 1 else self.avg_ms + self.alpha * (ms - self.avg_ms)
+        self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self):
+        return {"count": self.count, "last_ms": round(self.last_ms, 2),
+                "avg_ms": round(self.avg_ms, 2), "max_ms": round(self.max_ms, 2)}
+
+
+class FramePipeline:
+    # read_frame() -> (ret, frame) runs on the capture thread and always overwrites the
+    # single pending frame, so stale driver frames never pile up. process(frame) -> result
+    # runs on the worker thread(s). The UI thread pulls finished results with
+    # get_result() and reports its own render time through record_render().
+    # events(result) -> items, if given, picks what must reach the UI even when its
+    # result is dropped (attendance marks); get_events() returns all of them.
+
+    def __init__(self, read_frame, process, workers=1, frame_queue_size=1, result_queue_size=2,
+                 events=None):
+        self.read_frame = read_frame
+        self.process = process
+        self.workers = max(1, workers)
+        self.frames = DropOldestQueue(frame_queue_size)
+        self.results = DropOldestQueue(result_queue_size)
+        self.events_of = events
+        self.events = queue.Queue()
+        self.stats = {name: StageStats(name) for name in ("capture", "process", "render", "end_to_end")}
+        self._seq = itertools.count()
+        self._last_rendered_seq = -1
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._capture_loop, name="capture", daemon=True)]
+        self._threads += [threading.Thread(target=self._process_loop, name=f"process-{i}", daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        logger.info("Pipeline started with %d worker(s)", self.workers)
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            try:
+                ret, frame = self.read_frame()
+            except Exception as e:
+                logger.error(f"Error in capture stage: {e}")
+                frame = None
+            if frame is None:
+                time.sleep(0.05)
+                continue
+            self.stats["capture"].record(time.perf_counter() - start)
+            self.frames.put((next(self._seq), start, frame))
+
+    def _process_loop(self):
+        while not self._stop.is_set():
+            item = self.frames.get(timeout=0.1)
+            if item is None:
+                continue
+            seq, captured_at, frame = item
+            start = time.perf_counter()
+            try:
+                result = self.process(frame)
+            except Exception as e:
+                logger.error(f"Error in process stage: {e}")
+                continue
+            self.stats["process"].record(time.perf_counter() - start)
+            if self.events_of is not None:
+                for event in self.events_of(result):
+                    self.events.put(event)
+            self.results.put((seq, captured_at, result))
+
+    def get_result(self):
+        # Newest finished result not older than the last one returned, or None
+        item = None
+        while True:
+            newer = self.results.get_nowait()
+            if newer is None:
+                break
+            item = newer
+        if item is None or item[0] < self._last_rendered_seq:
+            return None
+        seq, captured_at, result = item
+        self._last_rendered_seq = seq
+        self.stats["end_to_end"].record(time.perf_counter() - captured_at)
+        return result
+
+    def get_events(self):
+        # Every event queued since the last call, oldest first
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def record_render(self, seconds):
+        self.stats["render"].record(seconds)
+
+    def snapshot(self):
+        snap = {name: stats.snapshot() for name, stats in self.stats.items()}
+        snap["capture"].update(queue_depth=len(self.frames), dropped=self.frames.dropped)
+        snap["process"].update(queue_depth=len(self.results), dropped=self.results.dropped)
+        return snap
@@ -0,0 +1,86 @@
+# Tk camera preview that reuses one PIL image and one PhotoImage for every frame
+#
+# The old path built Image.fromarray() and a new ImageTk.PhotoImage per frame, i.e. a
+# fresh full-frame image and Tk image 30+ times a second just for display. Here the
+# frame bytes are loaded into a preallocated PIL image and pasted into a persistent
+# PhotoImage in place. Refreshes are capped at max_fps independently of recognition,
+# and nothing is drawn while the window is minimized or withdrawn.
+
+import logging
+import time
+import cv2
+
+from pipeline import StageStats
+
+logger = logging.getLogger(__name__)
+
+#  Preview refreshes per second; recognition runs at its own rate
+PREVIEW_FPS = 15
+
+
+def draw_overlays(frame, boxes, names):
+    for (x1, y1, x2, y2), name in zip(boxes, names):
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        if name is not None:
+            cv2.putText(frame, name, (x1, y2 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+
+
+class PreviewRenderer:
+    def __init__(self, label, max_fps=PREVIEW_FPS):
+        self.label = label
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.hidden = False
+        self._image = None
+        self._photo = None
+        self._last_shown = 0.0
+        self.displayed = 0
+        self.throttled = 0
+        self.hidden_skips = 0
+        # Wall and CPU (Tk thread) time per displayed frame
+        self.wall = StageStats("preview")
+        self.cpu = StageStats("preview_cpu")
+
+    def watch_visibility(self, win):
+        # Stop drawing while the toplevel is unmapped (minimized / withdrawn)
+        def on_map(event, hidden):
+            if event.widget is win:
+                self.hidden = hidden
+        win.bind("<Unmap>", lambda e: on_map(e, True), add="+")
+        win.bind("<Map>", lambda e: on_map(e, False), add="+")
+
+    def due(self, now=None):
+        # Whether a frame should be shown now; counts the ones that are skipped
+        if self.hidden:
+            self.hidden_skips += 1
+            return False
+        now = time.perf_counter() if now is None else now
+        if now - self._last_shown < self.min_interval:
+            self.throttled += 1
+            return False
+        return True
+
+    def _ensure_images(self, width, height):
+        from PIL import Image, ImageTk
+        if self._image is None or self._image.size != (width, height):
+            self._image = Image.new("RGB", (width, height))
+            self._photo = ImageTk.PhotoImage(self._image)
+            self.label.configure(image=self._photo)
+            # Tk only holds the image by name; keep a Python reference alive
+            self.label.imgtk = self._photo
+            logger.info("Preview buffers allocated for %dx%d", width, height)
+
+    def show(self, frame):
+        # frame: contiguous RGB uint8 array
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        height, width = frame.shape[:2]
+        self._ensure_images(width, height)
+        self._image.frombytes(frame.data if frame.flags.c_contiguous else frame.tobytes())
+        self._photo.paste(self._image)
+        self._last_shown = start
+        self.displayed += 1
+        self.wall.record(time.perf_counter() - start)
+        self.cpu.record(time.thread_time() - cpu_start)
+
+    def snapshot(self):
+        return {"displayed": self.displayed, "throttled": self.throttled, "hidden_skips": self.hidden_skips,
+                "avg_ms": round(self.wall.avg_ms, 2), "cpu_ms": round(self.cpu.avg_ms, 2)}
@@ -0,0 +1,53 @@
+# Landmark and 128D descriptor computation for all faces of one or more frames at once
+
+import logging
+import numpy as np
+
+from face_matcher import FEATURE_DIM
+
+logger = logging.getLogger(__name__)
+
+#  Faces pushed through the ResNet in one call
+MAX_DESCRIPTOR_BATCH = 32
+
+
+class BatchDescriber:
+    def __init__(self, predictor, face_reco_model, max_batch=MAX_DESCRIPTOR_BATCH):
+        self.predictor = predictor
+        self.face_reco_model = face_reco_model
+        self.max_batch = max(1, max_batch)
+
+    def landmarks(self, frame, faces):
+        return [self.predictor(frame, face) for face in faces]
+
+    def describe(self, frame, shapes):
+        # (n, 128) float32 descriptors for the landmarked faces of one frame
+        return self.describe_many([frame], [shapes])[0]
+
+    def describe_many(self, frames, shapes_per_frame):
+        # Descriptors for the landmarked faces of several frames. Faces are aligned and
+        # run through the network together, max_batch faces per call, using dlib's
+        # (list of images, list of full_object_detections) overload.
+        import dlib
+        out = [np.zeros((len(shapes), FEATURE_DIM), dtype=np.float32) for shapes in shapes_per_frame]
+        items = [(frame_no, face_no) for frame_no, shapes in enumerate(shapes_per_frame)
+                 for face_no in range(len(shapes))]
+
+        for start in range(0, len(items), self.max_batch):
+            chunk = items[start:start + self.max_batch]
+            batch_frame_nos = []
+            batch_faces = []
+            for frame_no, face_no in chunk:
+                if not batch_frame_nos or batch_frame_nos[-1] != frame_no:
+                    batch_frame_nos.append(frame_no)
+                    batch_faces.append(dlib.full_object_detections())
+                batch_faces[-1].append(shapes_per_frame[frame_no][face_no])
+
+            batch_img = [frames[frame_no] for frame_no in batch_frame_nos]
+            descriptors = self.face_reco_model.compute_face_descriptor(batch_img, batch_faces)
+
+            for frame_no, frame_descriptors in zip(batch_frame_nos, descriptors):
+                first = next(face_no for f, face_no in chunk if f == frame_no)
+                for i, descriptor in enumerate(frame_descriptors):
+                    out[frame_no][first + i] = np.asarray(descriptor, dtype=np.float32)
+        return out
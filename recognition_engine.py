@@ -0,0 +1,327 @@
+# GUI-free detect -> landmark -> describe -> match -> mark engine, usable on cameras,
+# video files, RTSP streams and image folders
+#
+#   python recognition_engine.py --source lecture.mp4 --no-display --max-fps 10 > events.jsonl
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+import cv2
+
+from face_matcher import GalleryMatcher, DISTANCE_THRESHOLD
+from recognition import BatchDescriber, MAX_DESCRIPTOR_BATCH
+from face_tracker import FaceTracker
+from detection import DetectionEngine
+from face_quality import QualityGate
+from metrics import DISABLED, start_metrics, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+#  Frames are processed at the kiosk resolution
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+
+def prepare_frame(frame):
+    # Camera/decoder BGR (or gray) frame -> 640x480 RGB, None if unusable
+    if frame is None or frame.size == 0 or frame.shape[0] == 0 or frame.shape[1] == 0:
+        return None
+    if len(frame.shape) == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    if frame.shape[1] != FRAME_WIDTH or frame.shape[0] != FRAME_HEIGHT:
+        frame = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def iter_source(source):
+    # Yield (timestamp, rgb_frame) from a camera index, video file, stream URL or image folder
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(source, filename)
+                frame = prepare_frame(cv2.imread(path))
+                if frame is not None:
+                    yield datetime.datetime.fromtimestamp(os.path.getmtime(path)), frame
+        return
+
+    is_file = os.path.isfile(source)
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open source {source}")
+    started = datetime.datetime.now()
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = prepare_frame(frame)
+            if frame is None:
+                continue
+            if is_file:
+                # Recorded footage: time relative to the start of the file
+                when = started + datetime.timedelta(milliseconds=cap.get(cv2.CAP_PROP_POS_MSEC))
+            else:
+                when = datetime.datetime.now()
+            yield when, frame
+    finally:
+        cap.release()
+
+
+class RecognitionEngine:
+    def __init__(self, detector, predictor, face_reco_model, matcher=None, store=None,
+                 threshold=DISTANCE_THRESHOLD, max_batch=MAX_DESCRIPTOR_BATCH, metrics=None, quality=None,
+                 events=None):
+        self.predictor = predictor
+        self.matcher = matcher if matcher is not None else GalleryMatcher()
+        # Optional AttendanceStore; without one recognitions are only reported
+        self.store = store
+        # Optional kiosk_client.IngestClient; new marks are also queued for the central server
+        self.events = events
+        self.threshold = threshold
+        self.describer = BatchDescriber(predictor, face_reco_model, max_batch=max_batch)
+        # Downscaled full scans every few frames, ROI search around known faces in between
+        self.detection = DetectionEngine(detector)
+        # Carries identities across frames; process() must not run concurrently
+        self.tracker = FaceTracker()
+        # Skips faces too small, blurred, dark or turned away to be worth a descriptor
+        self.quality = quality if quality is not None else QualityGate.from_env()
+        self.frame_cnt = 0
+        # Per-stage timings and counters; the shared disabled instance costs next to nothing
+        self.metrics = metrics if metrics is not None else DISABLED
+
+    def queue_event(self, name, when, distance):
+        # A failing outbox (locked, disk full) must not cost the rest of the frame
+        try:
+            self.events.add(name, when, distance)
+        except Exception as e:
+            logger.error(f"Error queueing {name} for ingest: {e}")
+            self.metrics.inc("ingest_queue_errors")
+
+    def process(self, frame, when=None):
+        when = when or datetime.datetime.now()
+        metrics = self.metrics
+        with metrics.timer("detect"):
+            faces = self.detection.detect(frame)
+        metrics.inc("frames")
+        metrics.inc("faces_seen", len(faces))
+        boxes = [(face.left(), face.top(), face.right(), face.bottom()) for face in faces]
+        tracks = self.tracker.update(boxes)
+
+        # Only new, unrecognized or stale tracks go through landmarks and the ResNet, and
+        # only if they pass the quality gate; rejected tracks are retried next frame
+        selected = []
+        shapes = []
+        rejected = 0
+        scores = self.detection.last_scores
+        # Per-frame totals, so the predictor stage times only the predictor
+        quality_time = predictor_time = 0.0
+        for i in self.tracker.select(tracks):
+            start = time.perf_counter()
+            reason = self.quality.check_box(frame, boxes[i], scores[i])
+            quality_time += time.perf_counter() - start
+            if reason is None:
+                start = time.perf_counter()
+                try:
+                    shape = self.predictor(frame, faces[i])
+                except Exception as e:
+                    logger.error(f"Error processing face: {e}")
+                    continue
+                finally:
+                    predictor_time += time.perf_counter() - start
+                start = time.perf_counter()
+                reason = self.quality.check_landmarks(shape)
+                quality_time += time.perf_counter() - start
+            if reason is not None:
+                rejected += 1
+                metrics.inc(f"quality_rejected_{reason}")
+                continue
+            shapes.append(shape)
+            selected.append(i)
+        metrics.observe("quality", quality_time)
+        metrics.observe("predictor", predictor_time)
+        metrics.inc("descriptors_saved", rejected)
+
+        # Descriptors for the selected faces in one batched call, matched in one batch
+        if shapes:
+            with metrics.timer("descriptor"):
+                descriptors = self.describer.describe(frame, shapes)
+            with metrics.timer("match"):
+                identities = self.matcher.identify(descriptors, self.threshold)
+        else:
+            identities = []
+        recognitions = []
+        marked = []
+        for i, (name, distance) in zip(selected, identities):
+            changed = self.tracker.set_identity(tracks[i], name, distance)
+            recognitions.append(i)
+            metrics.inc("recognitions" if name is not None else "unknowns")
+            # Attendance is only marked when a track takes on a new identity
+            if changed and name is not None and self.store is not None:
+                try:
+                    with metrics.timer("db_write"):
+                        mark = self.store.mark(name, when)
+                except Exception as e:
+                    logger.error(f"Error marking attendance: {e}")
+                    mark = None
+                if mark is not None:
+                    marked.append((name,) + mark)
+                    if self.events is not None:
+                        self.queue_event(name, when, distance)
+                else:
+                    metrics.inc("db_writes_skipped")
+            elif changed and name is not None and self.events is not None:
+                # No local database; the server keeps the earliest event per day
+                self.queue_event(name, when, distance)
+
+        self.frame_cnt += 1
+        return {
+            "frame": frame,
+            "frame_no": self.frame_cnt - 1,
+            "time": when,
+            "face_count": len(faces),
+            "boxes": boxes,
+            "names": [track.name for track in tracks],
+            "distances": [track.distance for track in tracks],
+            "track_ids": [track.track_id for track in tracks],
+            "recognitions": recognitions,
+            "marked": marked,
+        }
+
+    def run(self, frames, consumers=(), max_fps=None):
+        # Feed (timestamp, frame) pairs through process() and hand every result to
+        # each consumer; returns the number of frames processed
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        start = time.perf_counter()
+        count = 0
+        for when, frame in frames:
+            frame_start = time.perf_counter()
+            result = self.process(frame, when)
+            for consumer in consumers:
+                consumer(result)
+            count += 1
+            if min_interval:
+                time.sleep(max(0.0, min_interval - (time.perf_counter() - frame_start)))
+        elapsed = time.perf_counter() - start
+        logger.info("Processed %d frames in %.1fs (%.1f fps)", count, elapsed, count / elapsed if elapsed else 0.0)
+        return count
+
+
+class JsonLinesWriter:
+    # Consumer writing one JSON object per face whose identity was (re)computed
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+
+    def __call__(self, result):
+        marked = {name for name, _, _ in result["marked"]}
+        for i in result["recognitions"]:
+            name = result["names"][i]
+            distance = result["distances"][i]
+            record = {
+                "time": result["time"].isoformat(timespec="milliseconds"),
+                "frame": result["frame_no"],
+                "track": result["track_ids"][i],
+                "name": name,
+                "distance": round(distance, 4) if distance != float('inf') else None,
+                "box": list(result["boxes"][i]),
+                "marked": name in marked,
+            }
+            self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+
+class OpenCVDisplay:
+    # Consumer showing annotated frames in an OpenCV window; q or Esc stops the run
+    def __init__(self, title="Attendance"):
+        self.title = title
+
+    def __call__(self, result):
+        frame = cv2.cvtColor(result["frame"], cv2.COLOR_RGB2BGR)
+        for (x1, y1, x2, y2), name in zip(result["boxes"], result["names"]):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            if name is not None:
+                cv2.putText(frame, name, (x1, y2 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+        cv2.imshow(self.title, frame)
+        if cv2.waitKey(1) & 0xFF in (ord('q'), 27):
+            raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless face recognition / attendance engine")
+    parser.add_argument('--source', default='0', help="Camera index, video file, rtsp:// URL or image folder")
+    parser.add_argument('--no-display', action='store_true', help="Do not open a preview window")
+    parser.add_argument('--max-fps', type=float, default=None, help="Cap on frames processed per second")
+    parser.add_argument('--output', default='-', help="JSON-lines output file, '-' for stdout")
+    parser.add_argument('--db', default="attendance.db", help="Attendance database to mark")
+    parser.add_argument('--no-db', action='store_true', help="Only report recognitions, do not mark attendance")
+    parser.add_argument('--metrics-port', type=int, nargs='?', const=METRICS_PORT, default=None,
+                        help=f"Serve Prometheus metrics on localhost (default port {METRICS_PORT})")
+    parser.add_argument('--no-watch', action='store_true', help="Do not reload the gallery when it changes")
+    parser.add_argument('--ingest-url', default=os.environ.get("ATTENDANCE_INGEST_URL"),
+                        help="Also send marks to this central /api/ingest endpoint")
+    parser.add_argument('--kiosk-id', default=os.environ.get("ATTENDANCE_KIOSK_ID"),
+                        help="Kiosk name reported to the ingest endpoint (default: host name)")
+    parser.add_argument('--metrics-log', help="Append a JSON metrics snapshot to this file every minute")
+    args = parser.parse_args(argv)
+
+    # Logs go to stderr so stdout stays a clean JSON-lines stream
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    from gallery_watcher import GalleryWatcher, load_matcher
+    from attendance_store import AttendanceStore
+    from model_registry import registry
+    from kiosk_client import IngestClient, OUTBOX_PATH
+
+    # Models load while the gallery is read
+    registry.warm_up()
+
+    matcher = load_matcher()
+    if matcher is None:
+        logger.warning("features_all.gallery / features_all.csv not found!")
+        matcher = GalleryMatcher()
+    logger.info("Loaded %d faces", len(matcher))
+
+    metrics, exporters = DISABLED, []
+    if args.metrics_port or args.metrics_log:
+        metrics, exporters = start_metrics(args.metrics_port, args.metrics_log)
+    store = None if args.no_db else AttendanceStore(args.db, metrics=metrics)
+    events = None
+    if args.ingest_url:
+        events = IngestClient(args.ingest_url, args.kiosk_id, os.environ.get("ATTENDANCE_OUTBOX", OUTBOX_PATH),
+                              token=os.environ.get("ATTENDANCE_INGEST_TOKEN")).start()
+    engine = RecognitionEngine(*registry.models(), matcher, store, metrics=metrics, events=events)
+    watcher = None
+    if not args.no_watch:
+        watcher = GalleryWatcher(engine).start()
+        watcher.install_signal_handler()
+
+    output = sys.stdout if args.output == '-' else open(args.output, "a")
+    consumers = [JsonLinesWriter(output)]
+    if not args.no_display:
+        consumers.append(OpenCVDisplay())
+    try:
+        engine.run(iter_source(args.source), consumers, args.max_fps)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if store is not None:
+            store.close()
+        if events is not None:
+            events.stop()
+        if watcher is not None:
+            watcher.stop()
+        for exporter in exporters:
+            exporter.stop()
+        if output is not sys.stdout:
+            output.close()
+        if not args.no_display:
+            cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# Reporting rollups kept next to the raw attendance table
+#
+#   daily_attendance         date -> headcount, late arrivals, first/last arrival time
+#   person_month_attendance  (name, YYYY-MM) -> days present, late days, first/last
+#                            arrival time, first/last day seen
+#
+# AttendanceStore applies every committed batch to them in the same transaction, so
+# reports never scan the raw table. For a database that predates them (or after
+# changing the late threshold) run the backfill once; a new database needs none:
+#
+#   python rollups.py backfill --db attendance.db --late-after 09:00:00
+
+import argparse
+import datetime
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "attendance.db"
+#  Arrivals after this time of day count as late, unless the database says otherwise
+LATE_AFTER = "09:00:00"
+#  Rows of attendance_changes kept; a viewer further behind drops its whole cache
+CHANGES_KEPT = 1000
+
+
+def create_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_attendance
+                    (date DATE PRIMARY KEY, headcount INTEGER NOT NULL, late_count INTEGER NOT NULL,
+                    first_arrival TEXT, last_arrival TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS person_month_attendance
+                    (name TEXT NOT NULL, month TEXT NOT NULL, days_present INTEGER NOT NULL,
+                    late_days INTEGER NOT NULL, first_arrival TEXT, last_arrival TEXT,
+                    first_date DATE, last_date DATE, PRIMARY KEY (month, name))''')
+    # late_after and built_at; reports refuse to run before the first backfill
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT)")
+    # Past dates rewritten after the fact (kiosk ingest, video_archive.py, a backfill),
+    # so every viewer process can drop the responses it cached for them
+    conn.execute('''CREATE TABLE IF NOT EXISTS attendance_changes
+                    (seq INTEGER PRIMARY KEY AUTOINCREMENT, first_date DATE NOT NULL, last_date DATE NOT NULL)''')
+
+
+def mark_built_if_empty(conn, late=None):
+    # A new (empty) attendance table has nothing to backfill: the rollups, kept up to
+    # date from the first row on, are complete. Call in the transaction creating it.
+    if get_meta(conn, "built_at") is None and conn.execute("SELECT 1 FROM attendance LIMIT 1").fetchone() is None:
+        conn.executemany("INSERT OR IGNORE INTO rollup_meta VALUES (?, ?)",
+                         [("late_after", late or LATE_AFTER),
+                          ("built_at", datetime.datetime.now().isoformat(timespec="seconds"))])
+
+
+def get_meta(conn, key, default=None):
+    try:
+        row = conn.execute("SELECT value FROM rollup_meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return default
+    return row[0] if row else default
+
+
+def late_after(conn):
+    return get_meta(conn, "late_after", LATE_AFTER)
+
+
+def apply_rows(conn, rows, late=None):
+    # Add newly inserted (name, time, date) rows to the rollups. Must run in the
+    # transaction that inserted them, and only for rows that were actually new.
+    if not rows:
+        return
+    late = late or late_after(conn)
+    days = {}
+    months = {}
+    for name, t, day in rows:
+        is_late = int(t > late)
+        d = days.setdefault(day, [0, 0, t, t])
+        d[0] += 1
+        d[1] += is_late
+        d[2], d[3] = min(d[2], t), max(d[3], t)
+        m = months.setdefault((name, day[:7]), [0, 0, t, t, day, day])
+        m[0] += 1
+        m[1] += is_late
+        m[2], m[3] = min(m[2], t), max(m[3], t)
+        m[4], m[5] = min(m[4], day), max(m[5], day)
+
+    conn.executemany(
+        "INSERT INTO daily_attendance VALUES (?, ?, ?, ?, ?) ON CONFLICT(date) DO UPDATE SET "
+        "headcount = headcount + excluded.headcount, late_count = late_count + excluded.late_count, "
+        "first_arrival = min(first_arrival, excluded.first_arrival), "
+        "last_arrival = max(last_arrival, excluded.last_arrival)",
+        [(day,) + tuple(v) for day, v in days.items()])
+    conn.executemany(
+        "INSERT INTO person_month_attendance VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(month, name) DO UPDATE SET "
+        "days_present = days_present + excluded.days_present, late_days = late_days + excluded.late_days, "
+        "first_arrival = min(first_arrival, excluded.first_arrival), "
+        "last_arrival = max(last_arrival, excluded.last_arrival), "
+        "first_date = min(first_date, excluded.first_date), last_date = max(last_date, excluded.last_date)",
+        [(name, month) + tuple(v) for (name, month), v in months.items()])
+
+
+def move_time(conn, name, day, old, new):
+    # Roll up an existing row whose time was moved from `old` to the earlier `new`.
+    # Call after updating the attendance row, in the same transaction.
+    late = late_after(conn)
+    late_delta = int(new > late) - int(old > late)
+    month = day[:7]
+    # Only when the moved row was the latest arrival is the new latest looked up again
+    conn.execute("UPDATE daily_attendance SET late_count = late_count + ?, first_arrival = min(first_arrival, ?), "
+                 "last_arrival = CASE WHEN last_arrival = ? THEN (SELECT max(time) FROM attendance WHERE date = ?) "
+                 "ELSE last_arrival END WHERE date = ?",
+                 (late_delta, new, old, day, day))
+    conn.execute("UPDATE person_month_attendance SET late_days = late_days + ?, first_arrival = min(first_arrival, ?), "
+                 "last_arrival = CASE WHEN last_arrival = ? THEN (SELECT max(time) FROM attendance "
+                 "WHERE name = ? AND date BETWEEN ? AND ?) ELSE last_arrival END WHERE month = ? AND name = ?",
+                 (late_delta, new, old, name) + _month_bounds(month) + (month, name))
+
+
+def record_change(conn, first_date, last_date):
+    # Call in the writing transaction. Only days that are over are cached, so a change
+    # that starts today or later is not recorded.
+    if first_date >= datetime.date.today().strftime('%Y-%m-%d'):
+        return
+    seq = conn.execute("INSERT INTO attendance_changes (first_date, last_date) VALUES (?, ?)",
+                       (first_date, last_date)).lastrowid
+    conn.execute("DELETE FROM attendance_changes WHERE seq <= ?", (seq - CHANGES_KEPT,))
+
+
+def changes_since(conn, seq):
+    # (latest seq, [(first_date, last_date), ...] recorded after seq). The list is None
+    # when changes after seq were already pruned, i.e. anything may have changed.
+    try:
+        if seq is None:
+            (latest,) = conn.execute("SELECT max(seq) FROM attendance_changes").fetchone()
+            return latest or 0, []
+        rows = conn.execute("SELECT seq, first_date, last_date FROM attendance_changes WHERE seq > ? ORDER BY seq",
+                            (seq,)).fetchall()
+    except sqlite3.OperationalError:
+        return seq, []
+    if not rows:
+        return seq, []
+    if rows[0][0] > seq + 1:
+        return rows[-1][0], None
+    return rows[-1][0], [(first, last) for _, first, last in rows]
+
+
+def insert_attendance(conn, rows):
+    # INSERT OR IGNORE the (name, time, date) rows and roll up the ones that were new;
+    # returns those. Call inside a transaction.
+    inserted = []
+    for row in rows:
+        if conn.execute("INSERT OR IGNORE INTO attendance (name, time, date) VALUES (?, ?, ?)", row).rowcount:
+            inserted.append(row)
+    apply_rows(conn, inserted)
+    return inserted
+
+
+def _month_bounds(month):
+    # "2024-02" -> ("2024-02-01", "2024-02-31"); string bounds, so day 31 is fine
+    return month + "-01", month + "-31"
+
+
+def rebuild(conn, dates=None, late=None):
+    # Recompute the rollups from the raw table, for everything or only for the given
+    # dates (and the months they fall in). Call inside a transaction.
+    late = late or late_after(conn)
+    if dates is None:
+        record_change(conn, "0001-01-01", "9999-12-31")
+        conn.execute("DELETE FROM daily_attendance")
+        conn.execute("DELETE FROM person_month_attendance")
+        cursor = conn.execute("SELECT name, time, date FROM attendance ORDER BY date")
+    else:
+        months = sorted({day[:7] for day in dates})
+        if months:
+            record_change(conn, _month_bounds(months[0])[0], _month_bounds(months[-1])[1])
+        for month in months:
+            conn.execute("DELETE FROM daily_attendance WHERE date BETWEEN ? AND ?", _month_bounds(month))
+            conn.execute("DELETE FROM person_month_attendance WHERE month = ?", (month,))
+        cursor = (row for month in months for row in conn.execute(
+            "SELECT name, time, date FROM attendance WHERE date BETWEEN ? AND ?", _month_bounds(month)))
+    count = 0
+    batch = []
+    for row in cursor:
+        batch.append(row)
+        if len(batch) >= 10000:
+            apply_rows(conn, batch, late)
+            count += len(batch)
+            batch = []
+    apply_rows(conn, batch, late)
+    return count + len(batch)
+
+
+def backfill(db_path=DB_PATH, late=None):
+    from attendance_store import connect
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            late = late or late_after(conn)
+            count = rebuild(conn, late=late)
+            conn.executemany("INSERT OR REPLACE INTO rollup_meta VALUES (?, ?)",
+                             [("late_after", late),
+                              ("built_at", datetime.datetime.now().isoformat(timespec="seconds"))])
+    finally:
+        conn.close()
+    return count
+
+
+#  Report queries; they read only the rollup tables
+
+def is_built(conn):
+    return get_meta(conn, "built_at") is not None
+
+
+def daily_report(conn, from_date, to_date):
+    rows = conn.execute("SELECT date, headcount, late_count, first_arrival, last_arrival FROM daily_attendance "
+                        "WHERE date BETWEEN ? AND ? ORDER BY date", (from_date, to_date)).fetchall()
+    return [{"date": d, "headcount": n, "late": late, "first_arrival": first, "last_arrival": last}
+            for d, n, late, first, last in rows]
+
+
+def people_report(conn, from_month, to_month):
+    # Attendance rate over a term: days present / days on which anyone attended
+    low, high = from_month + "-01", to_month + "-31"
+    (class_days,) = conn.execute("SELECT count(*) FROM daily_attendance WHERE date BETWEEN ? AND ?",
+                                 (low, high)).fetchone()
+    rows = conn.execute(
+        "SELECT name, sum(days_present), sum(late_days), min(first_arrival), max(last_arrival), "
+        "min(first_date), max(last_date) FROM person_month_attendance WHERE month BETWEEN ? AND ? "
+        "GROUP BY name ORDER BY name", (from_month, to_month)).fetchall()
+    return class_days, [
+        {"name": name, "days_present": present, "late_days": late,
+         "rate": round(present / class_days, 4) if class_days else None,
+         "first_arrival": first, "last_arrival": last, "first_date": first_date, "last_date": last_date}
+        for name, present, late, first, last, first_date, last_date in rows]
+
+
+def person_report(conn, name, from_month, to_month):
+    rows = conn.execute(
+        "SELECT month, days_present, late_days, first_arrival, last_arrival, first_date, last_date "
+        "FROM person_month_attendance WHERE name = ? AND month BETWEEN ? AND ? ORDER BY month",
+        (name, from_month, to_month)).fetchall()
+    return [{"month": month, "days_present": present, "late_days": late, "first_arrival": first,
+             "last_arrival": last, "first_date": first_date, "last_date": last_date}
+            for month, present, late, first, last, first_date, last_date in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Attendance reporting rollups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backfill", help="Rebuild the rollups from the attendance table")
+    p.add_argument('--db', default=DB_PATH)
+    p.add_argument('--late-after', type=lambda v: datetime.time.fromisoformat(v).strftime('%H:%M:%S'),
+                   default=None, help=f"Arrivals after this time are late (default: as before, else {LATE_AFTER})")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    count = backfill(args.db, args.late_after)
+    logger.info("Rolled up %d attendance rows in %s", count, args.db)
+
+
+if __name__ == '__main__':
+    main()
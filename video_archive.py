@@ -0,0 +1,287 @@
+# Rebuild attendance from recorded doorway footage after a kiosk outage
+#
+#   python video_archive.py recordings/door_20261017_080000.mp4 recordings/door_20261017_120000.mp4 \
+#       --workers 4 --chunk-minutes 10 --stride 5
+#
+# Every file is cut into time ranges that worker processes decode and run through the
+# same RecognitionEngine (detector, predictor, ResNet, 0.4 threshold) as the kiosk,
+# looking at every `stride`-th frame. Chunk results are merged so every (name, date)
+# keeps its earliest sighting, which is what ends up in the `time` column.
+#
+# Finished chunks are appended to a journal; running the same command again after an
+# interruption skips them and only processes what is left.
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import cv2
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = "data/archive_journal.jsonl"
+CHUNK_SECONDS = 600
+#  Process every Nth frame; 5 is 6 frames/s of 30 fps footage, plenty for a doorway
+FRAME_STRIDE = 5
+
+#  Recording start taken from names like door_20261017_080000.mp4 or 2026-10-17T08-00-00.mkv
+_STAMP = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})[T_ -]?(\d{2})[-:.]?(\d{2})[-:.]?(\d{2})")
+
+
+def recording_start(path, duration_s, start=None):
+    # When the first frame was recorded: --start, else a timestamp in the file name,
+    # else the file's mtime (when recording stopped) minus its duration
+    if start is not None:
+        return start
+    match = _STAMP.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime.datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return datetime.datetime.fromtimestamp(os.path.getmtime(path) - duration_s)
+
+
+def plan_chunks(path, chunk_seconds=CHUNK_SECONDS, stride=FRAME_STRIDE, start=None, gallery=""):
+    # List of chunk dicts covering the file; frame ranges are [first, last). gallery is
+    # gallery_store.gallery_version(), so results matched against an older gallery
+    # are not reused after re-enrolling.
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    cap.release()
+    if fps <= 0:
+        logger.warning("%s reports no frame rate, assuming 30 fps", path)
+        fps = 30.0
+    started = recording_start(path, total / fps, start)
+    st = os.stat(path)
+    if total <= 0:
+        # Container without a frame count: one chunk read to the end
+        bounds = [(0, None)]
+    else:
+        step = max(1, int(round(chunk_seconds * fps)))
+        bounds = [(first, min(first + step, total)) for first in range(0, total, step)]
+    chunks = []
+    for first, last in bounds:
+        # Identifies the chunk across runs; changes if the file, the sampling or the
+        # gallery changes
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|"
+                           f"{first}|{last}|{stride}|{gallery}".encode()).hexdigest()[:16]
+        chunks.append({"key": key, "path": path, "first": first, "last": last, "fps": fps,
+                       "stride": stride, "start": started.isoformat()})
+    return chunks
+
+
+class EarliestStore:
+    # Stand-in for AttendanceStore: keeps the first sighting of every (name, date)
+    def __init__(self):
+        self.first_seen = {}
+
+    def mark(self, name, when=None):
+        when = when or datetime.datetime.now()
+        key = (name, when.strftime('%Y-%m-%d'))
+        current_time = when.strftime('%H:%M:%S')
+        if key in self.first_seen and self.first_seen[key] <= current_time:
+            return None
+        self.first_seen[key] = current_time
+        return key[1], current_time
+
+
+def iter_chunk(chunk):
+    # Yield (timestamp, rgb_frame) for every stride-th frame of the chunk. Skipped
+    # frames are only grabbed, not decoded into images.
+    from recognition_engine import prepare_frame
+
+    cap = cv2.VideoCapture(chunk["path"])
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video {chunk['path']}")
+    started = datetime.datetime.fromisoformat(chunk["start"])
+    first, last, stride, fps = chunk["first"], chunk["last"], chunk["stride"], chunk["fps"]
+    try:
+        if first:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+        frame_no = first
+        while last is None or frame_no < last:
+            if (frame_no - first) % stride:
+                if not cap.grab():
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame = prepare_frame(frame)
+                if frame is not None:
+                    yield started + datetime.timedelta(seconds=frame_no / fps), frame
+            frame_no += 1
+    finally:
+        cap.release()
+
+
+#  Worker side. Models come from the registry (shared pages when forked after the
+#  parent warmed them) and the gallery is memory-mapped, so workers start cheaply.
+
+_matcher = None
+
+
+def _init_worker(gallery_path, csv_path):
+    global _matcher
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(processName)s] %(levelname)s %(message)s")
+    from gallery_watcher import load_matcher
+    from face_matcher import GalleryMatcher
+    _matcher = load_matcher(gallery_path, csv_path) or GalleryMatcher()
+
+
+def process_chunk(chunk):
+    from model_registry import registry
+    from recognition_engine import RecognitionEngine
+
+    start = time.perf_counter()
+    store = EarliestStore()
+    engine = RecognitionEngine(*registry.models(), _matcher, store)
+    frames = engine.run(iter_chunk(chunk))
+    return {"key": chunk["key"], "path": chunk["path"], "first": chunk["first"],
+            "frames": frames, "seconds": round(time.perf_counter() - start, 3),
+            "marks": [[name, date, t] for (name, date), t in sorted(store.first_seen.items())]}
+
+
+def load_journal(path):
+    # {chunk key: result} of chunks finished by earlier runs
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Torn last line from an interrupted run; that chunk is simply redone
+                continue
+            done[result["key"]] = result
+    return done
+
+
+def merge_marks(results):
+    # Earliest time per (name, date) over all chunk results
+    earliest = {}
+    for result in results:
+        for name, date, t in result["marks"]:
+            key = (name, date)
+            if key not in earliest or t < earliest[key]:
+                earliest[key] = t
+    return earliest
+
+
+def write_attendance(earliest, db_path):
+    # Insert new rows and move existing ones to an earlier time; later times never win
+    from attendance_store import connect
+    from rollups import rebuild
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO attendance (name, time, date) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, date) DO UPDATE SET time = excluded.time WHERE excluded.time < attendance.time",
+                [(name, t, date) for (name, date), t in sorted(earliest.items())])
+            # Times may have moved earlier, so the affected months are recounted
+            rebuild(conn, {date for _, date in earliest})
+    finally:
+        conn.close()
+
+
+def reconstruct(paths, workers=1, chunk_seconds=CHUNK_SECONDS, stride=FRAME_STRIDE, start=None,
+                journal_path=JOURNAL_PATH, gallery_path=None, csv_path=None):
+    # Process every pending chunk of `paths`; returns ({(name, date): time}, stats)
+    from gallery_store import GALLERY_PATH, CSV_PATH, gallery_version
+    from model_registry import registry
+
+    gallery_path = gallery_path or GALLERY_PATH
+    csv_path = csv_path or CSV_PATH
+    gallery = gallery_version(gallery_path, csv_path)
+    chunks = [chunk for path in paths for chunk in plan_chunks(path, chunk_seconds, stride, start, gallery)]
+    done = load_journal(journal_path)
+    pending = [chunk for chunk in chunks if chunk["key"] not in done]
+    results = [done[chunk["key"]] for chunk in chunks if chunk["key"] in done]
+    if results:
+        logger.info("Resuming: %d of %d chunks already done", len(results), len(chunks))
+
+    os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+    frames = 0
+    start_time = time.perf_counter()
+    with open(journal_path, "a") as journal:
+        def finish(result):
+            nonlocal frames
+            journal.write(json.dumps(result) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            results.append(result)
+            frames += result["frames"]
+            elapsed = time.perf_counter() - start_time
+            logger.info("Chunk %d/%d done (%s @ frame %d): %d frames, %d marks, %.1f frames/sec overall",
+                        len(results), len(chunks), os.path.basename(result["path"]), result["first"],
+                        result["frames"], len(result["marks"]), frames / elapsed if elapsed else 0.0)
+
+        if workers > 1 and len(pending) > 1:
+            if multiprocessing.get_start_method() == "fork":
+                # Load once here so every forked worker shares the models
+                registry.warm_up(background=False)
+            with multiprocessing.Pool(min(workers, len(pending)), initializer=_init_worker,
+                                      initargs=(gallery_path, csv_path)) as pool:
+                for result in pool.imap_unordered(process_chunk, pending):
+                    finish(result)
+        elif pending:
+            _init_worker(gallery_path, csv_path)
+            for chunk in pending:
+                finish(process_chunk(chunk))
+
+    elapsed = time.perf_counter() - start_time
+    stats = {"chunks": len(chunks), "resumed": len(chunks) - len(pending), "frames": frames,
+             "seconds": round(elapsed, 2), "frames_per_s": round(frames / elapsed, 1) if elapsed else 0.0}
+    return merge_marks(results), stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild attendance from recorded video")
+    parser.add_argument('videos', nargs='+', help="Recorded video files")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Worker processes (1 = serial)")
+    parser.add_argument('--chunk-minutes', type=float, default=CHUNK_SECONDS / 60,
+                        help="Length of the time range each worker takes at a time")
+    parser.add_argument('--stride', type=int, default=FRAME_STRIDE, help="Process every Nth frame")
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=None,
+                        help="Wall-clock time of the first frame (ISO format); by default taken "
+                             "from the file name or modification time")
+    parser.add_argument('--journal', default=JOURNAL_PATH, help="Finished chunks, for resuming")
+    parser.add_argument('--restart', action='store_true', help="Forget finished chunks and start over")
+    parser.add_argument('--db', default="attendance.db", help="Attendance database to update")
+    parser.add_argument('--no-db', action='store_true', help="Only print the reconstructed attendance")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format="%(asctime)s [%(processName)s] %(levelname)s %(message)s")
+    if args.start is not None and len(args.videos) > 1:
+        parser.error("--start only makes sense for a single video")
+    if args.restart and os.path.exists(args.journal):
+        os.remove(args.journal)
+
+    earliest, stats = reconstruct(args.videos, args.workers, args.chunk_minutes * 60, max(1, args.stride),
+                                  args.start, args.journal)
+    for (name, date), t in sorted(earliest.items(), key=lambda item: (item[0][1], item[1], item[0][0])):
+        print(f"{date} {t} {name}")
+    if not args.no_db:
+        write_attendance(earliest, args.db)
+    logger.info("%d chunks (%d resumed), %d frames in %.1fs: %.1f frames/sec, %d attendance rows",
+                stats["chunks"], stats["resumed"], stats["frames"], stats["seconds"],
+                stats["frames_per_s"], len(earliest))
+
+
+if __name__ == '__main__':
+    main()